@@ -19,12 +19,17 @@ setup(
     author_email='eric@pobot.org',
     url='http://www.pobot.org',
     install_requires=['pybot-core', 'spidev', 'RPi.GPIO'],
+    extras_require={
+        'numpy': ['numpy']
+    },
     download_url='https://github.com/Pobot/PyBot',
     packages=find_packages("src"),
     package_dir={'': 'src'},
     entry_points={
         'console_scripts': [
-            'dspin-demo = pybot.dspin.demo:main'
+            'dspin-demo = pybot.dspin.demo:main',
+            'dspin-bench = pybot.dspin.bench:main',
+            'dspin-server = pybot.dspin.server:main'
         ]
     }
 )
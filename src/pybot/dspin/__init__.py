@@ -5,19 +5,33 @@ from pybot.core import log
 
 pkg_log = log.getLogger(__name__)
 
-try:
-    import RPi.GPIO as GPIO
-    real_raspi = True
+import os
 
-except (ImportError, RuntimeError):
-    # import a dummy module simulating the real API so that
-    # IDEs can help us
-    pkg_log.warn("not running on a RasPi")
-    import fake_gpio as GPIO
+if os.environ.get('PYBOT_DSPIN_EMULATOR'):
+    # use the behavioral emulation of the hardware
+    from . import emulator
+    emulator.configure(
+        chain_length=int(os.environ['PYBOT_DSPIN_EMULATOR']),
+        time_scale=float(os.environ.get('PYBOT_DSPIN_EMULATOR_TIME_SCALE', 1))
+    )
+    pkg_log.info("using the dSPIN emulator")
+    GPIO = emulator.GPIO
+    spidev = emulator
     real_raspi = False
 
-
-if real_raspi:
-    import spidev
 else:
-    import fake_spidev as spidev
+    try:
+        import RPi.GPIO as GPIO
+        real_raspi = True
+
+    except (ImportError, RuntimeError):
+        # import a dummy module simulating the real API so that
+        # IDEs can help us
+        pkg_log.warn("not running on a RasPi")
+        from . import fake_gpio as GPIO
+        real_raspi = False
+
+    if real_raspi:
+        import spidev
+    else:
+        from . import fake_spidev as spidev
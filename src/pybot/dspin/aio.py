@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+
+""" asyncio interface of the dSPIN devices.
+
+:py:class:`AsyncDSPIN` and :py:class:`AsyncDaisyChain` wrap a :py:class:`DSPIN` or
+a :py:class:`DaisyChain` instance, and expose coroutine versions of their methods.
+Motion commands resolve when the move is complete, which makes it possible to drive
+many axes from a single event loop without dedicating a thread to each of them::
+
+    x, y = AsyncDSPIN(dspin_x), AsyncDSPIN(dspin_y)
+    await asyncio.gather(x.goto(1000), y.goto(-500))
+
+The SPI transactions are executed by a single thread executor per SPI device (the
+bus executor), so that they are never run concurrently on the same bus and never
+block the event loop. Move completion is detected by watching the BUSYN signal, or by
+polling the BUSY flag of the STATUS register when the signal is not wired.
+
+This module requires Python 3.7 or later.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import threading
+import weakref
+
+from . import GPIO, pkg_log
+from .core import DSPIN, BusynWatcher, CommandTimeOut
+from .defs import Register, Status
+from .snapshot import as_register
+from .telemetry import DEFAULT_REGISTERS
+
+__author__ = 'Eric Pascual'
+
+_bus_executors = weakref.WeakKeyDictionary()
+_bus_executors_lock = threading.Lock()
+
+
+def bus_executor(spi):
+    """ Returns the executor in charge of the transactions of an SPI device, creating it
+    if needed.
+
+    :param DSPinSpiDev spi: the SPI device
+    :rtype: concurrent.futures.Executor
+    """
+    with _bus_executors_lock:
+        try:
+            return _bus_executors[spi]
+        except KeyError:
+            executor = _bus_executors[spi] = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dspin-bus')
+            return executor
+
+
+# BUSYN rising edges notification, relayed from the watcher of the pin (see BusynWatcher).
+# The events of the coroutines waiting for a given pin are stored with their loop,
+# since the GPIO callbacks are invoked in a foreign thread.
+_busyn_waiters = {}
+_busyn_waiters_lock = threading.Lock()
+
+
+def _busyn_edge_detected(pin):
+    with _busyn_waiters_lock:
+        waiters = list(_busyn_waiters.get(pin, ()))
+    for loop, event in waiters:
+        loop.call_soon_threadsafe(event.set)
+
+
+def _watch_busyn(pin):
+    """ Sets the BUSYN edge detection on a pin if possible.
+
+    :return: True if the edges are notified, False if the signal must be polled
+    """
+    with _busyn_waiters_lock:
+        if pin in _busyn_waiters:
+            return True
+        watcher = BusynWatcher.get(pin)
+        if watcher is None:
+            return False
+        watcher.add_callback(_busyn_edge_detected)
+        _busyn_waiters[pin] = set()
+        return True
+
+
+class TelemetryStream(object):
+    """ Asynchronous iterator over telemetry samples, provided as tuples (timestamp, snapshot).
+
+    Samples are buffered in a bounded queue. If the consumer does not keep pace, the
+    oldest ones are dropped, and counted in :py:attr:`dropped`.
+    """
+    _END = object()
+
+    def __init__(self, maxsize=100):
+        """
+        :param int maxsize: the maximum number of buffered samples
+        """
+        self._queue = asyncio.Queue(maxsize)
+        self._closers = []
+        self._closed = False
+        #: the number of samples dropped because of buffer overflow
+        self.dropped = 0
+
+    def _push(self, item):
+        if self._closed:
+            return
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(item)
+
+    def _on_close(self, closer):
+        self._closers.append(closer)
+
+    def close(self):
+        """ Stops the stream. The pending samples can still be consumed.
+        """
+        if self._closed:
+            return
+        for closer in self._closers:
+            closer()
+        self._push(self._END)
+        self._closed = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed and self._queue.empty():
+            raise StopAsyncIteration
+        item = await self._queue.get()
+        if item is self._END:
+            raise StopAsyncIteration
+        return item
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncDSPIN(object):
+    """ asyncio wrapper of a :py:class:`DSPIN` instance.
+
+    Unless stated otherwise, the methods accept the same parameters as their synchronous
+    counterparts, the `wait_cb` callback of the motion commands excepted.
+    """
+    #: BUSYN polling period, when edge detection is not available (seconds)
+    BUSYN_POLL_PERIOD = 0.002
+    #: BUSYN checking period, when edge detection is used, in case an edge was missed (seconds)
+    BUSYN_WATCH_PERIOD = 0.1
+    #: the initial and the maximum STATUS polling periods (seconds)
+    STATUS_POLL_PERIODS = (0.002, 0.05)
+
+    def __init__(self, dspin, executor=None, completion=None, logger=None):
+        """
+        :param DSPIN dspin: the wrapped device
+        :param concurrent.futures.Executor executor: the executor running the bus transactions
+        (default: the one shared by all the devices using the same SPI device)
+        :param str completion: the move completion detection method ('busyn' or 'status'). By default,
+        the BUSYN signal is used if wired.
+        :param logger: optional logger. If None, a new one will be created
+        """
+        if completion not in (None, 'busyn', 'status'):
+            raise ValueError('invalid completion method (%s)' % completion)
+
+        self.dspin = dspin
+        self._executor = executor or bus_executor(dspin._spi)
+        self._completion = completion or ('busyn' if dspin._busyn_pin is not None else 'status')
+        self.logger = logger or pkg_log.getChild(self.__class__.__name__)
+
+    async def run_in_bus(self, func, *args, **kwargs):
+        """ Executes a function in the bus executor and returns its result.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    # registers access
+
+    async def read_register(self, reg):
+        return await self.run_in_bus(self.dspin.read_register, as_register(reg))
+
+    async def write_register(self, reg, value):
+        await self.run_in_bus(self.dspin.write_register, as_register(reg), value)
+
+    async def read_registers(self, regs=None):
+        return await self.run_in_bus(self.dspin.read_registers, regs)
+
+    async def get_status(self):
+        return await self.run_in_bus(self.dspin.get_status)
+
+    async def clear_status(self, *args):
+        await self.run_in_bus(self.dspin.clear_status, *args)
+
+    # motion commands
+
+    async def _motion(self, method, args, kwargs, wait, timeout):
+        await self.run_in_bus(method, *args, wait=False, **kwargs)
+        if wait:
+            await self.wait_for_move_complete(timeout)
+
+    async def move(self, *args, wait=True, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT, **kwargs):
+        await self._motion(self.dspin.move, args, kwargs, wait, timeout)
+
+    async def goto(self, *args, wait=True, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT, **kwargs):
+        await self._motion(self.dspin.goto, args, kwargs, wait, timeout)
+
+    async def goto_dir(self, *args, wait=True, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT, **kwargs):
+        await self._motion(self.dspin.goto_dir, args, kwargs, wait, timeout)
+
+    async def go_home(self, *args, wait=True, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT, **kwargs):
+        await self._motion(self.dspin.go_home, args, kwargs, wait, timeout)
+
+    async def go_mark(self, *args, wait=True, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT, **kwargs):
+        await self._motion(self.dspin.go_mark, args, kwargs, wait, timeout)
+
+    async def go_until(self, *args, wait=True, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT, **kwargs):
+        await self._motion(self.dspin.go_until, args, kwargs, wait, timeout)
+
+    async def release_sw(self, *args, wait=True, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT, **kwargs):
+        await self._motion(self.dspin.release_sw, args, kwargs, wait, timeout)
+
+    async def soft_stop(self, *args, wait=True, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT, **kwargs):
+        await self._motion(self.dspin.soft_stop, args, kwargs, wait, timeout)
+
+    async def soft_hi_Z(self, *args, wait=True, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT, **kwargs):
+        await self._motion(self.dspin.soft_hi_Z, args, kwargs, wait, timeout)
+
+    async def run(self, *args, **kwargs):
+        await self.run_in_bus(self.dspin.run, *args, **kwargs)
+
+    async def step_clock(self, *args):
+        await self.run_in_bus(self.dspin.step_clock, *args)
+
+    async def hard_stop(self, *args):
+        await self.run_in_bus(self.dspin.hard_stop, *args)
+
+    async def hard_hi_Z(self, *args):
+        await self.run_in_bus(self.dspin.hard_hi_Z, *args)
+
+    async def reset_pos(self, *args):
+        await self.run_in_bus(self.dspin.reset_pos, *args)
+
+    # move completion
+
+    async def wait_for_move_complete(self, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT):
+        """ Waits until the current move is complete.
+
+        :param float timeout: the max wait time in seconds
+        :raise: CommandTimeOut if the move is not complete in time
+        """
+        await self._wait(timeout, None)
+
+    async def _wait(self, timeout, devices):
+        if self._completion == 'busyn' and hasattr(GPIO, 'FAKE'):
+            self.logger.warn('not on a real RasPi => bypassing wait_for_move_complete')
+            return
+
+        time_limit = asyncio.get_running_loop().time() + timeout
+        try:
+            if self._completion == 'busyn':
+                await self._wait_busyn_release(time_limit)
+            else:
+                await self._wait_status_ready(time_limit, devices)
+        except CommandTimeOut:
+            self.logger.error('timeout reached (%s seconds)', timeout)
+            raise
+
+    async def _wait_busyn_release(self, time_limit):
+        loop = asyncio.get_running_loop()
+        pin = self.dspin._busyn_pin
+        if not _watch_busyn(pin):
+            while GPIO.input(pin) == GPIO.LOW:
+                remaining = time_limit - loop.time()
+                if remaining <= 0:
+                    raise CommandTimeOut()
+                await asyncio.sleep(min(remaining, self.BUSYN_POLL_PERIOD))
+            return
+
+        event = asyncio.Event()
+        waiter = (loop, event)
+        with _busyn_waiters_lock:
+            _busyn_waiters[pin].add(waiter)
+        try:
+            while True:
+                # cleared before checking the level, so that an edge occurring in between
+                # is not lost
+                event.clear()
+                if GPIO.input(pin) != GPIO.LOW:
+                    break
+                remaining = time_limit - loop.time()
+                if remaining <= 0:
+                    raise CommandTimeOut()
+                try:
+                    await asyncio.wait_for(event.wait(), min(remaining, self.BUSYN_WATCH_PERIOD))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with _busyn_waiters_lock:
+                _busyn_waiters[pin].discard(waiter)
+
+    async def _wait_status_ready(self, time_limit, devices):
+        # the polling period is doubled at each iteration, since a move which is not
+        # complete shortly is likely to last
+        loop = asyncio.get_running_loop()
+        period, max_period = self.STATUS_POLL_PERIODS
+        while True:
+            snapshot = await self.run_in_bus(self.dspin.read_registers, (Register.STATUS,))
+            status = snapshot[Register.STATUS]
+            if devices is not None:
+                status = [status[d] for d in devices]
+            # BUSY flag is active low
+            if all(s & Status.BUSY for s in status):
+                return
+            remaining = time_limit - loop.time()
+            if remaining <= 0:
+                raise CommandTimeOut()
+            await asyncio.sleep(min(remaining, period))
+            period = min(period * 2, max_period)
+
+    # telemetry
+
+    def telemetry(self, registers=DEFAULT_REGISTERS, period=0.01, sampler=None, maxsize=100):
+        """ Returns an asynchronous iterator over register samples::
+
+            async with axis.telemetry(period=0.05) as stream:
+                async for timestamp, snapshot in stream:
+                    ...
+
+        The samples are either acquired by the stream itself, using the bus executor,
+        or provided by a :py:class:`TelemetrySampler` running in its own thread.
+
+        :param iterable registers: the sampled registers (ignored if a sampler is provided)
+        :param float period: the sampling period in seconds (ignored if a sampler is provided)
+        :param TelemetrySampler sampler: an optional sampler providing the samples
+        :param int maxsize: the maximum number of buffered samples
+        :rtype: TelemetryStream
+        """
+        loop = asyncio.get_running_loop()
+        stream = TelemetryStream(maxsize)
+
+        if sampler is not None:
+            def on_sample(timestamp, snapshot):
+                loop.call_soon_threadsafe(stream._push, (timestamp, snapshot))
+
+            sampler.subscribe(on_sample)
+            stream._on_close(lambda: sampler.unsubscribe(on_sample))
+
+        else:
+            registers = tuple(as_register(r) for r in registers)
+
+            async def sample():
+                next_time = loop.time()
+                while True:
+                    snapshot = await self.run_in_bus(self.dspin.read_registers, registers)
+                    stream._push((loop.time(), snapshot))
+                    next_time += period
+                    await asyncio.sleep(max(next_time - loop.time(), 0))
+
+            task = loop.create_task(sample())
+            stream._on_close(task.cancel)
+
+        return stream
+
+
+class AsyncDaisyChain(AsyncDSPIN):
+    """ asyncio wrapper of a :py:class:`DaisyChain` instance.
+
+    When the completion is detected with the STATUS register, the BUSY flags of all the
+    devices are read in a single transaction, and the wait can be restricted to some of them.
+    """
+    def __len__(self):
+        return len(self.dspin)
+
+    async def wait_for_move_complete(self, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT, devices=None):
+        """ Waits until the current moves are complete.
+
+        :param float timeout: the max wait time in seconds
+        :param iterable devices: the positions of the devices to wait for (default: all). They
+        can be selected only when the completion is detected with the STATUS register.
+        :raise: CommandTimeOut if the moves are not complete in time
+        """
+        await self._wait(timeout, tuple(devices) if devices is not None else None)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+""" Arbitration of the access to a SPI bus shared by several threads.
+
+Each transaction (a request and its reply, or a complete chain frame) is executed while
+holding the lock of the :py:class:`DSPinSpiDev`, which is a :py:class:`BusLock`. When
+several threads compete for the bus, the lock is granted by order of priority, and then
+of arrival. This way, a stop command issued while the telemetry sampler and some command
+threads are queued waits only for the completion of the transaction in progress.
+
+Priorities are set per thread, either for its whole life::
+
+    set_thread_priority(Priority.BACKGROUND)
+
+or for a block of code::
+
+    with thread_priority(Priority.URGENT):
+        chain.hard_stop()
+
+Stop commands (:py:meth:`DSPIN.hard_stop`, :py:meth:`DSPIN.soft_stop`,...) are
+automatically sent with the URGENT priority, and the telemetry sampler runs with the
+BACKGROUND one.
+
+The lock keeps statistics about the waits, per priority, for sizing the polling
+rates of the background activities (see :py:meth:`BusLock.stats`).
+"""
+
+from contextlib import contextmanager
+from heapq import heappush, heappop
+import itertools
+import threading
+
+try:
+    from threading import get_ident
+except ImportError:
+    from thread import get_ident
+
+from .metrics import clock
+
+__author__ = 'Eric Pascual'
+
+
+class Priority(object):
+    """ The priority classes of the bus accesses, the lower the more urgent.
+    """
+    URGENT = 0
+    COMMAND = 1
+    BACKGROUND = 2
+
+    ALL = ('URGENT', 'COMMAND', 'BACKGROUND')
+
+_local = threading.local()
+
+
+def get_thread_priority():
+    """ Returns the priority of the bus accesses of the current thread. """
+    return getattr(_local, 'priority', Priority.COMMAND)
+
+
+def set_thread_priority(priority):
+    """ Sets the priority of the bus accesses of the current thread.
+
+    :param int priority: one of the :py:class:`Priority` classes
+    """
+    if priority not in (Priority.URGENT, Priority.COMMAND, Priority.BACKGROUND):
+        raise ValueError('invalid priority (%s)' % priority)
+    _local.priority = priority
+
+
+@contextmanager
+def thread_priority(priority):
+    """ Context manager changing the priority of the bus accesses of the current thread
+    for the duration of a block.
+    """
+    previous = get_thread_priority()
+    set_thread_priority(priority)
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+class BusLock(object):
+    """ A re-entrant lock, granted by order of priority and arrival when contended.
+
+    When released, the lock is handed over directly to the first waiter, which prevents
+    newcomers from overtaking the queued threads.
+    """
+    def __init__(self):
+        # the bus itself, and the mutex protecting the waiters queue
+        self._bus = threading.Lock()
+        self._mutex = threading.Lock()
+        self._owner = None
+        self._count = 0
+        self._waiters = []
+        self._seq = itertools.count()
+
+        n = len(Priority.ALL)
+        self._acquisitions = 0
+        self._contended = [0] * n
+        self._wait_total = [0.] * n
+        self._wait_max = [0.] * n
+
+        #: optional histograms of the contended waits, one per priority (see :py:mod:`metrics`)
+        self.wait_histograms = None
+
+    def acquire(self, priority=None):
+        """ Acquires the lock.
+
+        :param int priority: the priority of the request if it has to wait (default: the one
+        of the current thread)
+        """
+        me = get_ident()
+        if self._owner == me:
+            self._count += 1
+            return True
+
+        # fast path: the bus being handed over while still held, it can be free only if
+        # nobody is waiting
+        if self._bus.acquire(False):
+            self._owner, self._count = me, 1
+            self._acquisitions += 1
+            return True
+
+        if priority is None:
+            priority = getattr(_local, 'priority', Priority.COMMAND)
+        with self._mutex:
+            if self._bus.acquire(False):
+                self._owner, self._count = me, 1
+                self._acquisitions += 1
+                return True
+            # queue up, and wait for the bus to be handed over
+            gate = threading.Lock()
+            gate.acquire()
+            heappush(self._waiters, (priority, next(self._seq), me, gate))
+
+        start = clock()
+        gate.acquire()
+        wait = clock() - start
+
+        self._acquisitions += 1
+        self._contended[priority] += 1
+        self._wait_total[priority] += wait
+        if wait > self._wait_max[priority]:
+            self._wait_max[priority] = wait
+        histograms = self.wait_histograms
+        if histograms is not None:
+            histograms[priority].observe(wait)
+        return True
+
+    def release(self):
+        if self._owner != get_ident():
+            raise RuntimeError('cannot release un-acquired lock')
+        self._count -= 1
+        if self._count:
+            return
+        with self._mutex:
+            if self._waiters:
+                _, _, owner, gate = heappop(self._waiters)
+                self._owner, self._count = owner, 1
+                gate.release()
+            else:
+                self._owner = None
+                self._bus.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def waiting(self):
+        """ Returns the number of threads waiting for the lock. """
+        return len(self._waiters)
+
+    def stats(self):
+        """ Returns the waits statistics.
+
+        :return: a dictionary giving the total number of acquisitions, and for each priority a
+        dictionary giving the number of acquisitions which had to wait, and the total and max
+        wait times (seconds)
+        :rtype: dict
+        """
+        result = dict(
+            (name, {
+                'contended': self._contended[i],
+                'wait_total': self._wait_total[i],
+                'wait_max': self._wait_max[i],
+            })
+            for i, name in enumerate(Priority.ALL)
+        )
+        result['acquisitions'] = self._acquisitions
+        return result
+
+    def reset_stats(self):
+        n = len(Priority.ALL)
+        self._acquisitions = 0
+        self._contended = [0] * n
+        self._wait_total = [0.] * n
+        self._wait_max = [0.] * n
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+
+""" Per axis views of the devices of a daisy-chain.
+
+An :py:class:`AxisProxy` has the same API as a single :py:class:`DSPIN`, and addresses a
+given device of a :py:class:`DaisyChain`. This way, code written per axis can be used
+as is with chained devices::
+
+    x, y, z = chain.axes()
+    x.goto(1000)                # in a thread
+    y.run(Direction.FWD, 400)   # in another one
+
+The requests of the proxies are not sent separately: the :py:class:`FrameCoalescer` of the
+chain gathers the requests issued by several threads within a short window (see
+:py:attr:`FrameCoalescer.window`) and merges them into shared chain frames, the replies being
+routed back to each caller. Several requests of the same device are sent in successive
+frames of the same burst, in their issuing order.
+
+Inside an explicit batch, the requests which do not return anything useful (commands and
+register writes) are queued without waiting, and sent together when the batch exits::
+
+    with chain.batch():
+        x.MAX_SPEED = max_spd_calc(800)
+        y.MAX_SPEED = max_spd_calc(400)
+        x.goto(1000, wait=False)
+        y.goto(-500, wait=False)
+
+A register read or a status request issued inside the batch flushes the requests queued
+so far, since its reply is needed. Stop commands are never delayed: requests issued with
+the URGENT priority (see :py:mod:`arbiter`) are sent immediately.
+"""
+
+from contextlib import contextmanager
+import threading
+import time
+
+from . import commands, metrics
+from .arbiter import BusLock, Priority, get_thread_priority
+from .core import DSPIN, CommandTimeOut, UnsupportedOperation
+from .defs import Status
+
+__author__ = 'Eric Pascual'
+
+
+class _PendingRequest(object):
+    __slots__ = ('device', 'request', 'event', 'reply', 'error')
+
+    def __init__(self, device, request):
+        self.device = device
+        self.request = request
+        self.event = threading.Event()
+        self.reply = self.error = None
+
+
+class FrameCoalescer(object):
+    """ Merges the requests sent to the devices of a chain by several callers into shared
+    frames.
+
+    The first caller of a burst waits for the coalescing window to expire, and then sends
+    all the requests issued meanwhile, the other callers just waiting for their reply.
+    """
+    #: the default coalescing window (seconds)
+    WINDOW = 0.0005
+
+    def __init__(self, chain, window=WINDOW):
+        """
+        :param DaisyChain chain: the chain
+        :param float window: how long requests are gathered before being sent (seconds). If
+        0, only the requests issued while the previous burst is being sent are merged.
+        """
+        self._chain = chain
+        self.window = window
+        self._mutex = threading.Lock()
+        # serializes the bursts, so that the requests of a device are sent in order
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._scheduled = False
+        self._local = threading.local()
+
+        #: the number of frames sent
+        self.frames = 0
+        #: the number of requests they contained
+        self.requests = 0
+
+    def stats(self):
+        """ Returns the coalescing statistics.
+
+        :return: a dictionary giving the number of frames and requests, and the average number
+        of requests per frame
+        :rtype: dict
+        """
+        return {
+            'frames': self.frames,
+            'requests': self.requests,
+            'requests_per_frame': float(self.requests) / self.frames if self.frames else 0.,
+        }
+
+    @property
+    def in_batch(self):
+        """ Tells if the current thread is inside a batch. """
+        return getattr(self._local, 'deferred', None) is not None
+
+    @contextmanager
+    def batch(self):
+        """ Context manager deferring the requests which do not need their reply up to the
+        end of the block. Batches can be nested, the requests being sent when the outermost
+        one exits.
+
+        If the block raises an exception, the requests already queued are sent anyway, since
+        the other threads' ones may be part of the same burst.
+
+        :raise: the error of the first failed request, if any
+        """
+        if self.in_batch:
+            yield
+            return
+        self._local.deferred = deferred = []
+        try:
+            yield
+        finally:
+            self._local.deferred = None
+            if deferred:
+                self.flush()
+        for pending in deferred:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+
+    def submit(self, device, request):
+        """ Sends a request to a device, merged with the other pending ones.
+
+        :param int device: the device position
+        :param request: the request bytes
+        :return: the reply bytes. Inside a batch, the requests not needing their reply
+        return immediately, and their reply is made of zeros.
+        :raise: the error of the transfer, if it failed
+        """
+        pending = _PendingRequest(device, request)
+        deferred = getattr(self._local, 'deferred', None)
+        defer = deferred is not None and not commands.OpCodes.expects_reply(request[0])
+        with self._mutex:
+            self._pending.append(pending)
+            if defer:
+                deferred.append(pending)
+                return bytearray(len(request))
+            lead = not self._scheduled
+            self._scheduled = True
+
+        if lead:
+            if self.window and deferred is None:
+                time.sleep(self.window)
+            self._flush()
+        pending.event.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.reply
+
+    def send_now(self, device, request):
+        """ Sends a request to a device immediately, without waiting for the pending ones.
+
+        :return: the reply bytes
+        """
+        chain = self._chain
+        requests = [None] * chain.device_count
+        requests[device] = request
+        return chain._xfer(requests)[device]
+
+    def flush(self):
+        """ Sends the pending requests.
+        """
+        with self._mutex:
+            self._scheduled = True
+        self._flush()
+
+    def _flush(self):
+        with self._flush_lock:
+            with self._mutex:
+                pending, self._pending = self._pending, []
+                self._scheduled = False
+            if not pending:
+                return
+
+            # each device gets its requests in successive frames
+            frames, next_frame = [], {}
+            for p in pending:
+                i = next_frame.get(p.device, 0)
+                next_frame[p.device] = i + 1
+                if i == len(frames):
+                    frames.append([None] * self._chain.device_count)
+                frames[i][p.device] = p
+
+            chain = self._chain
+            sent = 0
+            try:
+                with chain._spi.lock:
+                    for frame in frames:
+                        replies = chain._xfer([p.request if p else None for p in frame])
+                        sent += 1
+                        for p, reply in zip(frame, replies):
+                            if p is not None:
+                                p.reply = reply
+                                p.event.set()
+            except Exception as e:
+                # release the callers of the requests not sent
+                for frame in frames[sent:]:
+                    for p in frame:
+                        if p is not None:
+                            p.error = e
+                            p.event.set()
+            finally:
+                self.frames += sent
+                self.requests += sum(len(frame) - frame.count(None) for frame in frames[:sent])
+
+
+class _DeviceShadow(object):
+    """ The view of the registers shadow of a chain restricted to one of its devices. """
+    def __init__(self, shadow, device):
+        self._shadow = shadow
+        self._device = device
+
+    def is_current(self, _, reg, value):
+        return self._shadow.is_current(self._device, reg, value)
+
+    def update(self, _, reg, value):
+        self._shadow.update(self._device, reg, value)
+
+    def get(self, _, reg):
+        return self._shadow.get(self._device, reg)
+
+    def invalidate(self, devices=None):
+        self._shadow.invalidate([self._device])
+
+
+class _CoalescedSpi(object):
+    """ The SPI device of an :py:class:`AxisProxy`, which submits the transfers to the
+    frame coalescer of the chain.
+    """
+    BUFFER_SIZE = 256
+
+    def __init__(self, coalescer, device):
+        self._coalescer = coalescer
+        self._device = device
+        self.tx_buffer = bytearray(self.BUFFER_SIZE)
+        self.rx_buffer = bytearray(self.BUFFER_SIZE)
+        #: protects the transfer buffers
+        self.lock = BusLock()
+
+    def open(self):
+        pass
+
+    def xfer(self, values=None):
+        request = bytearray(values)
+        if get_thread_priority() == Priority.URGENT:
+            return list(self._coalescer.send_now(self._device, request))
+        return list(self._coalescer.submit(self._device, request))
+
+    xfer2 = xfer
+
+    def xfer_buffer(self, length, seg_len=1):
+        with self.lock:
+            self.rx_buffer[:length] = self.xfer(self.tx_buffer[:length])
+            return self.rx_buffer
+
+
+class AxisProxy(DSPIN):
+    """ A device of a daisy-chain, with the same API as a single one.
+
+    The devices are initialized and put in standby through the chain, and the
+    corresponding methods are thus not available. The BUSYN signal being shared by the
+    devices of the chain, the moves completion is detected by polling the STATUS register.
+    The registers shadow of the chain is used if enabled.
+    """
+    def __init__(self, chain, device, logger=None):
+        """
+        :param DaisyChain chain: the chain
+        :param int device: the device position
+        :param logger: optional logger. If None, a new one will be created
+        """
+        if not 0 <= device < chain.device_count:
+            raise ValueError('invalid device (%d)' % device)
+        self.chain = chain
+        self.device = device
+        super(AxisProxy, self).__init__(_CoalescedSpi(chain.coalescer, device), None, None, logger=logger)
+        self.shadow = _DeviceShadow(chain.shadow, device) if chain.shadow is not None else None
+
+    def power_on_reset(self):
+        raise UnsupportedOperation('devices are reset by the chain')
+
+    def initialize(self):
+        """ Does nothing, since the devices are initialized by the chain.
+
+        :return: True
+        """
+        return True
+
+    def standby(self):
+        raise UnsupportedOperation('the standby signal is shared by the chain')
+
+    def awake(self):
+        raise UnsupportedOperation('the standby signal is shared by the chain')
+
+    def shutdown(self):
+        """ Stops the motor and puts the bridge in HiZ state. The device is not put in standby.
+        """
+        self.clear_status()
+        self.hard_hi_Z()
+
+    def emergency_stop(self, hi_z=False, triggered_at=None):
+        """ Stops this device immediately, without waiting for the pending requests.
+
+        As for :py:meth:`DSPIN.emergency_stop`, the transactions in progress are bypassed:
+        the frame is written straight on the bus of the chain.
+        """
+        start = metrics.clock() if triggered_at is None else triggered_at
+        request = commands.HARD_HIZ_REQUEST if hi_z else commands.HARD_STOP_REQUEST
+        length = self.chain.device_count
+        spi = self.chain._spi
+        spi.lock.acquire(Priority.URGENT)
+        try:
+            # the other devices get NOPs
+            spi.tx_buffer[:length] = bytearray(length)
+            spi.tx_buffer[self.device] = request[0]
+            spi.xfer_buffer(length, length)
+        finally:
+            spi.lock.release()
+        latency = self.last_stop_latency = metrics.clock() - start
+        if self.metrics is not None:
+            self.metrics.stop_latency.observe(latency)
+        return latency
+
+    def is_moving(self):
+        return not self.STATUS & Status.BUSY
+
+    def wait_for_move_complete(self, callback=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT, expected_duration=None):
+        """ See :py:meth:`DSPIN.wait_for_move_complete`.
+
+        The BUSY flag of the STATUS register is polled every :py:attr:`WAIT_POLL_PERIOD`
+        seconds, the polls of the axes waiting concurrently being merged in the same frames.
+        """
+        self.logger.info('wait for move completion... (%s callback)', 'with' if callback else 'no')
+        started = metrics.clock()
+        now = time.time()
+        time_limit = now + timeout
+
+        if expected_duration is not None:
+            wake_up = min(now + expected_duration - self.PRE_COMPLETION_MARGIN, time_limit)
+            while now < wake_up:
+                if callback and callback(self):
+                    self.logger.debug('callback returned True')
+                    return
+                time.sleep(min(wake_up - now, self.WAIT_CB_PERIOD))
+                now = time.time()
+
+        next_callback = time.time() + self.WAIT_CB_PERIOD
+        while not self.STATUS & Status.BUSY:
+            now = time.time()
+            if callback and now >= next_callback:
+                if callback(self):
+                    self.logger.debug('callback returned True')
+                    return
+                next_callback = now + self.WAIT_CB_PERIOD
+            if now >= time_limit:
+                self.logger.error('timeout reached (%s seconds)', timeout)
+                if self.metrics is not None:
+                    self.metrics.timeouts.inc()
+                raise CommandTimeOut()
+            time.sleep(self.WAIT_POLL_PERIOD)
+
+        if self.metrics is not None:
+            self._record_wait(started, expected_duration)
+        self.logger.info('wait complete')
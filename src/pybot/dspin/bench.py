@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+
+""" Benchmarks of the dSPIN library.
+
+They run against whatever SPI backend is active, which is the fake one when
+not executed on a RasPi, or the emulator when the PYBOT_DSPIN_EMULATOR environment
+variable is set. Since these backends do not enter the kernel, the system calls
+counts are reported together with the timings, the former being the relevant figure
+for estimating the gain on the real target.
+
+The suite covers the encoding of the requests and the decoding of the replies (the
+compiled register codecs being compared with the generic conversions), the
+commands throughput of a single device, the chain frames building and transfer
+for increasing chain lengths, the registers snapshots and, with the emulator only,
+the latency of the moves completion detection.
+
+Results can be saved as JSON (--output), and compared with the ones of a previous run
+(--compare), for spotting regressions.
+"""
+
+import argparse
+from functools import reduce
+import json
+import os
+import platform
+import sys
+import textwrap
+import time
+
+from pybot.core import log
+
+from . import codec, commands, spidev
+from .core import DSPIN, DSPinSpiDev
+from .daisychain import DaisyChain
+from .defs import Register, Direction, max_spd_calc, acc_calc
+from .snapshot import ALL_REGISTERS
+
+__author__ = 'Eric Pascual'
+
+#: the chain lengths used by default for the chain scaling benchmark
+DEFAULT_CHAIN_LENGTHS = (2, 4, 8, 16, 32)
+
+
+def _time_calls(func, repeat):
+    """ Returns the average execution time of a function, in seconds.
+    """
+    t0 = time.time()
+    for _ in range(repeat):
+        func()
+    return (time.time() - t0) / repeat
+
+
+def _open_spi(chain_length=1):
+    """ Returns an opened SPI device, the emulator being configured with the requested
+    chain length if it is the active backend.
+    """
+    configure = getattr(spidev, 'configure', None)
+    if configure:
+        configure(chain_length=chain_length)
+    spi = DSPinSpiDev()
+    spi.open()
+    return spi
+
+
+def bench_codecs(repeat=10000):
+    """ Measures the encoding of the requests and the decoding of the replies.
+
+    :param int repeat: the number of iterations
+    :return: the average time per operation (in seconds), by operation name
+    :rtype: dict
+    """
+    goto, set_param = commands.GoTo(123456), commands.SetParam(Register.MAX_SPEED, 0x41)
+    move, run = commands.Move(Direction.FWD, 2000), commands.Run(Direction.REV, 500)
+    buf = bytearray(64)
+    dspin = DSPIN(DSPinSpiDev(), None, None)
+    reply = [0x12, 0x34, 0x56]
+
+    return {
+        'encode.goto.as_request': _time_calls(goto.as_request, repeat),
+        'encode.goto.encode_into': _time_calls(lambda: goto.encode_into(buf), repeat),
+        'encode.set_param.as_request': _time_calls(set_param.as_request, repeat),
+        'encode.move.as_request': _time_calls(move.as_request, repeat),
+        'encode.run.as_request': _time_calls(run.as_request, repeat),
+        'encode.value_as_bytes.abs_pos': _time_calls(
+            lambda: Register.value_as_bytes(Register.ABS_POS, -123456), repeat
+        ),
+        'decode.parse_register_reply.abs_pos': _time_calls(
+            lambda: dspin.parse_register_reply(Register.ABS_POS, reply), repeat
+        ),
+        'decode.parse_register_reply.status': _time_calls(
+            lambda: dspin.parse_register_reply(Register.STATUS, reply[:2]), repeat
+        ),
+    }
+
+
+def _generic_parse_register_reply(reg, value_bytes):
+    """ The generic decoding of a register value, as done before the compiled codecs
+    (see :py:mod:`codec`), kept as the reference of their benchmark.
+    """
+    raw_value = reduce(lambda a, b: (a << 8) | b, value_bytes) & reg.mask
+    if reg.signed:
+        if raw_value & (1 << (reg.size - 1)):
+            return raw_value - (1 << reg.size)
+    return raw_value
+
+
+def bench_register_codecs(repeat=10000, chain_lengths=DEFAULT_CHAIN_LENGTHS):
+    """ Compares the compiled register codecs with the generic conversions, for single
+    values and for the replies of registers snapshots of whole chains.
+
+    :param int repeat: the number of iterations for single values (snapshots use a tenth of it)
+    :param iterable chain_lengths: the chain lengths of the snapshots decoding
+    :return: the average time per operation (in seconds), by operation name
+    :rtype: dict
+    """
+    result = {}
+    for reg, value in ((Register.ABS_POS, -123456), (Register.STATUS, 0x7e03), (Register.KVAL_RUN, 0x29)):
+        reg_codec = codec.codec_for(reg)
+        data = reg_codec.encode(value)
+        name = reg.name.lower()
+        result.update({
+            'regcodec.%s.encode.generic' % name: _time_calls(lambda: Register.value_as_bytes(reg, value), repeat),
+            'regcodec.%s.encode.compiled' % name: _time_calls(lambda: reg_codec.encode(value), repeat),
+            'regcodec.%s.decode.generic' % name: _time_calls(
+                lambda: _generic_parse_register_reply(reg, data), repeat
+            ),
+            'regcodec.%s.decode.compiled' % name: _time_calls(lambda: reg_codec.decode(data), repeat),
+        })
+
+    # decoding of the replies of a full snapshot, as returned by the chain
+    regs = ALL_REGISTERS
+    set_codec = codec.RegisterSetCodec(regs)
+    offsets = set_codec.offsets
+    for n in chain_lengths:
+        replies = [bytearray((i * 7 + d) & 0xff for i in range(set_codec.size)) for d in range(n)]
+        count = max(repeat // 10, 1)
+        result['regcodec.snapshot.%d.generic' % n] = _time_calls(
+            lambda: [_generic_parse_register_reply(reg, reply[offset])
+                     for reply in replies for reg, offset in zip(regs, offsets)],
+            count
+        )
+        result['regcodec.snapshot.%d.compiled' % n] = _time_calls(
+            lambda: [decode(reply, offset) for reply in replies for decode, offset in set_codec._decoders],
+            count
+        )
+        if codec.numpy is not None:
+            result['regcodec.snapshot.%d.numpy' % n] = _time_calls(lambda: set_codec.decode_array(replies), count)
+    return result
+
+
+def bench_single_device(repeat=1000):
+    """ Measures the commands throughput of a single device.
+
+    :param int repeat: the number of iterations
+    :return: the average time per command (in seconds), by command name
+    :rtype: dict
+    """
+    spi = _open_spi()
+    dspin = DSPIN(spi, None, None)
+
+    return {
+        'device.goto': _time_calls(lambda: dspin.goto(1000, wait=False), repeat),
+        'device.run': _time_calls(lambda: dspin.run(Direction.FWD, 500), repeat),
+        'device.read_register': _time_calls(lambda: dspin.read_register(Register.ABS_POS), repeat),
+        'device.write_register': _time_calls(lambda: dspin.write_register(Register.MARK, 1234), repeat),
+        'device.read_registers': _time_calls(dspin.read_registers, repeat),
+    }
+
+
+def bench_chain_frames(chain_length, repeat=1000):
+    """ Measures the chain frames building, without any transfer, and the registers snapshots.
+
+    :param int chain_length: the number of devices in the chain
+    :param int repeat: the number of iterations
+    :return: the average time per operation (in seconds), by operation name
+    :rtype: dict
+    """
+    spi = _open_spi(chain_length)
+    chain = DaisyChain(chain_length, spi, None, None, None)
+    requests = [commands.GoTo(i).as_request() for i in range(chain_length)]
+
+    result = {
+        'chain.snapshot.%d' % chain_length: _time_calls(chain.read_registers, max(repeat // 10, 1)),
+    }
+
+    # transfers are short-circuited for measuring the frame building alone
+    chain._xfer_frame = lambda frame: frame
+    result['chain.frame_build.%d' % chain_length] = _time_calls(lambda: chain._xfer(requests), repeat)
+    return result
+
+
+def bench_wait_latency(repeat=20):
+    """ Measures the delay between the expected end of a move and the return of the wait
+    for its completion.
+
+    This requires the emulator, the fake GPIO backend bypassing the waits.
+
+    :param int repeat: the number of moves
+    :return: the average, min and max latencies (in seconds), by name. Empty if not
+    using the emulator.
+    :rtype: dict
+    """
+    if not getattr(spidev, 'configure', None):
+        return {}
+
+    spi = _open_spi()
+    dspin = DSPIN(spi, 11, 13)
+    dspin.initialize()
+    dspin.MAX_SPEED = max_spd_calc(4000)
+    dspin.ACC = dspin.DEC = acc_calc(10000)
+
+    latencies = []
+    for i in range(repeat):
+        expected = dspin.estimate_move_durations([200])[0]
+        t0 = time.time()
+        dspin.move(Direction.FWD if i % 2 else Direction.REV, 200, timeout=None)
+        latencies.append(time.time() - t0 - expected)
+
+    return {
+        'wait.latency.avg': sum(latencies) / len(latencies),
+        'wait.latency.min': min(latencies),
+        'wait.latency.max': max(latencies),
+    }
+
+
+def bench_chain_goto(chain_length, frame_burst, repeat=1000):
+    """ Measures the cost of a GoTo command sent to a whole chain.
+
+    :param int chain_length: the number of devices in the chain
+    :param bool frame_burst: the chain transfer mode
+    :param int repeat: the number of iterations
+    :return: the average time per command (in seconds) and the number of system
+    calls per command
+    :rtype: tuple
+    """
+    spi = _open_spi(chain_length)
+    chain = DaisyChain(chain_length, spi, None, None, None, frame_burst=frame_burst)
+    positions = list(range(chain_length))
+
+    syscalls = getattr(spi, 'syscalls', 0)
+    elapsed = _time_calls(lambda: chain.goto(positions, wait=False), repeat)
+    syscalls = float(getattr(spi, 'syscalls', 0) - syscalls) / repeat
+
+    return elapsed, syscalls
+
+
+def bench_chain_scaling(chain_lengths=DEFAULT_CHAIN_LENGTHS, repeat=1000):
+    """ Compares the per-column and frame burst transfer modes for increasing chain lengths.
+
+    :param iterable chain_lengths: the chain lengths to be tested
+    :param int repeat: the number of iterations for each measure
+    :return: a list of tuples (chain_length, column_time, column_syscalls, burst_time, burst_syscalls)
+    :rtype: list
+    """
+    return [
+        (n,) + bench_chain_goto(n, False, repeat) + bench_chain_goto(n, True, repeat)
+        for n in chain_lengths
+    ]
+
+
+def run_all(repeat=1000, chain_lengths=DEFAULT_CHAIN_LENGTHS):
+    """ Runs the whole suite.
+
+    :param int repeat: the base number of iterations per measure
+    :param iterable chain_lengths: the chain lengths used by the chain benchmarks
+    :return: the measures (seconds per operation, or system calls per command), by name
+    :rtype: dict
+    """
+    results = {}
+    results.update(bench_codecs(repeat * 10))
+    results.update(bench_register_codecs(repeat * 10, chain_lengths))
+    results.update(bench_single_device(repeat))
+    for n, col_t, col_sc, burst_t, burst_sc in bench_chain_scaling(chain_lengths, repeat):
+        results.update({
+            'chain.goto.column.%d' % n: col_t,
+            'chain.goto.burst.%d' % n: burst_t,
+            'chain.syscalls.column.%d' % n: col_sc,
+            'chain.syscalls.burst.%d' % n: burst_sc,
+        })
+        results.update(bench_chain_frames(n, repeat))
+    results.update(bench_wait_latency())
+    return results
+
+
+def save_results(results, path):
+    """ Saves the results in a JSON file, together with the run context.
+    """
+    with open(path, 'w') as fp:
+        json.dump({
+            'timestamp': time.time(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'backend': spidev.__name__,
+            'results': results,
+        }, fp, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as fp:
+        return json.load(fp)['results']
+
+
+def compare_results(results, previous, threshold=0.1):
+    """ Compares the results with the ones of a previous run.
+
+    :param dict results: the current results
+    :param dict previous: the previous results
+    :param float threshold: the relative increase reported as a regression
+    :return: a list of tuples (name, previous, current, ratio, regression), for the measures
+    present in both runs
+    :rtype: list
+    """
+    comparison = []
+    for name in sorted(set(results) & set(previous)):
+        before, after = previous[name], results[name]
+        ratio = after / before if before else None
+        # latencies can be negative, and are compared by their absolute increase
+        if name.startswith('wait.'):
+            regression = after - before > threshold * max(abs(before), 1e-3)
+        else:
+            regression = ratio is not None and ratio > 1 + threshold
+        comparison.append((name, before, after, ratio, regression))
+    return comparison
+
+
+def _format_value(name, value):
+    if 'syscalls' in name:
+        return '%.1f' % value
+    return '%.2f us' % (value * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(__doc__)
+    )
+    parser.add_argument('-n', '--repeat', type=int, default=1000, help='iterations per measure')
+    parser.add_argument('-l', '--lengths', type=int, nargs='+', default=DEFAULT_CHAIN_LENGTHS,
+                        help='chain lengths of the chain benchmarks')
+    parser.add_argument('-o', '--output', help='JSON file in which the results are saved')
+    parser.add_argument('-c', '--compare', help='JSON file of a previous run to compare with')
+    parser.add_argument('-t', '--threshold', type=float, default=10,
+                        help='slowdown reported as a regression, in percents (default: 10)')
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help='exit with a non zero status if regressions are detected')
+    args = parser.parse_args()
+
+    # the fake backend logs every transfer, which would spoil the measures
+    log.getLogger('pybot.dspin').setLevel(log.ERROR)
+
+    results = run_all(args.repeat, args.lengths)
+
+    print('GoTo on the whole chain (times in us/command)')
+    print('%6s %12s %10s %12s %10s %8s' % ('length', 'column', 'syscalls', 'burst', 'syscalls', 'gain'))
+    for n in args.lengths:
+        col_t, burst_t = results['chain.goto.column.%d' % n], results['chain.goto.burst.%d' % n]
+        print('%6d %12.1f %10.1f %12.1f %10.1f %7.1fx' % (
+            n, col_t * 1e6, results['chain.syscalls.column.%d' % n],
+            burst_t * 1e6, results['chain.syscalls.burst.%d' % n], col_t / burst_t
+        ))
+    print('')
+    for name in sorted(results):
+        if not name.startswith(('chain.goto.', 'chain.syscalls.')):
+            print('%-40s %14s' % (name, _format_value(name, results[name])))
+
+    if args.output:
+        save_results(results, args.output)
+
+    if args.compare:
+        regressions = 0
+        print('')
+        print('%-40s %14s %14s %8s' % ('comparison with ' + os.path.basename(args.compare), 'previous', 'current', 'ratio'))
+        for name, before, after, ratio, regression in compare_results(
+                results, load_results(args.compare), args.threshold / 100.
+        ):
+            regressions += regression
+            print('%-40s %14s %14s %8s%s' % (
+                name, _format_value(name, before), _format_value(name, after),
+                '%.2f' % ratio if ratio is not None else '-', '  <<< regression' if regression else ''
+            ))
+        print('%d regression(s)' % regressions)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+
+""" SPI clock calibration and monitoring.
+
+The clock the bus can reliably run at depends on the wiring (cable length, number of
+chained devices,...), and there is no way to know it beforehand. The
+:py:class:`ClockCalibrator` finds it experimentally: the clock is stepped upward, and at
+each step test patterns are written to harmless registers of all the devices and read
+back, the write and the read of each pattern being sent in the same burst. The highest
+speed at which no error occurred is kept, minus a safety margin::
+
+    calibrator = ClockCalibrator(dspin)
+    speed = calibrator.calibrate()       # the clock is left at this speed
+    print(calibrator.report())
+
+Since the conditions may degrade afterwards (temperature, vibrations loosening a
+connector,...), an :py:class:`IntegrityMonitor` can check the transfers in a background
+thread, and lower the clock as soon as errors appear::
+
+    monitor = IntegrityMonitor(dspin, speeds=calibrator.passing_speeds())
+    monitor.start()
+
+The monitor only reads configuration registers and compares them with their reference
+values, so that it does not interfere with the application. These references must be
+refreshed (see :py:meth:`IntegrityMonitor.refresh`) if the application modifies the
+registers afterwards.
+
+The effective clock of the SPI controller is derived from its input clock by a divider,
+and can thus be lower than the requested one (e.g. on a RasPi, the divider is a power of
+two in older kernels).
+"""
+
+from collections import namedtuple
+import threading
+import time
+
+from . import commands, pkg_log
+from .arbiter import Priority, set_thread_priority
+from .defs import Register
+from .snapshot import as_register
+
+__author__ = 'Eric Pascual'
+
+#: the candidate clock speeds (Hz). The dSPIN supports up to 5MHz.
+DEFAULT_SPEEDS = (500000, 1000000, 2000000, 3000000, 4000000, 5000000)
+
+#: the registers the test patterns are written to by default. MARK has no effect on the
+#: motor, unless a GoMark command is issued. KVAL_HOLD can be added, its value being
+#: restored at the end of the calibration, but the motor holding current is then
+#: changed meanwhile.
+TEST_REGISTERS = (Register.MARK,)
+
+#: the test patterns, truncated to the size of the registers. They are shifted for each
+#: device, so that devices swapped by a missing or extra bit in the chain are detected too.
+TEST_PATTERNS = (0x555555, 0xaaaaaa, 0xffffff, 0x000000, 0x0f0f0f, 0xf0f0f0, 0x123456, 0x6db6db)
+
+#: the registers checked by the integrity monitor, normally set once at initialization time
+MONITORED_REGISTERS = (Register.CONFIG, Register.STEP_MODE, Register.ALARM_EN, Register.OCD_TH)
+
+
+class StepResult(namedtuple('StepResult', 'speed checks errors')):
+    """ The result of the verification at a given speed.
+
+    .. py:attribute:: speed
+
+        the SPI clock (Hz)
+
+    .. py:attribute:: checks
+
+        the number of register values verified
+
+    .. py:attribute:: errors
+
+        the number of wrong values
+    """
+    __slots__ = ()
+
+    @property
+    def passed(self):
+        return self.checks > 0 and not self.errors
+
+
+def _read_raw(dspin, regs):
+    """ Reads registers in a single transfer, bypassing the registers shadow.
+
+    :return: the masked values, per device
+    :rtype: list of lists
+    """
+    request, offsets = dspin._registers_read_request(regs)
+    return [
+        [dspin.parse_register_reply(reg, reply[offset]) & reg.mask for reg, offset in zip(regs, offsets)]
+        for reply in dspin._xfer_all(request)
+    ]
+
+
+def _write_raw(dspin, regs, values):
+    """ Writes registers in a single transfer, bypassing the registers shadow.
+
+    :param list values: the values, per device
+    """
+    dspin._xfer_messages([
+        [b for reg, value in zip(regs, device_values) for b in commands.SetParam(reg, value).as_request()]
+        for device_values in values
+    ])
+
+
+class ClockCalibrator(object):
+    """ Finds the highest SPI clock at which register writes and reads are reliable.
+    """
+    def __init__(self, dspin, registers=TEST_REGISTERS, patterns=TEST_PATTERNS, logger=None):
+        """
+        :param DSPIN dspin: the device (single or daisy-chain)
+        :param iterable registers: the registers the patterns are written to, as definitions
+        or names. They must be writable whatever the state of the device.
+        :param iterable patterns: the test patterns
+        :param logger: optional logger. If None, a new one will be created
+        """
+        self._dspin = dspin
+        self.registers = tuple(as_register(r) for r in registers)
+        for reg in self.registers:
+            if reg.read_only:
+                raise ValueError('read only register (%s)' % reg.name)
+        self.patterns = tuple(patterns)
+        self.logger = logger or pkg_log.getChild(self.__class__.__name__)
+
+        # the patterns are written and read back in a single message per device, the
+        # read requests following the write ones
+        self._read_offset = sum(len(commands.SetParam(reg, 0).as_request()) for reg in self.registers)
+        self._read_request, self._read_slices = dspin._registers_read_request(self.registers)
+
+        #: the results of the last calibration, one per tested speed
+        self.results = []
+
+    @property
+    def spi(self):
+        return self._dspin._spi
+
+    def _pattern_values(self, pattern):
+        """ Returns the values written for a pattern, per device, the pattern being rotated
+        by the device position within the register size.
+        """
+        result = []
+        for device in range(self._dspin.device_count):
+            values = []
+            for reg in self.registers:
+                value, shift = pattern & reg.mask, device % reg.size
+                values.append(((value >> shift) | (value << (reg.size - shift))) & reg.mask)
+            result.append(values)
+        return result
+
+    def verify(self, rounds=10):
+        """ Writes all the patterns and reads them back at the current clock speed.
+
+        The write of a pattern and its read back are sent in the same transfer. The
+        registers are not restored.
+
+        :param int rounds: the number of times the patterns set is verified
+        :return: the verification result
+        :rtype: StepResult
+        """
+        dspin, regs, slices = self._dspin, self.registers, self._read_slices
+        offset = self._read_offset
+        tests = []
+        for pattern in self.patterns:
+            expected = self._pattern_values(pattern)
+            messages = [
+                [b for reg, value in zip(regs, values) for b in commands.SetParam(reg, value).as_request()] +
+                self._read_request
+                for values in expected
+            ]
+            tests.append((messages, expected))
+
+        checks = errors = 0
+        for _ in range(rounds):
+            for messages, expected in tests:
+                replies = dspin._xfer_messages(messages)
+                for reply, values in zip(replies, expected):
+                    for reg, s, value in zip(regs, slices, values):
+                        read = dspin.parse_register_reply(reg, reply[offset + s.start:offset + s.stop]) & reg.mask
+                        checks += 1
+                        if read != value:
+                            errors += 1
+        return StepResult(self.spi.speed_hz, checks, errors)
+
+    def calibrate(self, speeds=DEFAULT_SPEEDS, rounds=10, margin=1):
+        """ Steps the clock upward until errors occur, and selects the highest reliable
+        speed, lowered by a safety margin.
+
+        The content of the test registers is restored afterwards.
+
+        :param iterable speeds: the candidate speeds (Hz)
+        :param int rounds: the number of verification rounds at each speed
+        :param int margin: the number of steps below the highest reliable speed the
+        selected one is. If there are not enough reliable speeds, the lowest one is selected.
+        :return: the selected speed, to which the clock is set
+        :rtype: int
+        :raise IOError: if errors occurred even at the lowest speed
+        """
+        speeds = sorted(speeds)
+        if not speeds:
+            raise ValueError('no candidate speed')
+        spi, dspin = self.spi, self._dspin
+        initial_speed = spi.speed_hz
+        self.results = []
+        selected = None
+
+        # nobody else must access the bus while the speed is not the selected one
+        with spi.lock:
+            saved = _read_raw(dspin, self.registers)
+            try:
+                for speed in speeds:
+                    spi.speed_hz = speed
+                    result = self.verify(rounds)
+                    self.results.append(result)
+                    self.logger.info('%d Hz: %d errors / %d checks', speed, result.errors, result.checks)
+                    if not result.passed:
+                        break
+
+                passing = self.passing_speeds()
+                if passing:
+                    selected = passing[max(len(passing) - 1 - margin, 0)]
+            finally:
+                spi.speed_hz = selected or initial_speed
+                try:
+                    _write_raw(dspin, self.registers, saved)
+                finally:
+                    # the registers shadow may have missed the restore
+                    dspin.invalidate_shadow()
+
+        if selected is None:
+            self.logger.error('no reliable speed found, clock left at %d Hz', initial_speed)
+            raise IOError('transfers not reliable at %d Hz' % speeds[0])
+
+        self.logger.info('SPI clock set to %d Hz', selected)
+        return selected
+
+    def passing_speeds(self):
+        """ Returns the speeds which passed the last calibration, in ascending order.
+
+        :rtype: list
+        """
+        return [r.speed for r in self.results if r.passed]
+
+    def report(self):
+        """ Returns the results of the last calibration as a printable table.
+
+        :rtype: str
+        """
+        lines = ['%10s %8s %8s' % ('speed (Hz)', 'checks', 'errors')]
+        lines.extend('%10d %8d %8d' % r for r in self.results)
+        return '\n'.join(lines)
+
+
+class IntegrityMonitor(object):
+    """ Checks the integrity of the transfers in a background thread, and lowers the clock
+    when errors are detected.
+
+    The check reads the monitored registers and compares their values with the reference
+    ones. If a mismatch is detected, the register is read again to confirm it, and the
+    clock is lowered to the next candidate speed. Since a register legitimately modified
+    by the application would be taken for a transfer error, the references must be
+    refreshed in this case.
+    """
+    def __init__(self, dspin, speeds=DEFAULT_SPEEDS, registers=MONITORED_REGISTERS, period=1., logger=None):
+        """
+        :param DSPIN dspin: the device (single or daisy-chain)
+        :param iterable speeds: the speeds the clock can be lowered to (Hz)
+        :param iterable registers: the monitored registers, as definitions or names
+        :param float period: the checks period (seconds)
+        :param logger: optional logger. If None, a new one will be created
+        """
+        if period <= 0:
+            raise ValueError('invalid period (%s)' % period)
+        self._dspin = dspin
+        self.speeds = sorted(speeds)
+        self.registers = tuple(as_register(r) for r in registers)
+        self.period = period
+        self.logger = logger or pkg_log.getChild(self.__class__.__name__)
+
+        self._reference = None
+        self._thread = None
+        self._stop = threading.Event()
+
+        #: the number of checks done
+        self.checks = 0
+        #: the number of checks which detected an error
+        self.errors = 0
+        #: the number of times the clock has been lowered
+        self.drops = 0
+
+    @property
+    def spi(self):
+        return self._dspin._spi
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self):
+        """ Returns the monitoring statistics.
+
+        :return: a dictionary giving the number of checks, errors and clock drops, and
+        the current speed
+        :rtype: dict
+        """
+        return {
+            'checks': self.checks,
+            'errors': self.errors,
+            'drops': self.drops,
+            'speed_hz': self.spi.speed_hz,
+        }
+
+    def refresh(self):
+        """ Reads the reference values of the monitored registers. This must be done if
+        the application modifies them.
+        """
+        self._reference = _read_raw(self._dspin, self.registers)
+
+    def check(self):
+        """ Checks the monitored registers, and lowers the clock if errors are confirmed.
+
+        :return: True if no error was detected
+        :rtype: bool
+        """
+        if self._reference is None:
+            self.refresh()
+            return True
+
+        self.checks += 1
+        if _read_raw(self._dspin, self.registers) == self._reference:
+            return True
+        # a single corrupted read is not enough to conclude, since the application may
+        # have modified a register in between
+        if _read_raw(self._dspin, self.registers) == self._reference:
+            return True
+
+        self.errors += 1
+        self.lower_speed()
+        return False
+
+    def lower_speed(self):
+        """ Lowers the clock to the next candidate speed, if any.
+
+        :return: the new speed
+        :rtype: int
+        """
+        spi = self.spi
+        with spi.lock:
+            current = spi.speed_hz
+            lower = [s for s in self.speeds if s < current]
+            if not lower:
+                self.logger.error('transfer errors at %d Hz, no lower speed available', current)
+                return current
+            spi.speed_hz = lower[-1]
+            self.drops += 1
+        self.logger.warning('transfer errors detected: SPI clock lowered from %d to %d Hz', current, lower[-1])
+        return lower[-1]
+
+    def start(self):
+        """ Starts the monitoring thread.
+        """
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='dspin-integrity')
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info('monitoring started (period=%s)', self.period)
+
+    def stop(self, timeout=None):
+        """ Stops the monitoring thread and waits for its termination.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+        self.logger.info('monitoring stopped')
+
+    def _run(self):
+        # the checks must not delay the commands issued by the other threads
+        set_thread_priority(Priority.BACKGROUND)
+        while not self._stop.is_set():
+            start = time.time()
+            try:
+                self.check()
+            except Exception as e:
+                self.logger.error('check failed: %s', e)
+            self._stop.wait(max(self.period - (time.time() - start), 0))
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+""" Compiled encoders and decoders of the registers values.
+
+The generic conversions of :py:class:`defs.Register` loop over the bytes of the value,
+and compute its mask and sign at each call. Since they are used for each register
+access, and thus N times per access on a chain of N devices, a :py:class:`RegisterCodec`
+is built once for each register instead, with unrolled encoding and decoding functions
+specialized for its bytes count, mask and sign::
+
+    codec = codec_for(Register.ABS_POS)
+    codec.encode(-1000)                 # [0x3f, 0xfc, 0x18]
+    codec.decode(reply, 1)              # the value following the reply first byte
+
+The :py:class:`RegisterSetCodec` of a registers set decodes the replies to the
+concatenated GetParam requests reading them (see :py:meth:`DSPIN.read_registers`) for
+all the devices of a chain in a single pass, using NumPy for long chains when it is
+available.
+
+.. note::
+
+    The unrolled shifts have been preferred to `struct` and `int.from_bytes`: the
+    former needs the bytes to be copied in a `bytes` object (it has no 24 bits format),
+    and the latter is not available with Python 2, while not being faster.
+"""
+
+from .defs import Register
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'Eric Pascual'
+
+
+def _make_decoder(nbytes, mask, sign_bit):
+    """ Returns the function decoding a value stored MSB first in `nbytes` bytes, starting
+    at a given offset of a bytes sequence.
+    """
+    if nbytes == 3:
+        if sign_bit:
+            def decode(data, offset=0):
+                value = ((data[offset] << 16) | (data[offset + 1] << 8) | data[offset + 2]) & mask
+                return value - ((value & sign_bit) << 1)
+        else:
+            def decode(data, offset=0):
+                return ((data[offset] << 16) | (data[offset + 1] << 8) | data[offset + 2]) & mask
+    elif nbytes == 2:
+        if sign_bit:
+            def decode(data, offset=0):
+                value = ((data[offset] << 8) | data[offset + 1]) & mask
+                return value - ((value & sign_bit) << 1)
+        else:
+            def decode(data, offset=0):
+                return ((data[offset] << 8) | data[offset + 1]) & mask
+    else:
+        if sign_bit:
+            def decode(data, offset=0):
+                value = data[offset] & mask
+                return value - ((value & sign_bit) << 1)
+        else:
+            def decode(data, offset=0):
+                return data[offset] & mask
+    return decode
+
+
+def _make_encoder(nbytes, mask):
+    """ Returns the function encoding a value as the list of its `nbytes` bytes, MSB first.
+    Negative values are two's complement encoded by the masking.
+    """
+    if nbytes == 3:
+        def encode(value):
+            value &= mask
+            return [value >> 16, (value >> 8) & 0xff, value & 0xff]
+    elif nbytes == 2:
+        def encode(value):
+            value &= mask
+            return [value >> 8, value & 0xff]
+    else:
+        def encode(value):
+            return [value & mask]
+    return encode
+
+
+def _make_buffer_encoder(nbytes, mask):
+    """ Returns the function writing a value in a buffer, MSB first, consecutive bytes
+    being `stride` bytes apart.
+    """
+    if nbytes == 3:
+        def encode_into(value, buf, offset=0, stride=1):
+            value &= mask
+            buf[offset] = value >> 16
+            buf[offset + stride] = (value >> 8) & 0xff
+            buf[offset + 2 * stride] = value & 0xff
+            return offset + 3 * stride
+    elif nbytes == 2:
+        def encode_into(value, buf, offset=0, stride=1):
+            value &= mask
+            buf[offset] = value >> 8
+            buf[offset + stride] = value & 0xff
+            return offset + 2 * stride
+    else:
+        def encode_into(value, buf, offset=0, stride=1):
+            buf[offset] = value & mask
+            return offset + stride
+    return encode_into
+
+
+class RegisterCodec(object):
+    """ The encoding and decoding functions of a register.
+
+    .. py:attribute:: decode(data, offset=0)
+
+        returns the value stored at a given offset of a bytes sequence (list or bytearray)
+
+    .. py:attribute:: encode(value)
+
+        returns the list of bytes encoding a value, MSB first
+
+    .. py:attribute:: encode_into(value, buf, offset=0, stride=1)
+
+        writes the bytes of a value in a buffer, and returns the offset following the
+        last written one
+    """
+    __slots__ = ('register', 'nbytes', 'mask', 'sign_bit', 'decode', 'encode', 'encode_into')
+
+    def __init__(self, reg):
+        """
+        :param RegisterDefinition reg: the register
+        """
+        self.register = reg
+        self.nbytes = reg.nbytes
+        self.mask = reg.mask
+        self.sign_bit = 1 << (reg.size - 1) if reg.signed else 0
+        self.decode = _make_decoder(self.nbytes, self.mask, self.sign_bit)
+        self.encode = _make_encoder(self.nbytes, self.mask)
+        self.encode_into = _make_buffer_encoder(self.nbytes, self.mask)
+
+    def decode_array(self, data, offset=0):
+        """ Decodes the values stored at a given column of a bytes matrix, one row per device.
+
+        :param numpy.ndarray data: the bytes matrix, as an uint8 array
+        :param int offset: the column of the first byte of the values
+        :return: the values
+        :rtype: numpy.ndarray of int32
+        :raise: RuntimeError if NumPy is not available
+        """
+        if numpy is None:
+            raise RuntimeError('NumPy not available')
+        value = data[:, offset].astype(numpy.int32)
+        for i in range(1, self.nbytes):
+            value <<= 8
+            value |= data[:, offset + i]
+        value &= self.mask
+        if self.sign_bit:
+            value -= (value & self.sign_bit) << 1
+        return value
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.register.name)
+
+
+# the codecs of the standard registers, indexed by address
+_CODECS = [None] * 32
+for _name in Register.ALL:
+    _reg = getattr(Register, _name)
+    _CODECS[_reg.addr] = RegisterCodec(_reg)
+del _name, _reg
+
+# the codecs of the other definitions
+_other_codecs = {}
+
+
+def codec_for(reg):
+    """ Returns the codec of a register.
+
+    :param RegisterDefinition reg: the register
+    :rtype: RegisterCodec
+    """
+    codec = _CODECS[reg.addr]
+    if codec is not None and codec.register is reg:
+        return codec
+    try:
+        return _other_codecs[reg]
+    except KeyError:
+        codec = _other_codecs[reg] = RegisterCodec(reg)
+        return codec
+
+
+class RegisterSetCodec(object):
+    """ The decoder of the replies to the reading of a set of registers, made of the
+    concatenation of their GetParam requests.
+
+    .. py:attribute:: offsets
+
+        the slices of the replies containing the values of the registers
+    """
+    #: the number of devices from which the NumPy path is used, if available. Its cost
+    #: being mostly fixed per register, it is slower than the pure Python one for shorter
+    #: chains, whatever the number of registers.
+    NUMPY_MIN_DEVICES = 48
+
+    _instances = {}
+
+    def __init__(self, regs):
+        """
+        :param iterable regs: the registers definitions
+        """
+        self.registers = tuple(regs)
+        self.offsets, fields = [], []
+        offset = 0
+        for reg in self.registers:
+            # each request is made of the opcode followed by the value bytes
+            self.offsets.append(slice(offset + 1, offset + 1 + reg.nbytes))
+            fields.append((codec_for(reg), offset + 1))
+            offset += 1 + reg.nbytes
+        #: the length of the replies
+        self.size = offset
+        self._fields = tuple(fields)
+        self._decoders = tuple((codec.decode, offset) for codec, offset in fields)
+
+    @classmethod
+    def get(cls, regs):
+        """ Returns the codec of a registers set, creating it if needed.
+
+        :param tuple regs: the registers definitions
+        :rtype: RegisterSetCodec
+        """
+        try:
+            return cls._instances[regs]
+        except KeyError:
+            codec = cls._instances[regs] = cls(regs)
+            return codec
+
+    def decode(self, reply):
+        """ Decodes the reply of a device.
+
+        :param reply: the bytes of the reply
+        :return: the registers values
+        :rtype: list
+        """
+        return [decode(reply, offset) for decode, offset in self._decoders]
+
+    def decode_replies(self, replies):
+        """ Decodes the replies of a set of devices.
+
+        :param list replies: the replies of the devices
+        :return: the registers values, row-major by device
+        :rtype: list
+        """
+        if numpy is not None and len(replies) >= self.NUMPY_MIN_DEVICES:
+            return self.decode_array(replies).ravel().tolist()
+        decoders = self._decoders
+        return [decode(reply, offset) for reply in replies for decode, offset in decoders]
+
+    def decode_array(self, replies):
+        """ Decodes the replies of a set of devices with NumPy.
+
+        :param replies: the replies of the devices, as a list of bytes sequences or as an
+        uint8 array with one row per device
+        :return: the registers values, one row per device
+        :rtype: numpy.ndarray of int32
+        :raise: RuntimeError if NumPy is not available
+        """
+        if numpy is None:
+            raise RuntimeError('NumPy not available')
+        if isinstance(replies, numpy.ndarray):
+            data = replies.reshape(len(replies), -1)
+        else:
+            data = numpy.frombuffer(
+                bytearray().join(bytearray(r) for r in replies), dtype=numpy.uint8
+            ).reshape(len(replies), -1)
+        values = numpy.empty((len(data), len(self._fields)), dtype=numpy.int32)
+        for column, (codec, offset) in enumerate(self._fields):
+            values[:, column] = codec.decode_array(data, offset)
+        return values
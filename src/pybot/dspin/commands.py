@@ -6,11 +6,17 @@ in an encapsulated way, so that higher level classes such as
 byte streams building.
 """
 
-import defs
-from defs import Register, RegisterDefinition
+from . import defs
+from .codec import codec_for
+from .defs import Register, RegisterDefinition
 
 __author__ = 'Eric Pascual'
 
+# the encoders of the speed and position parameters, which have the format of the
+# corresponding registers
+_SPEED_CODEC = codec_for(Register.SPEED)
+_POSITION_CODEC = codec_for(Register.ABS_POS)
+
 
 class OpCodes(object):
     """ An enumeration of op-codes used in dSPIN commands.
@@ -53,13 +59,31 @@ class OpCodes(object):
         if value not in cls._all:
             raise ValueError('invalid opcode')
 
+    @classmethod
+    def expects_reply(cls, opcode):
+        """ Tells if the reply of a request is meaningful, i.e. if it is a register read or a
+        status request.
+
+        :param int opcode: the first byte of the request
+        """
+        return opcode & 0xe0 == cls.GET_PARAM or opcode == cls.GET_STATUS
+
 
 class Command(object):
     """ Root (abstract) class for the commands model.
 
     All command model classes must implement the :py:meth:`as_request` methode
-    which returns SPI request to be sent for this command.
+    which returns SPI request to be sent for this command, and the :py:meth:`encode_into`
+    one which writes the same request in a caller provided buffer.
+
+    Instances can be reused by changing their parameters, so that sending a command
+    repeatedly does not imply any allocation.
     """
+    __slots__ = ()
+
+    #: the size of the request (in bytes)
+    size = 1
+
     def as_request(self):
         """ Returns the SPI request for this command
 
@@ -68,6 +92,18 @@ class Command(object):
         """
         raise NotImplementedError()
 
+    def encode_into(self, buf, offset=0, stride=1):
+        """ Writes the SPI request for this command in a buffer.
+
+        :param bytearray buf: the destination buffer (a bytearray or a writable memoryview)
+        :param int offset: the position of the request first byte in the buffer
+        :param int stride: the distance between two consecutive request bytes in the buffer
+        (used for writing interleaved daisy-chain frames)
+        :return: the offset following the last written byte
+        :rtype: int
+        """
+        raise NotImplementedError()
+
 
 class SimpleCommand(Command):
     """ A simple parameter-less command.
@@ -77,6 +113,8 @@ class SimpleCommand(Command):
         Since they are fixed, their usage can be optimized by pre-defining constants
         containing the equivalent SPI requests.
     """
+    __slots__ = ('_opcode', '_padding', 'size')
+
     def __init__(self, opcode, size=1):
         """
         :param int opcode: one of the OpCodes values
@@ -92,10 +130,20 @@ class SimpleCommand(Command):
 
         self._opcode = opcode
         self._padding = [OpCodes.NOP] * (size - 1)
+        self.size = max(size, 1)
 
     def as_request(self):
         return [self._opcode] + self._padding
 
+    def encode_into(self, buf, offset=0, stride=1):
+        buf[offset] = self._opcode
+        end = offset + self.size * stride
+        offset += stride
+        while offset < end:
+            buf[offset] = OpCodes.NOP
+            offset += stride
+        return end
+
 
 class Nop(SimpleCommand):
     """ The do-nothing command, used to pad daisy-chain transactions when only some of
@@ -107,6 +155,8 @@ class Nop(SimpleCommand):
         """
         super(Nop, self).__init__(OpCodes.NOP, size)
 
+    __slots__ = ()
+
 
 #: a 1 byte long NOP
 NOP_1 = Nop(size=1)
@@ -174,6 +224,7 @@ ParametricCommand = Command
 
 class RegisterCommandMixin(object):
     """ A mixin factoring common process for commands manipulating registers. """
+    __slots__ = ()
 
     def __init__(self, reg):
         """
@@ -186,9 +237,18 @@ class RegisterCommandMixin(object):
         """ The register manipulated by the command. """
         return self._reg
 
+    @register.setter
+    def register(self, reg):
+        self._reg = reg
+
+    @property
+    def size(self):
+        return 1 + self._reg.nbytes
+
 
 class SetParam(RegisterCommandMixin, ParametricCommand):
     """ The SetParam command. """
+    __slots__ = ('_reg', '_value')
 
     def __init__(self, reg, value):
         """
@@ -208,17 +268,28 @@ class SetParam(RegisterCommandMixin, ParametricCommand):
         self._value = value
 
     def as_request(self):
-        return [OpCodes.SET_PARAM | self._reg.addr] + Register.value_as_bytes(self._reg, self._value)
+        return [OpCodes.SET_PARAM | self._reg.addr] + codec_for(self._reg).encode(self._value)
+
+    def encode_into(self, buf, offset=0, stride=1):
+        buf[offset] = OpCodes.SET_PARAM | self._reg.addr
+        return codec_for(self._reg).encode_into(self._value, buf, offset + stride, stride)
 
 
 class GetParam(RegisterCommandMixin, ParametricCommand):
     """ The GetParam command. """
+    __slots__ = ('_reg',)
+
     def as_request(self):
-        return [OpCodes.GET_PARAM | self._reg.addr] + Register.value_as_bytes(self._reg, 0)
+        return [OpCodes.GET_PARAM | self._reg.addr] + [0] * self._reg.nbytes
+
+    def encode_into(self, buf, offset=0, stride=1):
+        buf[offset] = OpCodes.GET_PARAM | self._reg.addr
+        return codec_for(self._reg).encode_into(0, buf, offset + stride, stride)
 
 
 class DirectionCommandMixin(object):
     """ A mixin factoring common process for commands dealing with move directions. """
+    __slots__ = ()
 
     #: default value for the direction, when not specified
     DEFAULT_DIRECTION = defs.Direction.FWD
@@ -250,6 +321,7 @@ class DirectionCommandMixin(object):
 
 class SpeedCommandMixin(object):
     """ A mixin factoring common process for commands dealing with move speeds. """
+    __slots__ = ()
 
     #: maximum allowed value (equals to MAX_SPEED as defined in the dSPIN datasheet)
     MAX_VALUE = 0x3fffff
@@ -277,6 +349,8 @@ class SpeedCommandMixin(object):
 
 class Run(ParametricCommand, DirectionCommandMixin, SpeedCommandMixin):
     """ The Run command. """
+    __slots__ = ('_dir', '_speed')
+    size = 4
 
     def __init__(self, direction=DirectionCommandMixin.DEFAULT_DIRECTION, steps_per_sec=SpeedCommandMixin.MAX_VALUE):
         """
@@ -287,11 +361,16 @@ class Run(ParametricCommand, DirectionCommandMixin, SpeedCommandMixin):
         SpeedCommandMixin.__init__(self, steps_per_sec)
 
     def as_request(self):
-        return [OpCodes.RUN | self._dir] + Register.value_as_bytes(Register.SPEED, defs.spd_calc(self.speed))
+        return [OpCodes.RUN | self._dir] + _SPEED_CODEC.encode(defs.spd_calc(self.speed))
+
+    def encode_into(self, buf, offset=0, stride=1):
+        buf[offset] = OpCodes.RUN | self._dir
+        return _SPEED_CODEC.encode_into(defs.spd_calc(self._speed), buf, offset + stride, stride)
 
 
 class StepClock(ParametricCommand, DirectionCommandMixin):
     """ The StepClock command. """
+    __slots__ = ('_dir',)
 
     def __init__(self, direction=DirectionCommandMixin.DEFAULT_DIRECTION):
         """
@@ -300,11 +379,17 @@ class StepClock(ParametricCommand, DirectionCommandMixin):
         DirectionCommandMixin.__init__(self, direction)
 
     def as_request(self):
-        return [OpCodes.RUN | self.direction]
+        return [OpCodes.STEP_CLOCK | self.direction]
+
+    def encode_into(self, buf, offset=0, stride=1):
+        buf[offset] = OpCodes.STEP_CLOCK | self._dir
+        return offset + stride
 
 
 class Move(ParametricCommand, DirectionCommandMixin):
     """ The Move command. """
+    __slots__ = ('_dir', '_steps')
+    size = 4
 
     def __init__(self, direction=defs.Direction.FWD, steps=1):
         """
@@ -321,14 +406,20 @@ class Move(ParametricCommand, DirectionCommandMixin):
 
     @steps.setter
     def steps(self, value):
-        self._steps = value
+        # same as for the constructor, so that a reused command behaves like a new one
+        self._steps = abs(value)
 
     def as_request(self):
-        return [OpCodes.MOVE | self.direction] + Register.value_as_bytes(Register.ABS_POS, self._steps)
+        return [OpCodes.MOVE | self.direction] + _POSITION_CODEC.encode(self._steps)
+
+    def encode_into(self, buf, offset=0, stride=1):
+        buf[offset] = OpCodes.MOVE | self._dir
+        return _POSITION_CODEC.encode_into(self._steps, buf, offset + stride, stride)
 
 
 class PositionCommandMixin(object):
     """ A mixin factoring common process for commands dealing with positions. """
+    __slots__ = ()
 
     def __init__(self, position):
         """
@@ -348,6 +439,8 @@ class PositionCommandMixin(object):
 
 class GoTo(ParametricCommand, PositionCommandMixin):
     """ The GoTo command. """
+    __slots__ = ('_pos',)
+    size = 4
 
     def __init__(self, position):
         """
@@ -356,11 +449,17 @@ class GoTo(ParametricCommand, PositionCommandMixin):
         PositionCommandMixin.__init__(self, position)
 
     def as_request(self):
-        return [OpCodes.GOTO] + Register.value_as_bytes(Register.ABS_POS, self.position)
+        return [OpCodes.GOTO] + _POSITION_CODEC.encode(self.position)
+
+    def encode_into(self, buf, offset=0, stride=1):
+        buf[offset] = OpCodes.GOTO
+        return _POSITION_CODEC.encode_into(self._pos, buf, offset + stride, stride)
 
 
 class GoToDir(ParametricCommand, DirectionCommandMixin, PositionCommandMixin):
     """ The GoToDir command. """
+    __slots__ = ('_dir', '_pos')
+    size = 4
 
     def __init__(self, direction, position):
         """
@@ -371,11 +470,16 @@ class GoToDir(ParametricCommand, DirectionCommandMixin, PositionCommandMixin):
         PositionCommandMixin.__init__(self, position)
 
     def as_request(self):
-        return [OpCodes.GOTO_DIR | self.direction] + Register.value_as_bytes(Register.ABS_POS, self.position)
+        return [OpCodes.GOTO_DIR | self.direction] + _POSITION_CODEC.encode(self.position)
+
+    def encode_into(self, buf, offset=0, stride=1):
+        buf[offset] = OpCodes.GOTO_DIR | self._dir
+        return _POSITION_CODEC.encode_into(self._pos, buf, offset + stride, stride)
 
 
 class ActionCommandMixin(object):
     """ A mixin factoring common process for commands dealing with switch edge detection actions. """
+    __slots__ = ()
 
     #: default action, when not specified
     DEFAULT_ACTION = defs.GoUntilAction.COPY
@@ -406,6 +510,8 @@ class ActionCommandMixin(object):
 
 class GoUntil(ParametricCommand, ActionCommandMixin, DirectionCommandMixin, SpeedCommandMixin):
     """ The GoUntil command. """
+    __slots__ = ('_action', '_dir', '_speed')
+    size = 4
 
     def __init__(self,
                  action=ActionCommandMixin.DEFAULT_ACTION,
@@ -423,11 +529,16 @@ class GoUntil(ParametricCommand, ActionCommandMixin, DirectionCommandMixin, Spee
 
     def as_request(self):
         return [OpCodes.GO_UNTIL | self.direction | self.action] + \
-               Register.value_as_bytes(Register.SPEED, defs.spd_calc(self.speed))
+               _SPEED_CODEC.encode(defs.spd_calc(self.speed))
+
+    def encode_into(self, buf, offset=0, stride=1):
+        buf[offset] = OpCodes.GO_UNTIL | self._dir | self._action
+        return _SPEED_CODEC.encode_into(defs.spd_calc(self._speed), buf, offset + stride, stride)
 
 
 class ReleaseSW(ParametricCommand, ActionCommandMixin, DirectionCommandMixin):
     """ The ReleaseSW command. """
+    __slots__ = ('_action', '_dir')
 
     def __init__(self, action=ActionCommandMixin.DEFAULT_ACTION, direction=DirectionCommandMixin.DEFAULT_DIRECTION):
         """
@@ -439,3 +550,7 @@ class ReleaseSW(ParametricCommand, ActionCommandMixin, DirectionCommandMixin):
 
     def as_request(self):
         return [OpCodes.RELEASE_SW | self.direction | self.action]
+
+    def encode_into(self, buf, offset=0, stride=1):
+        buf[offset] = OpCodes.RELEASE_SW | self._dir | self._action
+        return offset + stride
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+""" Per-device tracking of the moves completion on a daisy-chain.
+
+All the devices of a chain usually share the same BUSYN line, which is released only
+when the last of them has completed its move. The :py:class:`CompletionTracker` polls
+instead the STATUS registers of all the devices in a single chain frame, and resolves
+the :py:class:`MoveCompletion` of each device as soon as it is no more busy.
+"""
+
+import threading
+import time
+
+from . import pkg_log
+from .defs import Register, Status, spd_from_reg
+
+__author__ = 'Eric Pascual'
+
+
+class MoveCompletion(object):
+    """ The completion of the move of a device, which can be waited for or observed.
+    """
+    def __init__(self, device, target=None, expected_end=None):
+        """
+        :param int device: the position of the device in the chain
+        :param int target: the target position of the move, if known
+        :param float expected_end: the time at which the move should end, if estimated
+        """
+        self.device = device
+        self.target = target
+        self.expected_end = expected_end
+        #: the content of the STATUS register when the move has been detected as complete
+        self.status = None
+        #: True if the completion has been abandoned because a new command was sent to the device
+        self.superseded = False
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """ Waits for the completion.
+
+        :param float timeout: the max wait time in seconds (default: no limit)
+        :return: True if complete, False if timeout
+        :rtype: bool
+        """
+        return self._event.wait(timeout)
+
+    def add_done_callback(self, callback):
+        """ Registers a callback invoked with the completion as argument when it occurs. If
+        already complete, the callback is invoked immediately.
+
+        Callbacks are invoked in the tracker thread, and must thus return quickly.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _resolve(self, status=None, superseded=False):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.status, self.superseded = status, superseded
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                pkg_log.exception('completion callback %s failed (%s)', callback, e)
+
+    def __repr__(self):
+        return '%s(device=%d, done=%s)' % (self.__class__.__name__, self.device, self.done())
+
+
+class CompletionTracker(object):
+    """ Tracks the moves of the devices of a chain.
+
+    A background thread runs while some moves are pending. It reads STATUS, ABS_POS and
+    SPEED of all the devices in one frame. When the remaining time of all the pending moves
+    can be predicted, from their estimated duration (see :py:mod:`motion`) or from their
+    target position and current speed, the next poll is scheduled according to the shortest
+    one. Otherwise the polling period is doubled at each poll.
+    """
+    #: the polled registers
+    REGISTERS = (Register.STATUS, Register.ABS_POS, Register.SPEED)
+    #: the bounds of the polling period (seconds)
+    MIN_POLL_PERIOD = 0.001
+    MAX_POLL_PERIOD = 0.05
+
+    def __init__(self, chain, logger=None):
+        """
+        :param DaisyChain chain: the tracked chain
+        :param logger: optional logger. If None, a new one will be created
+        """
+        self._chain = chain
+        self.logger = logger or pkg_log.getChild(self.__class__.__name__)
+        self._pending = [None] * chain.device_count
+        self._changed = threading.Condition()
+        self._thread = None
+        #: the number of polling transactions done so far
+        self.polls = 0
+
+    def track(self, devices, targets=None, durations=None):
+        """ Starts tracking the move just commanded to some devices.
+
+        A pending completion of a device involved in the new move is resolved as superseded.
+
+        :param iterable devices: the positions of the devices
+        :param list targets: the target positions, indexed by device position, if known
+        :param list durations: the estimated durations of the moves, indexed by device position, if known
+        :return: the completions, indexed by device position, None for devices not involved
+        :rtype: list
+        """
+        result = [None] * len(self._pending)
+        superseded = []
+        now = time.time()
+        with self._changed:
+            for d in devices:
+                if self._pending[d] is not None:
+                    superseded.append(self._pending[d])
+                duration = durations[d] if durations is not None else None
+                result[d] = self._pending[d] = MoveCompletion(
+                    d,
+                    target=targets[d] if targets is not None else None,
+                    expected_end=now + duration if duration is not None else None
+                )
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='dspin-completion')
+                self._thread.daemon = True
+                self._thread.start()
+            self._changed.notify()
+
+        for completion in superseded:
+            completion._resolve(superseded=True)
+        return result
+
+    def pending(self):
+        """ Returns the pending completions, indexed by device position.
+        """
+        with self._changed:
+            return list(self._pending)
+
+    def cancel(self, devices=None):
+        """ Stops tracking the moves of some devices, their completion being resolved as superseded.
+
+        :param iterable devices: the positions of the devices (default: all)
+        """
+        with self._changed:
+            cancelled = []
+            for d in (range(len(self._pending)) if devices is None else devices):
+                if self._pending[d] is not None:
+                    cancelled.append(self._pending[d])
+                    self._pending[d] = None
+        for completion in cancelled:
+            completion._resolve(superseded=True)
+
+    def _predicted_delay(self, completion, position, speed):
+        """ Returns the predicted remaining time of a move, None if it cannot be predicted.
+
+        The estimated end of the move is used if known. Otherwise, assuming that the speed
+        will not increase, the remaining distance divided by the current speed gives a lower
+        bound as long as the device decelerates before reaching the target.
+        """
+        if completion.expected_end is not None:
+            remaining = completion.expected_end - time.time()
+            # once overdue, the estimation is no more relevant
+            return remaining if remaining > 0 else None
+        if completion.target is None or not speed:
+            return None
+        return abs(completion.target - position) / spd_from_reg(speed)
+
+    def _run(self):
+        period = self.MIN_POLL_PERIOD
+        while True:
+            with self._changed:
+                if not any(self._pending):
+                    self._thread = None
+                    return
+                # the moves commanded after this point are not yet visible in the registers
+                tracked = list(self._pending)
+
+            try:
+                snapshot = self._chain.read_registers(self.REGISTERS)
+            except Exception as e:
+                # the polling must go on, otherwise the pending completions would never resolve
+                self.logger.error('status polling failed (%s)', e)
+                snapshot = None
+            self.polls += 1
+
+            completed, delays = [], []
+            if snapshot is not None:
+                with self._changed:
+                    for d, completion in enumerate(tracked):
+                        if completion is None or self._pending[d] is not completion:
+                            continue
+                        status = snapshot[d, Register.STATUS]
+                        # BUSY flag is active low
+                        if status & Status.BUSY:
+                            completed.append((completion, status))
+                            self._pending[d] = None
+                        else:
+                            delays.append(self._predicted_delay(
+                                completion, snapshot[d, Register.ABS_POS], snapshot[d, Register.SPEED]
+                            ))
+
+            metrics = self._chain.metrics
+            for completion, status in completed:
+                if metrics is not None and completion.expected_end is not None:
+                    metrics.overshoot.observe(time.time() - completion.expected_end)
+                completion._resolve(status)
+
+            if delays and None not in delays:
+                period = min(delays)
+            else:
+                period *= 2
+            period = max(self.MIN_POLL_PERIOD, min(period, self.MAX_POLL_PERIOD))
+
+            with self._changed:
+                # a new move restarts the polling at the fastest rate
+                if self._changed.wait(period):
+                    period = self.MIN_POLL_PERIOD
+
+
+def wait_all(completions, timeout=None):
+    """ Waits for a set of completions.
+
+    :param iterable completions: the completions (None items are ignored)
+    :param float timeout: the max wait time in seconds (default: no limit)
+    :return: True if all complete, False if timeout
+    :rtype: bool
+    """
+    time_limit = time.time() + timeout if timeout is not None else None
+    for completion in completions:
+        if completion is None:
+            continue
+        remaining = max(time_limit - time.time(), 0) if time_limit is not None else None
+        if not completion.wait(remaining):
+            return False
+    return True
@@ -1,11 +1,25 @@
 # -*- coding: utf-8 -*-
 
+from contextlib import contextmanager
+import threading
 import time
 
 from pybot.core import log
 
-from . import commands, pkg_log, GPIO, spidev
+from . import commands, metrics, pkg_log, GPIO, spidev
+from .arbiter import BusLock, Priority, thread_priority
+from .codec import RegisterSetCodec, codec_for
+from .shadow import RegisterShadow
+from .snapshot import RegisterSnapshot, ALL_REGISTERS, as_register
+from .transaction import Transaction
 from .defs import Register, Status, Configuration, Direction, GoUntilAction
+from .motion import PROFILE_REGISTERS, ProfileParameters, goto_distance, move_duration
+
+try:
+    from .spi_ioc import IocTransferEngine
+except ImportError:
+    # not on Linux
+    IocTransferEngine = None
 
 __author__ = 'Eric Pascual'
 
@@ -16,17 +30,49 @@ class DSPinSpiDev(spidev.SpiDev):
     """
     log = pkg_log.getChild('spi')
 
-    def __init__(self, spi_bus=0, spi_dev=0, max_speed_hz=500000):
+    #: size of the transfer buffers (matches the default message size limit of the spidev driver)
+    BUFFER_SIZE = 4096
+
+    def __init__(self, spi_bus=0, spi_dev=0, max_speed_hz=500000, use_ioc=True):
         """
         :param int spi_bus: the SPI bus id (0 or 1, default:0)
         :param int spi_dev: the SPI device id (0 or 1, default:0)
         :param int max_speed_hz: the maximum clock speed (default: 500kHz)
+        :param bool use_ioc: use the single ioctl transfer engine if available (default: True)
         """
         super(DSPinSpiDev, self).__init__()
 
         self._bus = spi_bus
         self._dev = spi_dev
         self._max_speed = max_speed_hz
+        self._use_ioc = use_ioc
+
+        self._tx_buf = bytearray(self.BUFFER_SIZE)
+        self._rx_buf = bytearray(self.BUFFER_SIZE)
+        self._ioc_engine = None
+        self._send_message = self._send_message_loop
+
+        #: serializes the transactions of the threads sharing the device. It must be held
+        #: across sequences using the transfer buffers (encoding, transfer, reply parsing).
+        #: Waiting threads are granted the bus by order of priority (see :py:mod:`arbiter`)
+        self.lock = BusLock()
+
+        #: the transfers metrics (see :py:mod:`metrics`), None if not collected
+        self.metrics = None
+        if metrics.ENABLED:
+            self.enable_metrics()
+
+    def enable_metrics(self, registry=None):
+        """ Starts collecting the transfers metrics.
+
+        :param MetricsRegistry registry: the registry of the metrics (default: :py:data:`metrics.REGISTRY`)
+        """
+        self.metrics = metrics.SpiMetrics(registry or metrics.REGISTRY, bus=self._bus, dev=self._dev)
+        self.lock.wait_histograms = self.metrics.lock_waits
+
+    def disable_metrics(self):
+        self.metrics = None
+        self.lock.wait_histograms = None
 
     def open(self):
         """ Opens the SPI device, using the settings provided at instantiation time.
@@ -36,25 +82,158 @@ class DSPinSpiDev(spidev.SpiDev):
         self.mode = 3
         self.max_speed_hz = self._max_speed
 
+        self._select_transfer_engine()
+
         self.log.info("SPI open done (bus=%d device=%d)", self._bus, self._dev)
 
+    @property
+    def speed_hz(self):
+        """ The SPI clock speed (Hz).
+
+        It can be changed while the device is open, the transfers in progress being
+        completed at the previous speed. See :py:mod:`clocktune` for finding the highest
+        reliable one.
+        """
+        return self._max_speed
+
+    @speed_hz.setter
+    def speed_hz(self, value):
+        with self.lock:
+            self._max_speed = value
+            try:
+                self.max_speed_hz = value
+            except (IOError, OSError, TypeError):
+                # not open yet: will be applied by open()
+                pass
+
+    def _select_transfer_engine(self):
+        """ Selects the way messages with CS toggled between segments are sent.
+
+        Backends emulating the device (see :py:mod:`fake_spidev`) provide their own
+        `transfer_message` method. For the real one, the ioctl based engine is used,
+        unless unavailable or disabled, in which case we fall back to one
+        transfer per segment.
+        """
+        self._send_message = self._send_message_loop
+        if self._ioc_engine:
+            self._ioc_engine.release()
+            self._ioc_engine = None
+        if not self._use_ioc:
+            return
+
+        backend_message = getattr(super(DSPinSpiDev, self), 'transfer_message', None)
+        if backend_message:
+            self._send_message = backend_message
+
+        elif IocTransferEngine:
+            try:
+                self._ioc_engine = IocTransferEngine(self.fileno(), self._tx_buf, self._rx_buf)
+            except (AttributeError, IOError, OSError) as e:
+                self.log.warn('ioctl transfer engine not available (%s)', e)
+            else:
+                self._send_message = self._send_message_ioc
+
+    def _send_message_loop(self, values, seg_len):
+        xfer = super(DSPinSpiDev, self).xfer
+        result = []
+        for i in range(0, len(values), seg_len):
+            result.extend(xfer(list(values[i:i + seg_len])))
+        return result
+
+    def _send_message_ioc(self, values, seg_len):
+        tx_buf, rx_buf, engine = self._tx_buf, self._rx_buf, self._ioc_engine
+        # the buffers being sized to the driver limit, this is almost always a single pass
+        chunk = len(tx_buf) - len(tx_buf) % seg_len
+        result = []
+        for start in range(0, len(values), chunk):
+            part = values[start:start + chunk]
+            length = len(part)
+            tx_buf[:length] = part
+            engine.transfer(length, seg_len)
+            result.extend(rx_buf[:length])
+        return result
+
+    @property
+    def tx_buffer(self):
+        """ The transmit buffer, in which requests can be encoded in place before calling
+        :py:meth:`xfer_buffer`.
+        """
+        return self._tx_buf
+
+    @property
+    def rx_buffer(self):
+        """ The receive buffer, filled by :py:meth:`xfer_buffer`.
+        """
+        return self._rx_buf
+
+    def xfer_buffer(self, length, seg_len=1):
+        """ Sends the first bytes of the transmit buffer, toggling CS every `seg_len` bytes.
+
+        The received bytes are stored in the receive buffer. When the ioctl transfer engine
+        is used, the data are exchanged in place and nothing is allocated.
+
+        :param int length: the number of bytes to be sent
+        :param int seg_len: the number of bytes sent between CS toggles
+        :return: the receive buffer
+        :rtype: bytearray
+        """
+        m = self.metrics
+        with self.lock:
+            if m is not None:
+                start = metrics.clock()
+            engine = self._ioc_engine
+            if engine is not None:
+                engine.transfer(length, seg_len)
+            else:
+                self._rx_buf[:length] = bytearray(self._send_message(self._tx_buf[:length], seg_len))
+            if m is not None:
+                m.record(length, metrics.clock() - start)
+
+            if self.log.isEnabledFor(log.DEBUG):
+                self.log.debug('_xfer_buffer(%s) -> %s',
+                               bytes_as_string(self._tx_buf[:length]), bytes_as_string(self._rx_buf[:length]))
+
+        return self._rx_buf
+
+    def xfer_segments(self, values, seg_len):
+        """ Send data, toggling CS every `seg_len` bytes.
+
+        Whenever possible, the whole message is sent using a single system call.
+
+        :param iterable values: the bytes to be sent
+        :param int seg_len: the number of bytes sent between CS toggles
+        :return: the received bytes
+        :rtype: list
+        """
+        m = self.metrics
+        with self.lock:
+            if m is None:
+                return self._send_message(values, seg_len)
+            start = metrics.clock()
+            result = self._send_message(values, seg_len)
+            m.record(len(result), metrics.clock() - start)
+            return result
+
     def xfer(self, values=None):
         """ Send data, toggling CS for each byte.
 
         Unlike stated in the documentation, the CS line is held during the whole transfer,
-        whatever method (xfer or xfer2) is used.
-        We thus cannot use a single call to send the message and instead need
-        to loop and send bytes one at a time.
+        whatever method (xfer or xfer2) of the spidev binding is used. The message is
+        thus sent as a sequence of single byte segments (see :py:meth:`xfer_segments`).
 
         :param iterable values: the bytes to be sent
         :return: the received bytes
         :rtype: list
         """
-        result = []
-        for b in values:
-            result.extend(super(DSPinSpiDev, self).xfer([b]))
-
-        if self.log.getEffectiveLevel() == log.DEBUG:
+        m = self.metrics
+        with self.lock:
+            if m is not None:
+                start = metrics.clock()
+            result = self._send_message(values, 1)
+            if m is not None:
+                m.record(len(result), metrics.clock() - start)
+
+        if self.log.isEnabledFor(log.DEBUG):
             self.log.debug('_xfer(%s) -> %s', bytes_as_string(values), bytes_as_string(result))
 
         return result
@@ -66,25 +245,118 @@ class DSPinSpiDev(spidev.SpiDev):
         :return: the received bytes
         :rtype: list
         """
-        result = super(DSPinSpiDev, self).xfer(list(values))
-
-        if self.log.getEffectiveLevel() == log.DEBUG:
+        m = self.metrics
+        with self.lock:
+            if m is not None:
+                start = metrics.clock()
+            result = super(DSPinSpiDev, self).xfer(list(values))
+            if m is not None:
+                m.record(len(result), metrics.clock() - start)
+
+        if self.log.isEnabledFor(log.DEBUG):
             self.log.debug('_xfer2(%s) -> %s', bytes_as_string(values), bytes_as_string(result))
 
         return result
 
 
+class BusynWatcher(object):
+    """ Notifies the rising edges of a BUSYN signal, using the event detection of the GPIO
+    module.
+
+    `wait_for_edge` only reports the edges occurring after it has been called, so that
+    the end of a move happening between the check of the signal level and the call is
+    missed. The edges are counted here instead, and a waiter takes the count (see
+    :py:meth:`arm`) before checking the level, the edges occurring afterwards being then
+    never lost.
+
+    A single watcher exists per pin, the GPIO modules supporting a single event detection
+    per pin. Other parties can be notified of the edges via :py:meth:`add_callback`.
+    """
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, pin):
+        self.pin = pin
+        self._changed = threading.Condition()
+        self._edges = 0
+        self._callbacks = []
+        GPIO.add_event_detect(pin, GPIO.RISING, callback=self._edge_detected)
+
+    @classmethod
+    def get(cls, pin):
+        """ Returns the watcher of a pin, creating it if needed.
+
+        :param int pin: the GPIO number of the signal
+        :return: the watcher, None if the GPIO module does not support event detection, or
+        if it cannot be used on the pin (e.g. because of an event detection already set on it)
+        :rtype: BusynWatcher
+        """
+        with cls._instances_lock:
+            try:
+                return cls._instances[pin]
+            except KeyError:
+                try:
+                    watcher = cls(pin)
+                except (AttributeError, RuntimeError):
+                    watcher = None
+                cls._instances[pin] = watcher
+                return watcher
+
+    def _edge_detected(self, channel):
+        with self._changed:
+            self._edges += 1
+            self._changed.notify_all()
+        for callback in self._callbacks:
+            callback(channel)
+
+    def add_callback(self, callback):
+        """ Registers a callable invoked with the pin number for each edge, in the thread
+        of the GPIO module.
+        """
+        # copy on write, so that the notification can iterate without locking
+        self._callbacks = self._callbacks + [callback]
+
+    def arm(self):
+        """ Returns the token to be passed to :py:meth:`wait` for waiting for the edges
+        occurring from now on.
+        """
+        return self._edges
+
+    def wait(self, token, timeout):
+        """ Waits for an edge occurring since :py:meth:`arm` returned the token.
+
+        :param token: the value returned by :py:meth:`arm`
+        :param float timeout: the maximum wait time, in seconds
+        :return: True if an edge occurred, False if timeout
+        :rtype: bool
+        """
+        with self._changed:
+            if self._edges == token:
+                self._changed.wait(timeout)
+            return self._edges != token
+
+
 class DSPIN(object):
     """ Model of the dSPIN module.
     """
     DEFAULT_MOVE_TIMEOUT = 30       # seconds
-
-    def __init__(self, spi, standby_pin, busyn_pin, logger=None):
+    #: max delay between two invocations of the callback in move completion waits (seconds)
+    WAIT_CB_PERIOD = 0.1
+    #: busy signal polling period, when edge detection is not available (seconds)
+    WAIT_POLL_PERIOD = 0.001
+    #: the timeout of a move which duration is estimated is: estimated duration * factor + margin
+    TIMEOUT_FACTOR = 1.5
+    TIMEOUT_MARGIN = 0.5
+    #: how long before the expected end of a move the watch of the busy signal starts (seconds)
+    PRE_COMPLETION_MARGIN = 0.02
+
+    def __init__(self, spi, standby_pin, busyn_pin, logger=None, shadow=False):
         """
         :param DSPinSpiDev spi: the SPI device instance, which can be shared by several dSPINs
         :param int standby_pin: GPIO number of the standby signal
         :param int busyn_pin: GPIO number of the busy signal
         :param logger: optional logger. If None, a new one will be created
+        :param bool shadow: if True, keep a shadow of the registers for skipping redundant writes
         """
         if not spi:
             raise ValueError('spi parameter missing')
@@ -92,8 +364,166 @@ class DSPIN(object):
         self._spi = spi
         self._standby_pin = standby_pin
         self._busyn_pin = busyn_pin
+        self._busyn_edge_detect = hasattr(GPIO, 'add_event_detect')
         self.logger = logger or pkg_log.getChild(self.__class__.__name__)
 
+        # reusable commands, saving allocations in frequently called methods
+        self._cmd_get_param = commands.GetParam(Register.STATUS)
+        self._cmd_set_param = commands.SetParam(Register.MARK, 0)
+        self._cmd_run = commands.Run()
+        self._cmd_move = commands.Move()
+        self._cmd_goto = commands.GoTo(0)
+        self._cmd_goto_dir = commands.GoToDir(Direction.FWD, 0)
+        self._cmd_go_until = commands.GoUntil()
+        self._cmd_release_sw = commands.ReleaseSW()
+
+        #: the registers shadow (see :py:class:`RegisterShadow`), None if not used
+        self.shadow = RegisterShadow(self.device_count) if shadow else None
+
+        # the emergency stop frames, ready to be sent to all the devices at once
+        self._stop_frames = (
+            bytearray([commands.OpCodes.HARD_STOP] * self.device_count),
+            bytearray([commands.OpCodes.HARD_HIZ] * self.device_count),
+        )
+        #: the trigger-to-bus latency of the last emergency stop (seconds)
+        self.last_stop_latency = None
+
+        # the transactions in progress (see :py:meth:`transaction`), the count sparing the
+        # thread local lookup when there is none
+        self._tx_local = threading.local()
+        self._tx_lock = threading.Lock()
+        self._tx_count = 0
+
+        #: the commands and waits metrics (see :py:mod:`metrics`), None if not collected
+        self.metrics = None
+        if metrics.ENABLED:
+            self.enable_metrics()
+
+    def enable_metrics(self, registry=None):
+        """ Starts collecting the metrics of this instance and of its SPI device.
+
+        :param MetricsRegistry registry: the registry of the metrics (default: :py:data:`metrics.REGISTRY`)
+        """
+        registry = registry or metrics.REGISTRY
+        spi = self._spi
+        if hasattr(spi, 'enable_metrics'):
+            spi.enable_metrics(registry)
+        self.metrics = metrics.DeviceMetrics(
+            registry, device=self.__class__.__name__,
+            bus=getattr(spi, '_bus', ''), dev=getattr(spi, '_dev', '')
+        )
+
+    def disable_metrics(self):
+        self.metrics = None
+        if hasattr(self._spi, 'disable_metrics'):
+            self._spi.disable_metrics()
+
+    def _record_wait(self, started, expected_duration=None):
+        """ Records the metrics of a completed move wait.
+
+        :param float started: when the wait started, as given by :py:func:`metrics.clock`
+        :param float expected_duration: the expected duration of the move, counted from the
+        start of the wait, if known
+        """
+        m = self.metrics
+        elapsed = metrics.clock() - started
+        m.wait.observe(elapsed)
+        if expected_duration is not None:
+            m.overshoot.observe(elapsed - expected_duration)
+
+    @property
+    def device_count(self):
+        """ The number of devices controlled by this instance. """
+        return 1
+
+    def invalidate_shadow(self, devices=None):
+        """ Forgets the shadowed registers values, if the shadow is used.
+
+        This is done automatically when the devices are reset, and must be done explicitly
+        if they have been reset or reconfigured behind our back.
+
+        :param iterable devices: the positions of the devices (default: all)
+        """
+        if self.shadow is not None:
+            self.shadow.invalidate(devices)
+
+    @contextmanager
+    def transaction(self):
+        """ Context manager deferring the register writes and the commands issued by the current
+        thread up to the end of the block, where they are sent in a single burst (see
+        :py:mod:`transaction`).
+
+        Transactions can be nested, the requests being sent when the outermost one ends. If
+        the block raises an exception, nothing is sent.
+
+        :return: the transaction
+        :rtype: Transaction
+        """
+        local = self._tx_local
+        tx = getattr(local, 'transaction', None)
+        if tx is not None:
+            yield tx
+            return
+
+        tx = local.transaction = Transaction(self)
+        with self._tx_lock:
+            self._tx_count += 1
+        try:
+            yield tx
+        finally:
+            local.transaction = None
+            with self._tx_lock:
+                self._tx_count -= 1
+        self._commit(tx)
+
+    def _current_transaction(self):
+        """ Returns the transaction in progress in the current thread, None if none.
+        """
+        return getattr(self._tx_local, 'transaction', None) if self._tx_count else None
+
+    def _defer(self, requests):
+        """ Queues requests in the transaction in progress in the current thread, unless their
+        reply is needed.
+
+        :param list requests: the requests, one per device (None for devices not involved)
+        :return: True if the requests have been queued
+        :rtype: bool
+        """
+        tx = self._current_transaction()
+        if tx is None or any(r and commands.OpCodes.expects_reply(r[0]) for r in requests):
+            return False
+        for device, r in enumerate(requests):
+            if r:
+                tx.command(device, bytearray(r))
+        return True
+
+    def _commit(self, tx):
+        """ Sends the requests queued by a transaction.
+        """
+        messages, writes = tx.messages()
+        if all(m is None for m in messages):
+            return
+        try:
+            self._xfer_messages(messages)
+        except Exception:
+            # the content of the registers is unknown
+            self.invalidate_shadow([d for d, w in enumerate(writes) if w])
+            raise
+        shadow = self.shadow
+        if shadow is not None:
+            for device, device_writes in enumerate(writes):
+                for reg, value in device_writes:
+                    shadow.update(device, reg, value)
+
+    def _xfer_messages(self, messages):
+        """ Sends a message to each device in a single transfer.
+
+        :param list messages: the messages, one per device (None for devices not involved)
+        :return: the list of replies, one per device (None for devices not involved)
+        :rtype: list
+        """
+        return [self._xfer(list(messages[0]))]
+
     def power_on_reset(self):
         """ Performs initializations which are supposed to be done
         once for all the devices.
@@ -103,6 +533,8 @@ class DSPIN(object):
         GPIO.setup(self._busyn_pin, GPIO.IN)
         self.logger.debug('GPIO.IN busy setup ok')
 
+        self.invalidate_shadow()
+
         self._spi.open()
 
         # reset the chip by switching to standby mode and then waking up back
@@ -161,6 +593,8 @@ class DSPIN(object):
         """ Goes standby
         """
         GPIO.output(self._standby_pin, GPIO.LOW)
+        # the chip is reset when going standby
+        self.invalidate_shadow()
 
     def awake(self):
         """ Awakes and wait enough for everybody ready (min: 45us + 650us)
@@ -179,29 +613,56 @@ class DSPIN(object):
         :return: the data returned by the dSPIN
         :rtype: list
         """
+        if self._tx_count and self._defer([data]):
+            return [0] * len(data)
+        if self.metrics is not None and data and data[0]:
+            self.metrics.commands.count(data[0])
         return self._spi.xfer(data)
 
+    def _xfer_command(self, command):
+        """ Sends a command, encoding it straight into the SPI transmit buffer.
+
+        :param commands.Command command: the command
+        :return: the receive buffer, containing the reply in its first bytes. Its content remains valid up
+        to the next transfer on the bus.
+        :rtype: bytearray
+        """
+        if self._tx_count and self._defer([command.as_request()]):
+            return bytearray(command.size)
+        spi = self._spi
+        with spi.lock:
+            length = command.encode_into(spi.tx_buffer)
+            if self.metrics is not None and spi.tx_buffer[0]:
+                self.metrics.commands.count(spi.tx_buffer[0])
+            return spi.xfer_buffer(length)
+
     def read_register(self, reg):
         """ Reads a register and returns its value.
 
         :param reg: the register to be read, as one of the Register.XXXX predefined values.
         :return: the register value
         """
-        if self.logger.getEffectiveLevel() == log.DEBUG:
+        if self.logger.isEnabledFor(log.DEBUG):
             self.logger.debug('DSPIN.read_register(%s)...', reg.name)
-        value_bytes = self._xfer(commands.GetParam(reg).as_request())[1:]
-        result = self.parse_register_reply(reg, value_bytes)
-        if self.logger.getEffectiveLevel() == log.DEBUG:
+        with self._spi.lock:
+            cmd = self._cmd_get_param
+            cmd.register = reg
+            result = codec_for(reg).decode(self._xfer_command(cmd), 1)
+        if self.shadow is not None:
+            self.shadow.update(0, reg, result)
+        if self.logger.isEnabledFor(log.DEBUG):
             self.logger.debug(' -> 0x%x', result)
         return result
 
     def parse_register_reply(self, reg, value_bytes):
-        mask = 0xffffffff >> (32 - reg.size)
-        raw_value = reduce(lambda a, b: (a << 8) | b, value_bytes) & mask
-        if reg.signed:
-            if raw_value & (1 << (reg.size - 1)):
-                return raw_value - (1 << reg.size)
-        return raw_value
+        """ Decodes a register value.
+
+        :param RegisterDefinition reg: the register
+        :param value_bytes: the bytes of the value (i.e. the reply to GetParam, the first
+        byte excluded)
+        :return: the register value
+        """
+        return codec_for(reg).decode(value_bytes)
 
     def write_register(self, reg, value):
         """ Changes a register value.
@@ -209,12 +670,30 @@ class DSPIN(object):
         Care is taken to format the SPI request according to the register properties
         (address, size,...)
 
+        If the registers shadow is used, the write is skipped when the register is known
+        to contain the value already.
+
         :param reg: the register to be written, as one of the Register.XXXX predefined values.
         :param int value: the value to be written
         """
-        if self.logger.getEffectiveLevel() == log.DEBUG:
+        tx = self._current_transaction()
+        if tx is not None:
+            tx.write(0, reg, value)
+            return
+
+        shadow = self.shadow
+        if shadow is not None and shadow.is_current(0, reg, value):
+            return
+
+        if self.logger.isEnabledFor(log.DEBUG):
             self.logger.debug('write_register(%s, 0x%x)', reg.name, value)
-        self._xfer(commands.SetParam(reg, value).as_request())
+        with self._spi.lock:
+            cmd = self._cmd_set_param
+            cmd.register, cmd.value = reg, value
+            self._xfer_command(cmd)
+
+        if shadow is not None:
+            shadow.update(0, reg, value)
 
     @staticmethod
     def _register_as_property(reg):
@@ -324,7 +803,11 @@ class DSPIN(object):
         :param int direction: one of :py:class:`Direction` predefined values
         :param int steps_per_sec: speed in steps/s (accounting micro-stepping)
         """
-        self._xfer(commands.Run(direction, steps_per_sec).as_request())
+        # the reusable command must not be modified by another thread before being sent
+        with self._spi.lock:
+            cmd = self._cmd_run
+            cmd.direction, cmd.speed = direction, steps_per_sec
+            self._xfer_command(cmd)
 
     def step_clock(self, direction):
         """ Moves one step in the given direction.
@@ -340,11 +823,16 @@ class DSPIN(object):
         :param int steps: number of steps (accounting micro-stepping)
         :param bool wait: wait until the move is finished before returning
         :param wait_cb: an optional callback to be called while waiting
-        :param timeout: the max wait time in seconds
+        :param timeout: the max wait time in seconds, None for deriving it from the estimated
+        duration of the move
         """
-        self._xfer(commands.Move(direction, steps).as_request())
+        expected = self.estimate_move_durations([steps])[0] if wait and timeout is None else None
+        with self._spi.lock:
+            cmd = self._cmd_move
+            cmd.direction, cmd.steps = direction, steps
+            self._xfer_command(cmd)
         if wait:
-            self.wait_for_move_complete(wait_cb, timeout=timeout)
+            self._wait_for_estimated_move(wait_cb, timeout, expected)
 
     def goto(self, position, wait=True, wait_cb=None, timeout=DEFAULT_MOVE_TIMEOUT):
         """ Moves to a given absolute position, optimizing the direction.
@@ -352,11 +840,16 @@ class DSPIN(object):
         :param int position: the target position (accounting micro-stepping)
         :param bool wait: wait until the move is finished before returning
         :param wait_cb: an optional callback to be called while waiting
-        :param timeout: the max wait time in seconds
+        :param timeout: the max wait time in seconds, None for deriving it from the estimated
+        duration of the move
         """
-        self._xfer(commands.GoTo(position).as_request())
+        expected = self.estimate_goto_durations([position])[0] if wait and timeout is None else None
+        with self._spi.lock:
+            cmd = self._cmd_goto
+            cmd.position = position
+            self._xfer_command(cmd)
         if wait:
-            self.wait_for_move_complete(wait_cb, timeout=timeout)
+            self._wait_for_estimated_move(wait_cb, timeout, expected)
 
     def goto_dir(self, direction, position, wait=True, wait_cb=None, timeout=DEFAULT_MOVE_TIMEOUT):
         """ Same as :py:meth:`goto`, but imposing the diection.
@@ -365,11 +858,16 @@ class DSPIN(object):
         :param int position: the target position (accounting micro-stepping)
         :param bool wait: wait until the move is finished before returning
         :param wait_cb: an optional callback to be called while waiting
-        :param timeout: the max wait time in seconds
+        :param timeout: the max wait time in seconds, None for deriving it from the estimated
+        duration of the move
         """
-        self._xfer(commands.GoToDir(direction, position).as_request())
+        expected = self.estimate_goto_durations([position], [direction])[0] if wait and timeout is None else None
+        with self._spi.lock:
+            cmd = self._cmd_goto_dir
+            cmd.direction, cmd.position = direction, position
+            self._xfer_command(cmd)
         if wait:
-            self.wait_for_move_complete(wait_cb, timeout=timeout)
+            self._wait_for_estimated_move(wait_cb, timeout, expected)
 
     def go_home(self, wait=True, wait_cb=None, timeout=DEFAULT_MOVE_TIMEOUT):
         """ Returns to home position (abs pos = 0), using the shortest path.
@@ -380,7 +878,7 @@ class DSPIN(object):
         """
         self._xfer(commands.GO_HOME_REQUEST)
         if wait:
-            self.wait_for_move_complete(wait_cb, timeout=timeout)
+            self._wait_for_estimated_move(wait_cb, timeout, None)
 
     def go_mark(self, wait=True, wait_cb=None, timeout=DEFAULT_MOVE_TIMEOUT):
         """ Returns to a previously marked position, using the shortest path.
@@ -391,7 +889,7 @@ class DSPIN(object):
         """
         self._xfer(commands.GO_MARK_REQUEST)
         if wait:
-            self.wait_for_move_complete(wait_cb, timeout=timeout)
+            self._wait_for_estimated_move(wait_cb, timeout, None)
 
     def go_until(self, action, direction, steps_per_sec, wait=True, wait_cb=None, timeout=DEFAULT_MOVE_TIMEOUT):
         """ Runs in the given direction, until the switch is closed.
@@ -405,9 +903,12 @@ class DSPIN(object):
         :param wait_cb: an optional callback to be called while waiting
         :param timeout: the max wait time in seconds
         """
-        self._xfer(commands.GoUntil(action, direction, steps_per_sec).as_request())
+        with self._spi.lock:
+            cmd = self._cmd_go_until
+            cmd.action, cmd.direction, cmd.speed = action, direction, steps_per_sec
+            self._xfer_command(cmd)
         if wait:
-            self.wait_for_move_complete(wait_cb, timeout=timeout)
+            self._wait_for_estimated_move(wait_cb, timeout, None)
 
     def release_sw(self, action, direction, wait=True, wait_cb=None, timeout=DEFAULT_MOVE_TIMEOUT):
         """ Runs in the given direction, until the switch is released.
@@ -421,9 +922,12 @@ class DSPIN(object):
         :param wait_cb: an optional callback to be called while waiting
         :param timeout: the max wait time in seconds
         """
-        self._xfer(commands.ReleaseSW(action, direction).as_request())
+        with self._spi.lock:
+            cmd = self._cmd_release_sw
+            cmd.action, cmd.direction = action, direction
+            self._xfer_command(cmd)
         if wait:
-            self.wait_for_move_complete(wait_cb, timeout=timeout)
+            self._wait_for_estimated_move(wait_cb, timeout, None)
 
     def reset_pos(self):
         """ Resets the absolute position indicator.
@@ -434,6 +938,7 @@ class DSPIN(object):
         """ Resets the device in initial conditions (same effect as standby/awake cycle).
         """
         self._xfer(commands.RESET_DEVICE_REQUEST)
+        self.invalidate_shadow()
 
     def soft_stop(self, wait=True, wait_cb=None, timeout=DEFAULT_MOVE_TIMEOUT):
         """ Performs a soft stop.
@@ -442,14 +947,15 @@ class DSPIN(object):
         :param wait_cb: an optional callback to be called while waiting
         :param timeout: the max wait time in seconds
         """
-        self._xfer(commands.SOFT_STOP_REQUEST)
+        with thread_priority(Priority.URGENT):
+            self._xfer(commands.SOFT_STOP_REQUEST)
         if wait:
-            self.wait_for_move_complete(wait_cb, timeout=timeout)
+            self._wait_for_estimated_move(wait_cb, timeout, None)
 
     def hard_stop(self):
-        """ Performs a hard stop.
+        """ Performs a hard stop, using the emergency stop path.
         """
-        self._xfer(commands.HARD_STOP_REQUEST)
+        self.emergency_stop()
 
     def soft_hi_Z(self, wait=True, wait_cb=None, timeout=DEFAULT_MOVE_TIMEOUT):
         """ Performs a soft stop and puts the bridge in HiZ state.
@@ -458,14 +964,50 @@ class DSPIN(object):
         :param wait_cb: an optional callback to be called while waiting
         :param timeout: the max wait time in seconds
         """
-        self._xfer(commands.SOFT_HIZ_REQUEST)
+        with thread_priority(Priority.URGENT):
+            self._xfer(commands.SOFT_HIZ_REQUEST)
         if wait:
-            self.wait_for_move_complete(wait_cb, timeout=timeout)
+            self._wait_for_estimated_move(wait_cb, timeout, None)
 
     def hard_hi_Z(self):
-        """ Performs a hard stop and puts the bridge in HiZ state.
+        """ Performs a hard stop and puts the bridge in HiZ state, using the emergency stop path.
+        """
+        self.emergency_stop(hi_z=True)
+
+    def emergency_stop(self, hi_z=False, triggered_at=None):
+        """ Stops all the devices immediately.
+
+        The pre-encoded HardStop (or HardHiZ) frame is sent in a single transfer. The bus is
+        requested with the URGENT priority, and is thus granted as soon as the transaction in
+        progress, if any, is complete, before any other pending one.
+
+        :param bool hi_z: if True, the bridges are put in HiZ state
+        :param float triggered_at: the time of the event triggering the stop, as given by
+        :py:func:`metrics.clock`. If None, the latency is measured from the call.
+        :return: the trigger-to-bus latency, i.e. the delay between the trigger and the end of
+        the transfer (seconds)
+        :rtype: float
         """
-        self._xfer(commands.HARD_HIZ_REQUEST)
+        start = metrics.clock() if triggered_at is None else triggered_at
+        frame = self._stop_frames[hi_z]
+        length = len(frame)
+        spi = self._spi
+        spi.lock.acquire(Priority.URGENT)
+        try:
+            spi.tx_buffer[:length] = frame
+            spi.xfer_buffer(length, length)
+        finally:
+            spi.lock.release()
+        latency = self.last_stop_latency = metrics.clock() - start
+
+        # bookkeeping is done once the devices are stopped
+        m = self.metrics
+        if m is not None:
+            m.stop_latency.observe(latency)
+            for _ in range(length):
+                m.commands.count(frame[0])
+        self.logger.info('emergency stop sent (latency: %.1f us)', latency * 1e6)
+        return latency
 
     def is_moving(self):
         """ Tells if the motor is moving, by checking the busy signal.
@@ -474,51 +1016,239 @@ class DSPIN(object):
         """
         return GPIO.input(self._busyn_pin) == GPIO.LOW
 
-    def wait_for_move_complete(self, callback=None, timeout=DEFAULT_MOVE_TIMEOUT):
+    def profile_parameters(self, snapshot=None):
+        """ Returns the speed profile parameters of the devices.
+
+        The shadowed register values are used if available, otherwise the registers are read.
+
+        :param RegisterSnapshot snapshot: a snapshot containing the profile registers, if already read
+        :return: the parameters, one item per device
+        :rtype: list of ProfileParameters
+        """
+        devices = range(self.device_count)
+        shadow = self.shadow
+        if snapshot is None and shadow is not None:
+            values = [[shadow.get(d, r) for r in PROFILE_REGISTERS] for d in devices]
+            if all(v is not None for device_values in values for v in device_values):
+                return [ProfileParameters.from_registers(*device_values) for device_values in values]
+        if snapshot is None:
+            snapshot = self.read_registers(PROFILE_REGISTERS)
+        return [ProfileParameters.from_registers(*(snapshot[d, r] for r in PROFILE_REGISTERS)) for d in devices]
+
+    def estimate_move_durations(self, steps):
+        """ Estimates the durations of Move commands, started at rest.
+
+        :param list steps: the number of steps of each device, None for devices not moving
+        :return: the durations in seconds, None for devices not moving
+        :rtype: list
+        """
+        return [
+            move_duration(abs(n), p) if n is not None else None
+            for n, p in zip(steps, self.profile_parameters())
+        ]
+
+    def estimate_goto_durations(self, positions, directions=None):
+        """ Estimates the durations of GoTo or GoToDir commands, started at rest.
+
+        :param list positions: the target position of each device, None for devices not moving
+        :param list directions: the imposed directions (GoToDir), None for the shortest path (GoTo)
+        :return: the durations in seconds, None for devices not moving
+        :rtype: list
+        """
+        snapshot = self.read_registers((Register.ABS_POS,) + PROFILE_REGISTERS)
+        result = []
+        for d, (target, params) in enumerate(zip(positions, self.profile_parameters(snapshot))):
+            if target is None:
+                result.append(None)
+                continue
+            direction = directions[d] if directions is not None else None
+            _, distance = goto_distance(snapshot[d, Register.ABS_POS], target, direction)
+            result.append(move_duration(distance, params))
+        return result
+
+    def _wait_for_estimated_move(self, callback, timeout, expected):
+        """ Waits for the end of a move which duration may have been estimated, the timeout
+        being derived from the estimation if not provided (the default one being used if the
+        duration is not estimated either).
+
+        :param float expected: the estimated duration of the move, or of the longest one of a
+        set of concurrent moves (None if not estimated)
+        """
+        if timeout is None:
+            timeout = self._estimated_timeout(expected)
+        self.wait_for_move_complete(callback, timeout=timeout, expected_duration=expected)
+
+    def _estimated_timeout(self, expected):
+        """ Returns the timeout of a move derived from its estimated duration, or the default
+        one if not estimated.
+        """
+        if expected is None:
+            return self.DEFAULT_MOVE_TIMEOUT
+        return expected * self.TIMEOUT_FACTOR + self.TIMEOUT_MARGIN
+
+    def wait_for_move_complete(self, callback=None, timeout=DEFAULT_MOVE_TIMEOUT, expected_duration=None):
         """ Waits until the current move is complete.
 
         If provided, the callback will be invoked while executing
         the in the monitoring loop, with the dSPIN instance as argument.
         It can return `True` for ending the wait.
 
+        The end of the move is detected by waiting for the rising edge of the busy signal,
+        using the edge detection of the GPIO module if available. The wait is sliced so that
+        the callback is invoked every :py:attr:`WAIT_CB_PERIOD` seconds. If edge detection
+        is not available, the busy signal is polled every :py:attr:`WAIT_POLL_PERIOD` seconds.
+
+        If the expected duration of the move is provided, the wait starts by sleeping until
+        shortly before the move end (see :py:attr:`PRE_COMPLETION_MARGIN`).
+
         :param callback: the callback to invoke while waiting
         :param timeout: the max wait time in seconds
+        :param float expected_duration: the expected duration of the move (seconds)
         """
         if hasattr(GPIO, 'FAKE'):
             self.logger.warn('not on a real RasPi => bypassing wait_for_move_complete')
             return
 
         self.logger.info('wait for move completion... (%s callback)', 'with' if callback else 'no')
-        time_limit = time.time() + timeout
+        # the metrics use their own clock
+        started = metrics.clock()
+        now = time.time()
+        time_limit = now + timeout
+
+        if expected_duration is not None:
+            wake_up = min(now + expected_duration - self.PRE_COMPLETION_MARGIN, time_limit)
+            while now < wake_up:
+                if callback and callback(self):
+                    self.logger.debug('callback returned True')
+                    return
+                time.sleep(min(wake_up - now, self.WAIT_CB_PERIOD))
+                now = time.time()
 
         try:
             while GPIO.input(self._busyn_pin) == GPIO.LOW:
                 if callback and callback(self):
                     self.logger.debug('callback returned True')
                     break
-                if time.time() >= time_limit:
+                remaining = time_limit - time.time()
+                if remaining <= 0:
                     raise CommandTimeOut()
-                time.sleep(0.1)
+                self._wait_busyn_edge(min(remaining, self.WAIT_CB_PERIOD))
+            else:
+                if self.metrics is not None:
+                    self._record_wait(started, expected_duration)
 
         except CommandTimeOut:
-            self.logger.error('timeout reached (%d seconds)')
+            self.logger.error('timeout reached (%s seconds)', timeout)
+            if self.metrics is not None:
+                self.metrics.timeouts.inc()
             raise
 
         else:
             self.logger.info('wait complete')
 
+    def _wait_busyn_edge(self, max_wait):
+        """ Waits for the rising edge of the busy signal, or at most the given delay.
+
+        The edge detection is armed before checking the signal level, so that an end of
+        move occurring in between is not missed. Falls back to polling if the GPIO module
+        does not support edge detection, or if it cannot be used on the busy signal pin
+        (e.g. because of an event detection already set on it by another party).
+
+        :param float max_wait: the maximum wait time, in seconds
+        :return: True if the edge has been seen, False if the signal was already released
+        or if the wait timed out (always False when polling)
+        :rtype: bool
+        """
+        if self._busyn_edge_detect:
+            watcher = BusynWatcher.get(self._busyn_pin)
+            if watcher is not None:
+                token = watcher.arm()
+                if GPIO.input(self._busyn_pin) == GPIO.HIGH:
+                    return False
+                return watcher.wait(token, max_wait)
+
+            self.logger.warn('BUSYN edge detection not available => polling')
+            self._busyn_edge_detect = False
+
+        time.sleep(min(max_wait, self.WAIT_POLL_PERIOD))
+        return False
+
+    def _xfer_all(self, request):
+        """ Sends the same request to all the devices.
+
+        :param list request: the request
+        :return: the list of replies, one per device
+        :rtype: list
+        """
+        return [self._xfer(list(request))]
+
+    _registers_read_requests = {}
+
+    @classmethod
+    def _registers_read_request(cls, regs):
+        """ Returns the request reading a set of registers in a row, and the slices of
+        the reply containing the values. They are cached since they depend only on the registers.
+        """
+        try:
+            return cls._registers_read_requests[regs]
+        except KeyError:
+            request = []
+            for reg in regs:
+                request.extend(commands.GetParam(reg).as_request())
+            result = cls._registers_read_requests[regs] = (request, RegisterSetCodec.get(regs).offsets)
+            return result
+
+    def read_registers(self, regs=None):
+        """ Reads a set of registers in a single bus transaction.
+
+        The GetParam requests are concatenated in one message, instead of being sent
+        separately. The replies of all the devices are decoded in a single pass (see
+        :py:class:`codec.RegisterSetCodec`).
+
+        :param iterable regs: the registers to be read, as definitions or names (default: all)
+        :return: the registers values
+        :rtype: RegisterSnapshot
+        """
+        regs = tuple(as_register(r) for r in regs) if regs else ALL_REGISTERS
+        request, _ = self._registers_read_request(regs)
+
+        values = RegisterSetCodec.get(regs).decode_replies(self._xfer_all(request))
+        snapshot = RegisterSnapshot(regs, self.device_count, values)
+        shadow = self.shadow
+        if shadow is not None:
+            i = 0
+            for device in range(self.device_count):
+                for reg in regs:
+                    shadow.update(device, reg, values[i])
+                    i += 1
+
+        return snapshot
+
+    def snapshot(self):
+        """ Reads all the registers in a single bus transaction.
+
+        :rtype: RegisterSnapshot
+        """
+        return self.read_registers()
+
     def get_all_registers(self):
         """ Returns the current content of all the registers as a list of tuples (name, value).
 
         :rtype: list
         """
-        return [(n, getattr(self, n)) for n in Register.ALL]
+        return self.snapshot().device(0)
 
 
 class CommandTimeOut(Exception):
     pass
 
 
+class UnsupportedOperation(RuntimeError):
+    """ Raised by the proxies of a device (remote or member of a chain) for the operations
+    only the owner of the hardware can perform.
+    """
+
+
 def bytes_as_string(data):
     return ', '.join(('0x%0x' % b for b in data))
 
@@ -1,12 +1,49 @@
 # -*- coding: utf-8 -*-
 
-from .core import DSPIN, bytes_as_string, values_as_string
-from .defs import Register, Status
-from . import commands, log
+import time
+
+from . import GPIO
+from .core import DSPIN, CommandTimeOut, bytes_as_string, values_as_string
+from .arbiter import Priority, thread_priority
+from .axes import AxisProxy, FrameCoalescer
+from .codec import codec_for
+from .completion import CompletionTracker
+from .defs import Register, Status, Direction
+from . import commands, log, metrics, vectorized
 
 __author__ = 'Eric Pascual'
 
 
+# the parameters setters of the pooled commands (see DaisyChain._send_pooled)
+
+def _set_direction(cmd, direction):
+    cmd.direction = direction
+
+
+def _set_position(cmd, position):
+    cmd.position = position
+
+
+def _set_direction_speed(cmd, params):
+    cmd.direction, cmd.speed = params
+
+
+def _set_direction_steps(cmd, params):
+    cmd.direction, cmd.steps = params
+
+
+def _set_direction_position(cmd, params):
+    cmd.direction, cmd.position = params
+
+
+def _set_action_direction_speed(cmd, params):
+    cmd.action, cmd.direction, cmd.speed = params
+
+
+def _set_action_direction(cmd, params):
+    cmd.action, cmd.direction = params
+
+
 class DaisyChain(DSPIN):
     """ This class implements a control interface for several dSPIN chips
     connected in daisy-chain configuration.
@@ -19,26 +56,63 @@ class DaisyChain(DSPIN):
     inherited from the superclass are the same. Refer to their documentation for
     detail.
     """
-    def __init__(self, chain_length, spi, standby_pin, busyn_pin, logger):
+    def __init__(self, chain_length, spi, standby_pin, busyn_pin, logger, frame_burst=True, shadow=False,
+                 track_completion=False):
+        """
+        :param int chain_length: the number of dSPINs in the chain
+        :param DSPinSpiDev spi: the SPI device instance
+        :param int standby_pin: GPIO number of the standby signal
+        :param int busyn_pin: GPIO number of the busy signal
+        :param logger: optional logger. If None, a new one will be created
+        :param bool frame_burst: send the whole chain frame as a single multi-segment
+        transfer when the SPI device supports it (default: True)
+        :param bool shadow: if True, keep a shadow of the registers of each device for skipping
+        redundant writes
+        :param bool track_completion: if True, the completion of the moves is tracked per device
+        by polling the STATUS registers instead of waiting for the shared BUSYN signal
+        """
         if chain_length <= 1:
             raise ValueError('chain length must be > 1')
 
-        super(DaisyChain, self).__init__(spi, standby_pin, busyn_pin, logger=logger)
-
+        # must be known before the superclass initializes the shadow
         self._chain_length = chain_length
 
+        super(DaisyChain, self).__init__(spi, standby_pin, busyn_pin, logger=logger, shadow=shadow)
+
+        self._frame_burst = frame_burst and hasattr(spi, 'xfer_segments')
+
+        # per device reusable commands, modified and encoded under the bus lock only
+        self._cmds_run = [commands.Run() for _ in range(chain_length)]
+        self._cmds_step_clock = [commands.StepClock() for _ in range(chain_length)]
+        self._cmds_move = [commands.Move() for _ in range(chain_length)]
+        self._cmds_goto = [commands.GoTo(0) for _ in range(chain_length)]
+        self._cmds_goto_dir = [commands.GoToDir(Direction.FWD, 0) for _ in range(chain_length)]
+        self._cmds_go_until = [commands.GoUntil() for _ in range(chain_length)]
+        self._cmds_release_sw = [commands.ReleaseSW() for _ in range(chain_length)]
+        # NumPy view of the transmit buffer, created when first needed
+        self._tx_array = None
+
+        #: the per device moves completion tracker (see :py:class:`CompletionTracker`), None if not used
+        self.completion_tracker = CompletionTracker(self) if track_completion else None
+        self._coalescer = None
+
     def __len__(self):
         return self._chain_length
 
+    @property
+    def device_count(self):
+        return self._chain_length
+
     def read_register(self, reg):
         self.logger.debug('DaisyChain.read_register(%s)...', reg.name)
 
         replies = self._xfer([commands.GetParam(reg).as_request()] * self._chain_length)
 
-        values = [
-            self.parse_register_reply(reg, r[1:])
-            for r in replies
-        ]
+        decode = codec_for(reg).decode
+        values = [decode(r, 1) for r in replies]
+        if self.shadow is not None:
+            for i, v in enumerate(values):
+                self.shadow.update(i, reg, v)
         if self.logger.isEnabledFor(log.DEBUG):
             self.logger.debug(' -> [%s]', bytes_as_string(values))
         return values
@@ -50,51 +124,211 @@ class DaisyChain(DSPIN):
         except TypeError:
             # data parameter is a scalar, so we execute a broadcast
             self.logger.debug('write_register(%s, 0x%x)', reg.name, data)
-            requests = [commands.SetParam(reg, data).as_request()] * self._chain_length
+            data = [data] * self._chain_length
 
         else:
             if self.logger.isEnabledFor(log.DEBUG):
                 self.logger.debug('write_register(%s, [%s])', reg.name, values_as_string(data))
-            requests = [
-                commands.SetParam(reg, value).as_request() if value is not None else None
-                for value in data
+
+        tx = self._current_transaction()
+        if tx is not None:
+            for i, value in enumerate(data):
+                if value is not None:
+                    tx.write(i, reg, value)
+            return
+
+        shadow = self.shadow
+        if shadow is not None:
+            # leave out the devices already containing the value
+            data = [
+                None if value is None or shadow.is_current(i, reg, value) else value
+                for i, value in enumerate(data)
             ]
+            if all(value is None for value in data):
+                return
 
+        requests = [
+            commands.SetParam(reg, value).as_request() if value is not None else None
+            for value in data
+        ]
         self._xfer(requests)
 
+        if shadow is not None:
+            for i, value in enumerate(data):
+                if value is not None:
+                    shadow.update(i, reg, value)
+
     def _xfer(self, requests):
         if len(requests) != self._chain_length:
             raise ValueError(
                 'requests list length (%d) does not match chain one (%d)' % (len(requests), self._chain_length)
             )
+        if not any(requests):
+            # no device involved: nothing to send
+            return [None] * self._chain_length
+        if self._tx_count and self._defer(requests):
+            return [bytearray(len(r)) if r else None for r in requests]
 
         # find the longest request for padding them to the same size
         max_len = max((len(r) for r in requests if r))
 
-        # remember which dSPIN has requests for them
-        dist_list = [i for i, r in enumerate(requests) if r]
-
-        # build the complete data stream, by padding the requests to the highest
-        # size and adding dummy ones (all NOP) for devices not involved
-        padding = [0] * max_len
+        # build the complete data stream, column by column. The frame being zero
+        # initialized, the shorter requests are implicitly padded with NOPs, and so are
+        # the devices not involved
+        chain_length = self._chain_length
+        frame = bytearray(max_len * chain_length)
         for i, r in enumerate(requests):
             if r:
-                r.extend(padding[len(r):])
-            else:
-                requests[i] = padding
+                frame[i:i + len(r) * chain_length:chain_length] = r
+        if self.metrics is not None:
+            self._count_commands(frame)
+
+        replies = self._xfer_frame(frame)
+
+        # "dispatch" the replies, ignoring the ones to dummy requests
+        return [replies[i::chain_length] if r else None for i, r in enumerate(requests)]
+
+    def _count_commands(self, frame):
+        """ Updates the commands metrics with the first column of a frame.
+        """
+        count = self.metrics.commands.count
+        for opcode in frame[:self._chain_length]:
+            if opcode:
+                count(opcode)
+
+    def _xfer_frame(self, frame):
+        """ Sends a complete chain frame, made of the concatenation of the byte
+        columns, one byte per device in each column.
+
+        The CS line is released between the columns. When frame bursts are enabled,
+        the whole frame is sent in a single kernel transaction, otherwise each column
+        is transferred separately.
+
+        :param bytearray frame: the frame to be sent
+        :return: the replies, in the same layout as the frame
+        :rtype: list
+        """
+        chain_length = self._chain_length
+        if self._frame_burst:
+            return self._spi.xfer_segments(frame, chain_length)
+
+        # the columns must not be interleaved with other transfers
+        replies = []
+        with self._spi.lock:
+            for i in range(0, len(frame), chain_length):
+                replies.extend(self._spi.xfer2(frame[i:i + chain_length]))
+        return replies
+
+    def _xfer_commands(self, cmds):
+        """ Sends a command to each device, encoding them straight into the frame.
+
+        :param list cmds: the commands (instances of :py:class:`commands.Command`), `None`
+        being used for devices not involved (they receive NOPs)
+        :return: the buffer containing the replies frame in its first bytes, in the same layout
+        as the request one. Its content remains valid up to the next transfer on the bus.
+        :rtype: bytearray
+        """
+        chain_length = self._chain_length
+        size = 0
+        for cmd in cmds:
+            if cmd is not None and cmd.size > size:
+                size = cmd.size
+        length = size * chain_length
+        if self._tx_count and self._defer([cmd.as_request() if cmd is not None else None for cmd in cmds]):
+            return bytearray(length)
+
+        if not self._frame_burst:
+            buf = bytearray(length)
+            for i, cmd in enumerate(cmds):
+                if cmd is not None:
+                    cmd.encode_into(buf, i, chain_length)
+            if self.metrics is not None:
+                self._count_commands(buf)
+            return bytearray(self._xfer_frame(buf))
+
+        with self._spi.lock:
+            buf = self._spi.tx_buffer
+            for i, cmd in enumerate(cmds):
+                offset = cmd.encode_into(buf, i, chain_length) if cmd is not None else i
+                # pad with NOPs
+                while offset < length:
+                    buf[offset] = 0
+                    offset += chain_length
+            if self.metrics is not None:
+                self._count_commands(buf)
+            return self._spi.xfer_buffer(length, chain_length)
+
+    def _xfer_array(self, frame):
+        """ Sends a frame built by one of the :py:mod:`vectorized` encoders.
+
+        The transposition from the `(n_devices, n_bytes)` layout to the columns one is
+        done by NumPy while copying the frame into the transmit buffer.
+
+        :param numpy.ndarray frame: the frame, one row per device
+        :return: the buffer containing the replies frame in its first bytes, in the columns layout
+        :rtype: bytearray
+        """
+        chain_length, size = frame.shape
+        if chain_length != self._chain_length:
+            raise ValueError(
+                'frame rows count (%d) does not match chain length (%d)' % (chain_length, self._chain_length)
+            )
+        length = size * chain_length
+        if self._tx_count and self._defer([bytearray(row.tobytes()) if row.any() else None for row in frame]):
+            return bytearray(length)
+        if self.metrics is not None:
+            self._count_commands(frame[:, 0].tolist())
 
-        # time to send them now, and "dispatch" the replies
-        replies = zip(*[self._spi.xfer2(r) for r in zip(*requests)])
+        if not self._frame_burst:
+            return bytearray(self._xfer_frame(bytearray(frame.T.tobytes())))
 
-        # remove replies to dummy requests
-        return [r if i in dist_list else None for i, r in enumerate(replies)]
+        with self._spi.lock:
+            if self._tx_array is None:
+                self._tx_array = vectorized.numpy.frombuffer(self._spi.tx_buffer, dtype=vectorized.numpy.uint8)
+            self._tx_array[:length].reshape(size, chain_length)[:] = frame.T
+            return self._spi.xfer_buffer(length, chain_length)
+
+    def _xfer_messages(self, messages):
+        return self._xfer(messages)
+
+    def _xfer_command(self, command):
+        # sends the same command to all the devices
+        return self._xfer_commands([command] * self._chain_length)
+
+    @property
+    def coalescer(self):
+        """ The frame coalescer of the per axis proxies (see :py:class:`FrameCoalescer`),
+        created when first needed.
+        """
+        if self._coalescer is None:
+            self._coalescer = FrameCoalescer(self)
+        return self._coalescer
+
+    def axes(self):
+        """ Returns the proxies of the devices, each one having the API of a single
+        :py:class:`DSPIN` (see :py:mod:`axes`).
+
+        :rtype: list of AxisProxy
+        """
+        return [AxisProxy(self, d) for d in range(self._chain_length)]
+
+    def batch(self):
+        """ Context manager merging the requests of the axes proxies issued inside the
+        block (see :py:meth:`FrameCoalescer.batch`).
+        """
+        return self.coalescer.batch()
 
     def check_initial_config(self):
         return all((v == Register.CONFIG.reset_value for v in self.CONFIG))
 
     def broadcast_request(self, request):
-        requests = [request] * self._chain_length
-        return zip(*[self._spi.xfer2(p) for p in zip(*requests)])
+        return self._xfer([request] * self._chain_length)
+
+    _xfer_all = broadcast_request
+
+    def get_all_registers(self):
+        snapshot = self.snapshot()
+        return [(r.name, snapshot[r]) for r in snapshot.registers]
 
     def send_command(self, command, dist_list=None):
         """ Sends *the same command* with *same parameters* if any to a list of dSPINs.
@@ -104,10 +338,7 @@ class DaisyChain(DSPIN):
         """
         command_request = command.as_request()
         if dist_list:
-            nop = commands.Nop(len(command_request)).as_request()
-            requests = [command_request if d in dist_list else nop for d in xrange(self._chain_length)]
-            for p in zip(*requests):
-                self._spi.xfer2(p)
+            self._xfer([command_request if d in dist_list else None for d in range(self._chain_length)])
         else:
             self.broadcast_request(command_request)
 
@@ -158,14 +389,14 @@ class DaisyChain(DSPIN):
         self.logger.debug("expand_parameters(%s)", p_dict)
         # take the size of the first parameters tuple as the reference one
         try:
-            p_count = len(p_dict.values()[0])
+            p_count = len(list(p_dict.values())[0])
         except TypeError:
             # accept scalars in place of single item tuples
             p_count = 1
         # initialize a all None expanded parameter list
         p_list = [[None] * p_count] * len(self)
 
-        for m_num, p in p_dict.iteritems():
+        for m_num, p in p_dict.items():
             try:
                 lg = len(p)
             except TypeError:
@@ -174,7 +405,7 @@ class DaisyChain(DSPIN):
             if lg != p_count:
                 raise ValueError('invalid parameters list (%s)', p_dict)
             p_list[m_num] = p
-        return zip(*p_list)
+        return list(zip(*p_list))
 
     @property
     def switch_is_closed(self):
@@ -182,83 +413,215 @@ class DaisyChain(DSPIN):
         """
         return [bool(s & Status.SW_F) for s in self.STATUS]
 
-    def run(self, directions, speeds):
+    def _move_started(self, devices, wait, wait_cb, timeout, targets=None, durations=None):
+        """ Common process done once a motion command has been sent.
+
+        If completion tracking is not used, the optional wait is done on the BUSYN signal, and
+        nothing is returned. Otherwise the moves are tracked, and the wait concerns only the
+        devices involved.
+
+        :param iterable devices: the positions of the devices involved in the command
+        :param list targets: the target positions, if known
+        :param list durations: the estimated durations of the moves, if known
+        :return: the completions, indexed by device position (None for the devices not involved)
+        :rtype: list
+        """
+        known = [t for t in durations if t is not None] if durations is not None else None
+        expected = max(known) if known else None
+        tracker = self.completion_tracker
+        if tracker is None:
+            if wait:
+                self._wait_for_estimated_move(wait_cb, timeout, expected)
+            return None
+
+        completions = tracker.track(devices, targets, durations)
+        if wait:
+            if timeout is None:
+                timeout = self._estimated_timeout(expected)
+            self.wait_for_completions(completions, callback=wait_cb, timeout=timeout)
+        return completions
+
+    @staticmethod
+    def _masked(values, mask):
+        """ Returns per device parameters as a list, the devices excluded by the mask being set to None.
+        """
+        if mask is None:
+            return list(values)
+        return [v if m else None for v, m in zip(values, mask)]
+
+    def wait_for_completions(self, completions, callback=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT):
+        """ Waits for the moves of a set of devices to be complete.
+
+        The callback is invoked as in :py:meth:`wait_for_move_complete`.
+
+        :param iterable completions: the completions, as returned by the motion commands
+        :param callback: the callback to invoke while waiting
+        :param timeout: the max wait time in seconds
+        :raise: CommandTimeOut if the moves are not complete in time
+        """
+        if hasattr(GPIO, 'FAKE'):
+            self.logger.warn('not on a real RasPi => bypassing wait_for_completions')
+            self.completion_tracker.cancel()
+            return
+
+        started = metrics.clock()
+        time_limit = time.time() + timeout
+        for completion in completions:
+            if completion is None:
+                continue
+            while not completion.wait(min(max(time_limit - time.time(), 0), self.WAIT_CB_PERIOD)):
+                if callback and callback(self):
+                    self.logger.debug('callback returned True')
+                    return
+                if time.time() >= time_limit:
+                    self.logger.error('timeout reached (%s seconds)', timeout)
+                    if self.metrics is not None:
+                        self.metrics.timeouts.inc()
+                    raise CommandTimeOut()
+
+        # the overshoot of each move is recorded by the tracker
+        if self.metrics is not None:
+            self.metrics.wait.observe(metrics.clock() - started)
+
+    def _involved_devices(self, cmds, mask=None):
+        """ Returns the positions of the devices involved in a command, given by the
+        commands of the frame, or by the mask for the vectorized version (`cmds` being None).
+        """
+        if cmds is None:
+            return range(self._chain_length) if mask is None else [i for i, m in enumerate(mask) if m]
+        return [i for i, cmd in enumerate(cmds) if cmd is not None]
+
+    def _send_pooled(self, pool, params, setter):
+        """ Sends a frame made of reusable commands, one per device.
+
+        The commands are modified and encoded under the bus lock, so that concurrent
+        callers do not overwrite each other's parameters.
+
+        :param list pool: the reusable commands, one per device
+        :param iterable params: the parameters of each device, None for devices not involved
+        :param callable setter: the function setting the parameters of a command
+        :return: the commands of the frame, None for the devices not involved
+        :rtype: list
+        """
+        cmds = [None] * self._chain_length
+        with self._spi.lock:
+            for i, p in enumerate(params):
+                if p is not None:
+                    cmd = cmds[i] = pool[i]
+                    setter(cmd, p)
+            self._xfer_commands(cmds)
+        return cmds
+
+    def run(self, directions, speeds, mask=None):
+        """ See :py:meth:`DSPIN.run`.
+
+        The parameters can be NumPy arrays, the devices involved being then selected by
+        the optional boolean `mask` instead of `None` items.
+        """
         self.logger.debug('run(%s, %s)...', directions, speeds)
-        requests = [
-            commands.Run(d, s).as_request() if d is not None and s is not None else commands.NOP_4_REQUEST
-            for d, s in zip(directions, speeds)
-        ]
-        self._xfer(requests)
+        if mask is not None or vectorized.is_array(speeds):
+            self._xfer_array(vectorized.run_frame(directions, speeds, mask))
+            return
+
+        self._send_pooled(
+            self._cmds_run,
+            [(d, sp) if d is not None and sp is not None else None for d, sp in zip(directions, speeds)],
+            _set_direction_speed
+        )
 
     def step_clock(self, directions):
-        requests = [
-            commands.StepClock(d).as_request() if d is not None else commands.NOP_1_REQUEST
-            for d in directions
-        ]
-        self._xfer(requests)
+        self._send_pooled(self._cmds_step_clock, directions, _set_direction)
 
-    def move(self, directions, steps_s, wait=True, wait_cb=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT):
-        self.logger.debug('move(%s, %s, %s, %s, %d)...', directions, steps_s, wait, wait_cb, timeout)
-        requests = [
-            commands.Move(d, s).as_request() if (d is not None and s is not None) else commands.NOP_4_REQUEST
-            for d, s in zip(directions, steps_s)
-        ]
-        self._xfer(requests)
-        if wait:
-            self.wait_for_move_complete(callback=wait_cb, timeout=timeout)
+    def move(self, directions, steps_s, wait=True, wait_cb=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT, mask=None):
+        """ See :py:meth:`DSPIN.move`.
 
-    def goto(self, positions, wait=True, wait_cb=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT):
-        self.logger.debug('goto(%s, %s, %s, %d)...', positions, wait, wait_cb, timeout)
-        requests = [
-            commands.GoTo(p).as_request() if p is not None else commands.NOP_4_REQUEST
-            for p in positions
-        ]
-        self._xfer(requests)
-        if wait:
-            self.wait_for_move_complete(callback=wait_cb, timeout=timeout)
+        The parameters can be NumPy arrays, the devices involved being then selected by
+        the optional boolean `mask` instead of `None` items.
+        """
+        self.logger.debug('move(%s, %s, %s, %s, %s)...', directions, steps_s, wait, wait_cb, timeout)
+        vector = mask is not None or vectorized.is_array(steps_s)
+        durations = self.estimate_move_durations(self._masked(steps_s, mask)) if timeout is None else None
+        if vector:
+            cmds = None
+            self._xfer_array(vectorized.move_frame(directions, steps_s, mask))
+        else:
+            cmds = self._send_pooled(
+                self._cmds_move,
+                [(d, st) if d is not None and st is not None else None for d, st in zip(directions, steps_s)],
+                _set_direction_steps
+            )
+        return self._move_started(self._involved_devices(cmds, mask), wait, wait_cb, timeout, durations=durations)
+
+    def goto(self, positions, wait=True, wait_cb=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT, mask=None):
+        """ See :py:meth:`DSPIN.goto`.
+
+        The positions can be a NumPy array, the devices involved being then selected by
+        the optional boolean `mask` instead of `None` items.
+        """
+        self.logger.debug('goto(%s, %s, %s, %s)...', positions, wait, wait_cb, timeout)
+        vector = mask is not None or vectorized.is_array(positions)
+        targets = self._masked(positions, mask)
+        durations = self.estimate_goto_durations(targets) if timeout is None else None
+        if vector:
+            cmds = None
+            self._xfer_array(vectorized.goto_frame(positions, mask))
+        else:
+            cmds = self._send_pooled(self._cmds_goto, positions, _set_position)
+        return self._move_started(
+            self._involved_devices(cmds, mask), wait, wait_cb, timeout, targets=targets, durations=durations
+        )
 
     def goto_dir(self, directions, positions, wait=True, wait_cb=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT):
-        self.logger.debug('goto_dir(%s, %s, %s, %s, %d)...', directions, positions, wait, wait_cb, timeout)
-        requests = [
-            commands.GoToDir(d, p).as_request() if d is not None and p is not None else commands.NOP_4_REQUEST
-            for d, p in zip(directions, positions)
-        ]
-        self._xfer(requests)
-        if wait:
-            self.wait_for_move_complete(callback=wait_cb, timeout=timeout)
+        self.logger.debug('goto_dir(%s, %s, %s, %s, %s)...', directions, positions, wait, wait_cb, timeout)
+        durations = self.estimate_goto_durations(positions, directions) if timeout is None else None
+        cmds = self._send_pooled(
+            self._cmds_goto_dir,
+            [(d, p) if d is not None and p is not None else None for d, p in zip(directions, positions)],
+            _set_direction_position
+        )
+        return self._move_started(
+            self._involved_devices(cmds), wait, wait_cb, timeout, targets=positions, durations=durations
+        )
 
     def go_home(self, dist_list=None, wait=True, wait_cb=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT):
-        self.logger.debug('go_home(%s, %s, %s, %d)...', dist_list, wait, wait_cb, timeout)
+        self.logger.debug('go_home(%s, %s, %s, %s)...', dist_list, wait, wait_cb, timeout)
         self.send_command(commands.GO_HOME, dist_list=dist_list)
-        if wait:
-            self.wait_for_move_complete(callback=wait_cb, timeout=timeout)
+        return self._move_started(dist_list or range(self._chain_length), wait, wait_cb, timeout)
 
     def go_mark(self, dist_list=None, wait=True, wait_cb=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT):
-        self.logger.debug('go_mark(%s, %s, %s, %d)...', dist_list, wait, wait_cb)
+        self.logger.debug('go_mark(%s, %s, %s, %s)...', dist_list, wait, wait_cb, timeout)
         self.send_command(commands.GO_MARK, dist_list=dist_list)
-        if wait:
-            self.wait_for_move_complete(callback=wait_cb, timeout=timeout)
+        return self._move_started(dist_list or range(self._chain_length), wait, wait_cb, timeout)
 
-    def go_until(self, actions, directions, speeds, wait=True, wait_cb=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT):
-        self.logger.debug('go_until(%s, %s, %s, %s, %s, %d)...', actions, directions, speeds, wait, wait_cb, timeout)
-        requests = [
-            commands.GoUntil(a, d, s).as_request()
-            if a is not None and d is not None and s is not None else commands.NOP_4_REQUEST
-            for a, d, s in zip(actions, directions, speeds)
-        ]
-        self._xfer(requests)
-        if wait:
-            self.wait_for_move_complete(callback=wait_cb, timeout=timeout)
+    def go_until(self, actions, directions, speeds, wait=True, wait_cb=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT,
+                 mask=None):
+        """ See :py:meth:`DSPIN.go_until`.
+
+        The parameters can be NumPy arrays, the devices involved being then selected by
+        the optional boolean `mask` instead of `None` items.
+        """
+        self.logger.debug('go_until(%s, %s, %s, %s, %s, %s)...', actions, directions, speeds, wait, wait_cb, timeout)
+        vector = mask is not None or vectorized.is_array(speeds)
+        if vector:
+            cmds = None
+            self._xfer_array(vectorized.go_until_frame(actions, directions, speeds, mask))
+        else:
+            cmds = self._send_pooled(
+                self._cmds_go_until,
+                [(a, d, sp) if a is not None and d is not None and sp is not None else None
+                 for a, d, sp in zip(actions, directions, speeds)],
+                _set_action_direction_speed
+            )
+        return self._move_started(self._involved_devices(cmds, mask), wait, wait_cb, timeout)
 
     def release_sw(self, actions, directions, wait=True, wait_cb=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT):
-        self.logger.debug('release_sw(%s, %s, %s, %s, %d)...', actions, directions, wait, wait_cb, timeout)
-        requests = [
-            commands.ReleaseSW(a, d) if a is not None and d is not None else commands.NOP_4_REQUEST
-            for a, d in zip(actions, directions)
-        ]
-        self._xfer(requests)
-        if wait:
-            self.wait_for_move_complete(callback=wait_cb, timeout=timeout)
+        self.logger.debug('release_sw(%s, %s, %s, %s, %s)...', actions, directions, wait, wait_cb, timeout)
+        cmds = self._send_pooled(
+            self._cmds_release_sw,
+            [(a, d) if a is not None and d is not None else None for a, d in zip(actions, directions)],
+            _set_action_direction
+        )
+        return self._move_started(self._involved_devices(cmds), wait, wait_cb, timeout)
 
     def clear_status(self, dist_list=None):
         self.logger.debug('clear_status(%s)...', dist_list)
@@ -271,23 +634,40 @@ class DaisyChain(DSPIN):
     def reset_device(self, dist_list=None):
         self.logger.debug('reset_device(%s)...', dist_list)
         self.send_command(commands.RESET_DEVICE, dist_list=dist_list)
+        self.invalidate_shadow(dist_list or None)
 
     def soft_stop(self, dist_list=None, wait=True, wait_cb=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT):
-        self.logger.debug('soft_stop(%s, %s, %s, %d)...', dist_list, wait, wait_cb, timeout)
-        self.send_command(commands.SOFT_STOP, dist_list=dist_list)
-        if wait:
-            self.wait_for_move_complete(callback=wait_cb, timeout=timeout)
+        self.logger.debug('soft_stop(%s, %s, %s, %s)...', dist_list, wait, wait_cb, timeout)
+        with thread_priority(Priority.URGENT):
+            self.send_command(commands.SOFT_STOP, dist_list=dist_list)
+        return self._move_started(dist_list or range(self._chain_length), wait, wait_cb, timeout)
 
     def hard_stop(self, dist_list=None):
+        """ See :py:meth:`DSPIN.hard_stop`.
+
+        The emergency stop path is used when all the devices are concerned.
+        """
+        if not dist_list:
+            self.emergency_stop()
+            return
         self.logger.debug('hard_stop(%s)...', dist_list)
-        self.send_command(commands.HARD_STOP, dist_list=dist_list)
+        with thread_priority(Priority.URGENT):
+            self.send_command(commands.HARD_STOP, dist_list=dist_list)
 
     def hard_hi_Z(self, dist_list=None):
+        """ See :py:meth:`DSPIN.hard_hi_Z`.
+
+        The emergency stop path is used when all the devices are concerned.
+        """
+        if not dist_list:
+            self.emergency_stop(hi_z=True)
+            return
         self.logger.debug('hard_hi_Z(%s)...', dist_list)
-        self.send_command(commands.HARD_HIZ, dist_list=dist_list)
+        with thread_priority(Priority.URGENT):
+            self.send_command(commands.HARD_HIZ, dist_list=dist_list)
 
     def soft_hi_Z(self, dist_list=None, wait=True, wait_cb=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT):
-        self.logger.debug('soft_hi_Z(%s, %s, %s, %d)...', dist_list, wait, wait_cb, timeout)
-        self.send_command(commands.SOFT_HIZ, dist_list=dist_list)
-        if wait:
-            self.wait_for_move_complete(callback=wait_cb, timeout=timeout)
+        self.logger.debug('soft_hi_Z(%s, %s, %s, %s)...', dist_list, wait, wait_cb, timeout)
+        with thread_priority(Priority.URGENT):
+            self.send_command(commands.SOFT_HIZ, dist_list=dist_list)
+        return self._move_started(dist_list or range(self._chain_length), wait, wait_cb, timeout)
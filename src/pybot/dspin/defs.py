@@ -8,8 +8,13 @@ from collections import namedtuple
 __author__ = 'Eric Pascual'
 
 
-class RegisterDefinition(namedtuple('RegisterDefinition', 'name, addr, size, signed, reset_value, read_only')):
-    """ The definition of a dSPIN register """
+class RegisterDefinition(namedtuple('RegisterDefinition', 'name, addr, size, signed, reset_value, read_only, '
+                                                          'nbytes, mask')):
+    """ The definition of a dSPIN register
+
+    The `nbytes` (number of bytes used for transferring the value) and `mask` attributes
+    are computed from the size, to save doing it each time the register is accessed.
+    """
     __slots__ = ()
 
     def __new__(cls, name, addr, size, signed=False, reset_value=0, read_only=False):
@@ -21,7 +26,9 @@ class RegisterDefinition(namedtuple('RegisterDefinition', 'name, addr, size, sig
         :param int reset_value: register content after chip reset
         :param boolean read_only: is the register read-only ?
         """
-        return super(RegisterDefinition, cls).__new__(cls, name, addr, size, signed, reset_value, read_only)
+        return super(RegisterDefinition, cls).__new__(
+            cls, name, addr, size, signed, reset_value, read_only, (size + 7) >> 3, 0xffffffff >> (32 - size)
+        )
 
 
 class Register(object):
@@ -73,23 +80,21 @@ class Register(object):
         :return: the corresponding list of bytes to be transferred
         :rtype: list
         """
-        size = reg.size
-        bytes_cnt = (size >> 3) + (1 if size & 7 else 0)
+        bytes_cnt = reg.nbytes
         result = [0] * bytes_cnt
 
         # optimize for value == 0
         if value == 0:
             return result
 
-        mask = 0x0ffffffff >> (32 - size)
-        value &= mask
+        value &= reg.mask
 
         for i in range(bytes_cnt):
             result[bytes_cnt - i - 1] = int(value & 0x0ff)
             value >>= 8
         return result
 
-Register.ALL = sorted([n for n in dir(Register) if n.isupper() and n is not "ALL"])
+Register.ALL = sorted([n for n in dir(Register) if n.isupper() and n != "ALL"])
 
 
 def acc_calc(steps_per_sec_per_sec):
@@ -149,6 +154,65 @@ def spd_calc(steps_per_sec):
     return min(int(abs(steps_per_sec) * 67.106), 0x0fffff)
 
 
+def acc_from_reg(value):
+    """ Converts an ACC register value into an acceleration (inverse of :py:func:`acc_calc`)
+
+    :param int value: the register value
+    :return: acceleration in steps/s^2
+    """
+    return value / 0.137438
+
+#: The deceleration formula is the same as the acceleration one
+dec_from_reg = acc_from_reg
+
+
+def max_spd_from_reg(value):
+    """ Converts a MAX_SPEED register value into a speed (inverse of :py:func:`max_spd_calc`)
+
+    :param int value: the register value
+    :return: speed in steps/s
+    """
+    return value / 0.065536
+
+
+def min_spd_from_reg(value):
+    """ Converts a MIN_SPEED register value into a speed (inverse of :py:func:`min_spd_calc`)
+
+    The LSPD_OPT bit is ignored.
+
+    :param int value: the register value
+    :return: speed in steps/s
+    """
+    return (value & 0x0fff) / 4.1943
+
+
+def fs_spd_from_reg(value):
+    """ Converts a FS_SPD register value into a speed (inverse of :py:func:`fs_spd_calc`)
+
+    :param int value: the register value
+    :return: speed in steps/s
+    """
+    return (value + 0.5) / 0.065536
+
+
+def int_spd_from_reg(value):
+    """ Converts an INT_SPD register value into a speed (inverse of :py:func:`int_spd_calc`)
+
+    :param int value: the register value
+    :return: speed in steps/s
+    """
+    return value / 4.1943
+
+
+def spd_from_reg(value):
+    """ Converts a SPEED register value into a speed (inverse of :py:func:`spd_calc`)
+
+    :param int value: the register value
+    :return: speed in steps/s
+    """
+    return value / 67.106
+
+
 class Direction(object):
     """ Move Direction parameter """
     REV = 0
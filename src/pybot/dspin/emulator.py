@@ -0,0 +1,868 @@
+# -*- coding: utf-8 -*-
+
+""" Behavioral emulation of dSPIN chips, usable as a drop-in replacement of the
+`spidev` and `RPi.GPIO` modules.
+
+Unlike the `fake_spidev` and `fake_gpio` modules, which only allow the code to be
+imported outside a RasPi, the emulator models what the real hardware does:
+
+- the SPI byte stream is decoded according to the dSPIN command set, and the replies
+  are shifted out in the following frames, as the real chip does
+- all the registers are modeled, with their size, sign, reset value and write access
+  conditions (writing a register in a state where it is not allowed sets the NOTPERF_CMD
+  flag, exactly as on the chip)
+- moves follow a trapezoidal speed profile computed from the ACC, DEC, MAX_SPEED and
+  MIN_SPEED registers, and update ABS_POS, SPEED and the STATUS flags accordingly
+- the BUSYN and STANDBY signals are available through the emulated GPIO module
+- chained devices are connected as a shift register, so that daisy-chain transactions
+  behave as on real hardware
+- the signal integrity limit of the wiring can be modeled by a maximum SPI clock, above
+  which random bits of the replies are flipped
+
+Speeds and accelerations use the same units as the conversion functions of :py:mod:`defs`,
+i.e. steps per second, a step being the unit of the ABS_POS register.
+
+The motion is computed analytically from the emulated time, which can be accelerated
+with respect to the real one, so that complete applications can be run at full speed.
+
+The emulator is selected by setting the ``PYBOT_DSPIN_EMULATOR`` environment variable
+(its value gives the default chain length) before importing the package. The time scale
+can be provided by the ``PYBOT_DSPIN_EMULATOR_TIME_SCALE`` variable. It can also be
+configured programmatically with :py:func:`configure`, and individual chips are reachable
+via :py:data:`board` for injecting events such as switch closures.
+"""
+
+import atexit
+import random
+import threading
+import time
+
+from pybot.core import log
+
+from .commands import OpCodes
+from .defs import Register, Status, Direction, GoUntilAction, MotorStatus, Configuration
+from .defs import spd_from_reg, spd_calc
+from .motion import POS_RANGE, ProfileParameters, goto_distance, trapezoid, speed_change
+
+__author__ = 'Eric Pascual'
+
+_log = log.getLogger(__name__)
+
+#: the registers, indexed by their address
+REGISTERS = dict((r.addr, r) for r in (getattr(Register, n) for n in Register.ALL))
+
+# write access conditions
+_ALWAYS, _STOPPED, _HIZ = range(3)
+
+_WRITE_CONDITION = {
+    Register.ABS_POS: _STOPPED,
+    Register.EL_POS: _STOPPED,
+    Register.MARK: _ALWAYS,
+    Register.ACC: _STOPPED,
+    Register.DEC: _STOPPED,
+    Register.MAX_SPEED: _ALWAYS,
+    Register.MIN_SPEED: _STOPPED,
+    Register.FS_SPD: _ALWAYS,
+    Register.KVAL_HOLD: _ALWAYS,
+    Register.KVAL_RUN: _ALWAYS,
+    Register.KVAL_ACC: _ALWAYS,
+    Register.KVAL_DEC: _ALWAYS,
+    Register.INT_SPD: _HIZ,
+    Register.ST_SLP: _HIZ,
+    Register.FN_SLP_ACC: _HIZ,
+    Register.FN_SLP_DEC: _HIZ,
+    Register.K_THERM: _ALWAYS,
+    Register.OCD_TH: _ALWAYS,
+    Register.STALL_TH: _ALWAYS,
+    Register.STEP_MODE: _HIZ,
+    Register.ALARM_EN: _STOPPED,
+    Register.CONFIG: _HIZ,
+}
+
+#: speed used by ReleaseSW when MIN_SPEED is lower than it (see datasheet)
+_RELEASE_SW_MIN_SPEED = 5.
+
+
+class DSPinChip(object):
+    """ The model of a single dSPIN chip.
+    """
+    def __init__(self, board):
+        """
+        :param Board board: the board the chip is mounted on, providing the time base
+        """
+        self._board = board
+        self._lock = board.lock
+        self.reset()
+
+    def reset(self):
+        """ Puts the chip back in its power-up state.
+        """
+        self._regs = dict((reg, reg.reset_value) for reg in REGISTERS.values())
+
+        # protocol state
+        self._out = []
+        self._args = None
+        self._args_expected = 0
+        self._args_handler = None
+        self._ignored = 0
+
+        # motion state
+        self._t = self._board.now()
+        self._pos = 0.
+        self._speed = 0.
+        self._dir = Direction.FWD
+        self._phases = []
+        self._tail_speed = 0.
+        self._busy_tail = False
+        self._tail_action = None
+        self._hiz = True
+        self._hiz_at_end = False
+        self._until = None
+
+        # status flags
+        self._switch = False
+        self._sw_evn = False
+        self._notperf = False
+        self._wrong = False
+        self._uvlo = True
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # SPI interface
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def load_output(self):
+        """ Returns the byte the chip will shift out during the next frame.
+        """
+        return self._out.pop(0) if self._out else 0
+
+    def receive(self, value):
+        """ Processes the byte latched at the end of a frame.
+        """
+        if self._ignored:
+            self._ignored -= 1
+            return
+
+        if self._args is not None:
+            self._args.append(value)
+            if len(self._args) == self._args_expected:
+                args, handler = self._args, self._args_handler
+                self._args = self._args_handler = None
+                param = 0
+                for b in args:
+                    param = (param << 8) | b
+                self._update()
+                handler(param)
+            return
+
+        self._update()
+        self._decode(value)
+
+    def _expect(self, count, handler):
+        self._args = []
+        self._args_expected = count
+        self._args_handler = handler
+
+    def _decode(self, opcode):
+        if opcode == OpCodes.NOP:
+            return
+
+        if opcode < OpCodes.GET_PARAM:
+            reg = REGISTERS.get(opcode & 0x1f)
+            if reg is None or reg.read_only:
+                self._wrong = True
+            else:
+                self._expect(reg.nbytes, lambda v: self._set_param(reg, v))
+
+        elif opcode < OpCodes.MOVE:
+            reg = REGISTERS.get(opcode & 0x1f)
+            if reg is None:
+                self._wrong = True
+            else:
+                count = reg.nbytes
+                value = self.get_register(reg)
+                self._out = [(value >> (8 * (count - i - 1))) & 0xff for i in range(count)]
+                self._ignored = count
+
+        elif opcode & ~Direction.MASK == OpCodes.RUN:
+            self._expect(3, lambda v: self._run(opcode & Direction.MASK, spd_from_reg(v & 0x0fffff)))
+
+        elif opcode & ~Direction.MASK == OpCodes.STEP_CLOCK:
+            # step-clock mode is not emulated, since there is no STCK input
+            self._dir = opcode & Direction.MASK
+
+        elif opcode & ~Direction.MASK == OpCodes.MOVE:
+            self._expect(3, lambda v: self._move(opcode & Direction.MASK, v & (POS_RANGE - 1)))
+
+        elif opcode == OpCodes.GOTO:
+            self._expect(3, lambda v: self._goto(None, v & (POS_RANGE - 1)))
+
+        elif opcode & ~Direction.MASK == OpCodes.GOTO_DIR:
+            self._expect(3, lambda v: self._goto(opcode & Direction.MASK, v & (POS_RANGE - 1)))
+
+        elif opcode & ~(Direction.MASK | GoUntilAction.MASK) == OpCodes.GO_UNTIL:
+            self._expect(3, lambda v: self._go_until(
+                opcode & GoUntilAction.MASK, opcode & Direction.MASK, spd_from_reg(v & 0x0fffff)
+            ))
+
+        elif opcode & ~(Direction.MASK | GoUntilAction.MASK) == OpCodes.RELEASE_SW:
+            self._release_sw(opcode & GoUntilAction.MASK, opcode & Direction.MASK)
+
+        elif opcode == OpCodes.GO_HOME:
+            self._goto(None, 0)
+
+        elif opcode == OpCodes.GO_MARK:
+            self._goto(None, self._regs[Register.MARK])
+
+        elif opcode == OpCodes.RESET_POS:
+            self._pos = 0.
+
+        elif opcode == OpCodes.RESET_DEVICE:
+            self.reset()
+
+        elif opcode == OpCodes.SOFT_STOP:
+            self._soft_stop(hiz=False)
+
+        elif opcode == OpCodes.HARD_STOP:
+            self._hard_stop(hiz=False)
+
+        elif opcode == OpCodes.SOFT_HIZ:
+            self._soft_stop(hiz=True)
+
+        elif opcode == OpCodes.HARD_HIZ:
+            self._hard_stop(hiz=True)
+
+        elif opcode == OpCodes.GET_STATUS:
+            status = self._status()
+            self._out = [status >> 8, status & 0xff]
+            self._ignored = 2
+            self._sw_evn = self._notperf = self._wrong = self._uvlo = False
+
+        else:
+            self._wrong = True
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # registers
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def get_register(self, reg):
+        """ Returns the raw content of a register, as it would be read by GetParam.
+        """
+        with self._lock:
+            self._update()
+            if reg is Register.ABS_POS:
+                return int(round(self._pos)) & (POS_RANGE - 1)
+            if reg is Register.SPEED:
+                return spd_calc(self._speed)
+            if reg is Register.STATUS:
+                return self._status()
+            return self._regs[reg]
+
+    def _set_param(self, reg, value):
+        condition = _WRITE_CONDITION[reg]
+        if (condition == _STOPPED and not self.is_stopped) or (condition == _HIZ and not self._hiz):
+            self._notperf = True
+            return
+
+        value &= reg.mask
+        if reg is Register.ABS_POS:
+            self._pos = float(value - POS_RANGE if value & (POS_RANGE >> 1) else value)
+        else:
+            self._regs[reg] = value
+
+    @property
+    def position(self):
+        """ The current absolute position, as a signed integer. """
+        value = self.get_register(Register.ABS_POS)
+        return value - POS_RANGE if value & (POS_RANGE >> 1) else value
+
+    @property
+    def speed(self):
+        """ The current speed, in steps/s. """
+        with self._lock:
+            self._update()
+            return self._speed
+
+    @property
+    def status(self):
+        """ The current content of the STATUS register.
+
+        .. note::
+
+            BUSY, UVLO, TH_WRN, TH_SD, OCD and STEP_LOSS_x flags are active low.
+        """
+        with self._lock:
+            return self._status()
+
+    def _status(self):
+        self._update()
+        if self._phases:
+            accel = self._phases[0][2]
+            mot_status = MotorStatus.ACCEL if accel > 0 else MotorStatus.DECEL if accel < 0 \
+                else MotorStatus.CONSTANT_SPEED
+        else:
+            mot_status = MotorStatus.CONSTANT_SPEED if self._tail_speed else MotorStatus.STOPPED
+
+        return (
+            (Status.HiZ if self._hiz else 0) |
+            (0 if self.is_busy else Status.BUSY) |
+            (Status.SW_F if self._switch else 0) |
+            (Status.SW_EVN if self._sw_evn else 0) |
+            (Status.DIR if self._dir == Direction.FWD else 0) |
+            (mot_status << 5) |
+            (Status.NOTPERF_CMD if self._notperf else 0) |
+            (Status.WRONG_CMD if self._wrong else 0) |
+            (0 if self._uvlo else Status.UVLO) |
+            Status.TH_WRN | Status.TH_SD | Status.OCD | Status.STEP_LOSS
+        )
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # motion
+    # ------------------------------------------------------------------------------------------------------------------
+
+    @property
+    def is_busy(self):
+        """ The state of the BUSY signal (True if a command is being executed). """
+        self._update()
+        return bool(self._phases) or self._busy_tail
+
+    @property
+    def is_stopped(self):
+        self._update()
+        return not self._phases and not self._tail_speed
+
+    def remaining_busy_time(self):
+        """ Returns the emulated time before the BUSY signal is released, None if it
+        depends on an external event (e.g. GoUntil).
+        """
+        self._update()
+        if self._busy_tail:
+            return None
+        return sum(p[0] for p in self._phases)
+
+    def _profile_params(self):
+        regs = self._regs
+        return ProfileParameters.from_registers(
+            regs[Register.MIN_SPEED], regs[Register.MAX_SPEED], regs[Register.ACC], regs[Register.DEC]
+        )
+
+    def _update(self, now=None):
+        """ Brings the motion state up to date with the emulated time.
+        """
+        now = self._board.now() if now is None else now
+        dt = now - self._t
+        self._t = now
+        sign = 1 if self._dir == Direction.FWD else -1
+
+        while dt > 0 and self._phases:
+            duration, v0, accel = self._phases[0]
+            if dt < duration:
+                self._pos += sign * (v0 * dt + accel * dt * dt / 2)
+                self._speed = v0 + accel * dt
+                self._phases[0] = (duration - dt, self._speed, accel)
+                return
+            self._pos += sign * (v0 * duration + accel * duration * duration / 2)
+            dt -= duration
+            self._phases.pop(0)
+            if self._phases:
+                self._speed = self._phases[0][1]
+            else:
+                self._end_of_phases()
+                sign = 1 if self._dir == Direction.FWD else -1
+
+        if dt > 0 and not self._phases:
+            self._pos += sign * self._speed * dt
+
+    def _end_of_phases(self):
+        if self._until is not None:
+            # pending direction reversal
+            self._dir, plan, self._until = self._until[0], self._until[1], None
+            self._speed = plan[0][1] if plan else self._tail_speed
+            self._phases = plan
+            return
+
+        self._speed = self._tail_speed
+        if not self._speed:
+            self._busy_tail = False
+        if self._hiz_at_end:
+            self._hiz = True
+            self._hiz_at_end = False
+
+    def _start(self, direction, phases, tail_speed=0., busy_tail=False):
+        """ Starts a new motion, reversing the direction first if needed.
+        """
+        self._hiz = False
+        self._hiz_at_end = False
+        self._tail_speed = tail_speed
+        self._busy_tail = busy_tail
+
+        if direction != self._dir and self._speed:
+            _, _, _, dec = self._profile_params()
+            self._phases = speed_change(self._speed, 0, 1, dec)
+            self._until = (direction, phases)
+        else:
+            self._dir = direction
+            self._until = None
+            self._phases = phases
+            if phases:
+                self._speed = phases[0][1]
+            else:
+                self._end_of_phases()
+
+    def _run(self, direction, speed):
+        v_min, v_max, acc, dec = self._profile_params()
+        speed = min(speed, v_max)
+        v0 = self._speed if direction == self._dir else 0
+        self._start(direction, speed_change(max(v0, v_min) if speed else v0, speed, acc, dec), tail_speed=speed)
+
+    def _positioning(self, direction, distance):
+        if self.is_busy:
+            self._notperf = True
+            return
+        v_min, v_max, acc, dec = self._profile_params()
+        v0 = self._speed if direction == self._dir else 0
+        self._start(direction, trapezoid(distance, v0, v_min, v_max, acc, dec))
+
+    def _move(self, direction, steps):
+        if not self.is_stopped:
+            self._notperf = True
+            return
+        self._positioning(direction, float(steps))
+
+    def _goto(self, direction, target):
+        direction, distance = goto_distance(int(round(self._pos)), target, direction)
+        self._positioning(direction, float(distance))
+
+    def _go_until(self, action, direction, speed):
+        if self.is_busy:
+            self._notperf = True
+            return
+        self._run(direction, speed)
+        self._busy_tail = True
+        self._tail_action = ('until', action)
+
+    def _release_sw(self, action, direction):
+        if self.is_busy:
+            self._notperf = True
+            return
+        if not self._switch:
+            return
+        v_min, _, _, _ = self._profile_params()
+        self._start(direction, [], tail_speed=max(v_min, _RELEASE_SW_MIN_SPEED), busy_tail=True)
+        self._tail_action = ('release', action)
+
+    def _soft_stop(self, hiz):
+        _, _, _, dec = self._profile_params()
+        speed = self._speed
+        self._until = None
+        self._tail_speed = 0.
+        self._busy_tail = False
+        self._phases = speed_change(speed, 0, 1, dec)
+        if self._phases:
+            self._hiz_at_end = hiz
+        else:
+            self._hiz = self._hiz or hiz
+
+    def _hard_stop(self, hiz):
+        self._until = None
+        self._phases = []
+        self._speed = self._tail_speed = 0.
+        self._busy_tail = False
+        self._hiz = self._hiz or hiz
+
+    def _do_action(self, action):
+        if action == GoUntilAction.RESET:
+            self._pos = 0.
+        else:
+            self._regs[Register.MARK] = int(round(self._pos)) & (POS_RANGE - 1)
+
+    def set_switch(self, closed):
+        """ Changes the state of the SW input, as if the end switch was operated.
+
+        :param bool closed: the new state of the switch
+        """
+        with self._lock:
+            self._update()
+            if closed == self._switch:
+                return
+            self._switch = closed
+            tail_action = self._tail_action if self._busy_tail else None
+
+            if closed:
+                self._sw_evn = True
+                if tail_action and tail_action[0] == 'until':
+                    self._do_action(tail_action[1])
+                    self._soft_stop(hiz=False)
+                elif not self._regs[Register.CONFIG] & Configuration.SW_MODE_MASK:
+                    self._hard_stop(hiz=False)
+            elif tail_action and tail_action[0] == 'release':
+                self._do_action(tail_action[1])
+                self._hard_stop(hiz=False)
+
+            self._board.changed.notify_all()
+
+
+class ChipChain(object):
+    """ A chain of dSPIN chips sharing a CS line.
+
+    The chip at index 0 is the one whose SDO is connected to the host MISO, i.e. the
+    last one in the chain. This is consistent with the :py:class:`DaisyChain` conventions,
+    where the first request of a frame column is the first byte transmitted.
+    """
+    def __init__(self, board, length):
+        self._board = board
+        self.chips = [DSPinChip(board) for _ in range(length)]
+        self.in_standby = False
+
+    def __len__(self):
+        return len(self.chips)
+
+    def __getitem__(self, item):
+        return self.chips[item]
+
+    def cs_window(self, data):
+        """ Transfers bytes during a single CS assertion.
+
+        :param iterable data: the bytes sent by the host
+        :return: the bytes received by the host
+        :rtype: list
+        """
+        with self._board.lock:
+            data = list(data)
+            if self.in_standby:
+                return [0] * len(data)
+
+            stream = [chip.load_output() for chip in self.chips] + data
+            count = len(data)
+            for chip, value in zip(self.chips, stream[count:]):
+                chip.receive(value)
+            self._board.changed.notify_all()
+            return stream[:count]
+
+    def transfer(self, data, seg_len):
+        """ Transfers a message, CS being toggled every `seg_len` bytes.
+        """
+        result = []
+        for i in range(0, len(data), seg_len):
+            result.extend(self.cs_window(data[i:i + seg_len]))
+        return result
+
+    def set_standby(self, standby):
+        with self._board.lock:
+            if standby and not self.in_standby:
+                for chip in self.chips:
+                    chip.reset()
+            self.in_standby = standby
+            self._board.changed.notify_all()
+
+    @property
+    def is_busy(self):
+        return any(chip.is_busy for chip in self.chips)
+
+
+class Board(object):
+    """ The emulated hardware, i.e. the chips chains connected to the SPI buses and the
+    signals wired to the GPIOs.
+
+    Unless explicitly wired with :py:meth:`wire`, all the GPIO inputs read the wired-OR of
+    the BUSYN outputs of all the chips, and all the GPIO outputs drive their STANDBY inputs.
+    """
+    def __init__(self, chain_length=1, time_scale=1.):
+        """
+        :param int chain_length: the default number of chips on a SPI bus and device
+        :param float time_scale: the emulated time speed with respect to the real one
+        """
+        self.lock = threading.RLock()
+        #: notified each time the state of a chip may have changed
+        self.changed = threading.Condition(self.lock)
+        self.chain_length = chain_length
+        self._time_scale = time_scale
+        self._t0 = time.time()
+        self._chains = {}
+        self._wiring = {}
+        #: the highest SPI clock (Hz) transferring the replies reliably, None if unlimited
+        self.spi_speed_limit = None
+        self._random = random.Random(0)
+
+    def corrupt(self, data, speed_hz):
+        """ Flips random bits of the data received at a given SPI clock, if it exceeds
+        :py:attr:`spi_speed_limit`. The errors rate grows with the excess.
+        """
+        limit = self.spi_speed_limit
+        if limit is None or speed_hz <= limit:
+            return data
+        rate = min(1., float(speed_hz - limit) / limit)
+        rnd = self._random
+        return [b ^ (1 << rnd.randrange(8)) if rnd.random() < rate else b for b in data]
+
+    @property
+    def time_scale(self):
+        return self._time_scale
+
+    @time_scale.setter
+    def time_scale(self, value):
+        with self.lock:
+            now = self.now()
+            self._time_scale = value
+            self._t0 = time.time() - now / value
+            # the real time of the pending state changes has changed
+            self.changed.notify_all()
+
+    def now(self):
+        """ Returns the emulated time, in seconds. """
+        return (time.time() - self._t0) * self._time_scale
+
+    def chain(self, bus=0, device=0, length=None):
+        """ Returns the chips chain connected to a given SPI device, creating it if needed.
+
+        :param int bus: SPI bus
+        :param int device: SPI device (i.e. CS line)
+        :param int length: the length of the chain, if it must be created
+        :rtype: ChipChain
+        """
+        with self.lock:
+            try:
+                return self._chains[(bus, device)]
+            except KeyError:
+                chain = self._chains[(bus, device)] = ChipChain(self, length or self.chain_length)
+                return chain
+
+    @property
+    def chains(self):
+        return list(self._chains.values())
+
+    def wire(self, busyn_pin, standby_pin, bus=0, device=0):
+        """ Declares the GPIOs connected to the signals of a given chain.
+        """
+        with self.lock:
+            self._wiring[busyn_pin] = (bus, device)
+            self._wiring[standby_pin] = (bus, device)
+
+    def _chains_on(self, pin):
+        try:
+            return [self.chain(*self._wiring[pin])]
+        except KeyError:
+            return self.chains
+
+    def busyn(self, pin=None):
+        """ Returns the level of the BUSYN signal (open-drain, active low).
+        """
+        with self.lock:
+            return int(not any(chain.is_busy for chain in self._chains_on(pin)))
+
+    def remaining_busy_time(self, pin=None):
+        """ Returns the emulated time before BUSYN is released, None if unpredictable.
+        """
+        with self.lock:
+            result = 0.
+            for chain in self._chains_on(pin):
+                for chip in chain.chips:
+                    remaining = chip.remaining_busy_time()
+                    if remaining is None:
+                        return None
+                    result = max(result, remaining)
+            return result
+
+    def set_standby(self, pin, level):
+        with self.lock:
+            for chain in self._chains_on(pin):
+                chain.set_standby(not level)
+
+    def reset(self):
+        """ Removes all the chains, which will be re-created in their power-up state on next use.
+        """
+        with self.lock:
+            self._chains.clear()
+            self._wiring.clear()
+            self.changed.notify_all()
+
+
+#: the emulated hardware
+board = Board()
+
+
+def configure(chain_length=1, time_scale=1., spi_speed_limit=None):
+    """ Resets the emulated hardware with new settings.
+
+    :param int chain_length: the default number of chips on a SPI bus and device
+    :param float time_scale: the emulated time speed with respect to the real one
+    :param int spi_speed_limit: the highest reliable SPI clock (Hz), None if unlimited
+    :return: the emulated board
+    :rtype: Board
+    """
+    board.reset()
+    board.chain_length = chain_length
+    board.time_scale = time_scale
+    board.spi_speed_limit = spi_speed_limit
+    return board
+
+
+class SpiDev(object):
+    """ Emulation of the `spidev.SpiDev` class.
+    """
+    #: number of system calls the real device would have issued so far
+    syscalls = 0
+
+    mode = 0
+    max_speed_hz = 500000
+
+    def __init__(self):
+        self._chain = None
+
+    def open(self, bus, device):
+        self._chain = board.chain(bus, device)
+
+    def close(self):
+        self._chain = None
+
+    def xfer(self, data):
+        self.syscalls += 1
+        return board.corrupt(self._chain.cs_window(data), self.max_speed_hz)
+
+    xfer2 = xfer
+
+    def transfer_message(self, data, seg_len):
+        """ Emulation of a ``SPI_IOC_MESSAGE`` ioctl, CS being toggled every `seg_len` bytes.
+        """
+        self.syscalls += 1
+        return board.corrupt(self._chain.transfer(data, seg_len), self.max_speed_hz)
+
+
+class EmulatedGPIO(object):
+    """ Emulation of the `RPi.GPIO` module API, limited to what is used by the library.
+    """
+    IN, OUT = range(2)
+    LOW, HIGH = range(2)
+    BOARD, BCM = range(2)
+    RISING, FALLING, BOTH = 31, 32, 33
+
+    #: wake-up period when the end of the busy state cannot be predicted (real seconds)
+    UNPREDICTABLE_WAIT_PERIOD = 0.01
+
+    def __init__(self, emulated_board):
+        self._board = emulated_board
+        self._modes = {}
+        self._detections = {}
+
+    def setwarnings(self, state):
+        pass
+
+    def setmode(self, numbering_mode):
+        pass
+
+    def setup(self, channels, io_mode):
+        try:
+            for channel in channels:
+                self._modes[channel] = io_mode
+        except TypeError:
+            self._modes[channels] = io_mode
+
+    def cleanup(self):
+        self._modes.clear()
+        for channel in list(self._detections):
+            self.remove_event_detect(channel)
+
+    def input(self, channel):
+        return self._board.busyn(channel)
+
+    def wait_for_edge(self, channel, edge, timeout=-1):
+        """ Waits for an edge of the BUSYN signal.
+
+        Since the emulator knows when the running commands will complete, the wait ends
+        as soon as the signal changes instead of relying on polling.
+
+        :param int channel: the channel
+        :param int edge: RISING, FALLING or BOTH
+        :param int timeout: the timeout in milliseconds (negative for none)
+        :return: the channel if the edge occurred, None if timeout
+        """
+        board = self._board
+        end = time.time() + timeout / 1000. if timeout >= 0 else None
+        with board.changed:
+            level = board.busyn(channel)
+            while True:
+                new_level = board.busyn(channel)
+                if new_level != level:
+                    if edge == self.BOTH or (edge == self.RISING) == bool(new_level):
+                        return channel
+                    level = new_level
+
+                remaining = board.remaining_busy_time(channel) if not new_level else None
+                delay = remaining / board.time_scale if remaining is not None else self.UNPREDICTABLE_WAIT_PERIOD
+                if end is not None:
+                    now = time.time()
+                    if now >= end:
+                        return None
+                    delay = min(delay, end - now)
+                board.changed.wait(delay)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        """ Starts the detection of the edges of the BUSYN signal.
+
+        As with `RPi.GPIO`, a single detection can be active on a channel. The edges are
+        tracked by a thread, which invokes the callbacks, and which is stopped by
+        :py:meth:`remove_event_detect` or :py:meth:`cleanup`.
+
+        :param int channel: the channel
+        :param int edge: RISING, FALLING or BOTH
+        :param callable callback: optional callable invoked with the channel for each edge
+        :param int bouncetime: ignored
+        :raise: RuntimeError if a detection is already active on the channel
+        """
+        with self._board.lock:
+            if channel in self._detections:
+                raise RuntimeError('Conflicting edge detection already enabled for this GPIO channel')
+            callbacks = [callback] if callback else []
+            thread = threading.Thread(target=self._detect_edges, args=(channel, edge, callbacks))
+            thread.daemon = True
+            self._detections[channel] = (callbacks, thread)
+        thread.start()
+
+    def add_event_callback(self, channel, callback):
+        with self._board.lock:
+            try:
+                self._detections[channel][0].append(callback)
+            except KeyError:
+                raise RuntimeError('Add event detection using add_event_detect first before adding a callback')
+
+    def remove_event_detect(self, channel):
+        with self._board.lock:
+            detection = self._detections.pop(channel, None)
+            self._board.changed.notify_all()
+        if detection is not None and detection[1] is not threading.current_thread():
+            detection[1].join()
+
+    def _detect_edges(self, channel, edge, callbacks):
+        board = self._board
+        with board.changed:
+            level = board.busyn(channel)
+        while True:
+            with board.changed:
+                while True:
+                    if self._detections.get(channel, (None, None))[0] is not callbacks:
+                        return
+                    new_level = board.busyn(channel)
+                    if new_level != level:
+                        break
+                    remaining = board.remaining_busy_time(channel) if not new_level else None
+                    board.changed.wait(
+                        remaining / board.time_scale if remaining is not None else self.UNPREDICTABLE_WAIT_PERIOD
+                    )
+            level = new_level
+            if edge == self.BOTH or (edge == self.RISING) == bool(new_level):
+                for callback in list(callbacks):
+                    callback(channel)
+
+    def output(self, channels, states):
+        try:
+            pairs = zip(channels, states)
+        except TypeError:
+            pairs = [(channels, states)]
+        for channel, state in pairs:
+            self._board.set_standby(channel, state)
+
+
+#: the emulated GPIO module
+GPIO = EmulatedGPIO(board)
+
+# stops the edge detection threads before the interpreter shutdown
+atexit.register(GPIO.cleanup)
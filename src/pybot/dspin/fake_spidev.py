@@ -6,6 +6,9 @@ _log = log.getLogger(__name__)
 
 
 class SpiDev(object):
+    #: number of system calls the real device would have issued so far
+    syscalls = 0
+
     def open(self, bus, device):
         _log.warn('open(%s, %s)', bus, device)
 
@@ -13,9 +16,19 @@ class SpiDev(object):
         _log.warn('close()')
 
     def xfer(self, data):
+        self.syscalls += 1
         _log.warn('xfer(%s)', data)
         return [0] * len(data)
 
     def xfer2(self, data):
+        self.syscalls += 1
         _log.warn('xfer2(%s)', data)
         return [0] * len(data)
+
+    def transfer_message(self, data, seg_len):
+        """ Fake counterpart of a ``SPI_IOC_MESSAGE`` ioctl, CS being toggled
+        every `seg_len` bytes.
+        """
+        self.syscalls += 1
+        _log.warn('transfer_message(%s, %d)', data, seg_len)
+        return [0] * len(data)
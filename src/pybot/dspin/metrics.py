@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+""" Low overhead instrumentation of the bus transfers and of the moves completion waits.
+
+The instrumentation is off by default, and costs then a single attribute test per
+transfer. It is enabled per instance::
+
+    dspin.enable_metrics()          # also enables the metrics of its SPI device
+    ...
+    print(metrics.REGISTRY.snapshot())
+    metrics.REGISTRY.write_prometheus('/run/dspin.prom')
+
+or for all the instances created afterwards, by setting the `PYBOT_DSPIN_METRICS`
+environment variable.
+
+The collected metrics are:
+
+    - for each SPI device: the number of transfers, the number of transferred bytes and
+      the transfer latency
+    - for each :py:class:`DSPIN` or :py:class:`DaisyChain`: the number of commands sent,
+      per opcode (NOPs excepted), the duration of the moves completion waits and their
+      overshoot, i.e. how late the end of the move has been detected with respect to its
+      expected end, when the move duration has been estimated, and the latency of the
+      emergency stops.
+
+The per-opcode counts are based on the first command of each request, the additional ones
+concatenated in the same request (e.g. by :py:meth:`DSPIN.read_registers`) being not counted.
+
+Metrics are registered in a :py:class:`MetricsRegistry` (by default the module level
+:py:data:`REGISTRY`), which provides them as a dictionary or in the Prometheus text
+exposition format, written to a file or sent to a socket.
+
+Updates are not synchronized: they are mostly done under the bus lock, and the metrics are
+meant for monitoring, not accounting.
+"""
+
+from bisect import bisect_left
+import os
+import socket
+import threading
+import time
+
+from .commands import OpCodes
+
+__author__ = 'Eric Pascual'
+
+#: set by the environment for enabling the metrics of all the instances
+ENABLED = bool(os.environ.get('PYBOT_DSPIN_METRICS'))
+
+#: the most accurate available clock, for measuring latencies
+clock = getattr(time, 'perf_counter', time.time)
+
+#: the default histogram buckets for latencies (seconds)
+LATENCY_BUCKETS = (
+    50e-6, 100e-6, 250e-6, 500e-6, 1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 50e-3, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.
+)
+
+#: the histogram buckets for moves end detection overshoot (seconds)
+OVERSHOOT_BUCKETS = (-10e-3, -1e-3, 0., 1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 50e-3, 0.1, 0.25, 1.)
+
+
+def _opcode_names():
+    """ Builds the table giving the name of the command for each possible first byte of a
+    request, the parameters embedded in the opcode (direction, register,...) being ignored.
+    """
+    names = [None] * 256
+    # the embedded parameters bits of each command, from the widest
+    commands = (
+        (OpCodes.SET_PARAM, 0x1f, 'SET_PARAM'),
+        (OpCodes.GET_PARAM, 0x1f, 'GET_PARAM'),
+        (OpCodes.GO_UNTIL, 0x09, 'GO_UNTIL'),
+        (OpCodes.RELEASE_SW, 0x09, 'RELEASE_SW'),
+        (OpCodes.RUN, 0x01, 'RUN'),
+        (OpCodes.STEP_CLOCK, 0x01, 'STEP_CLOCK'),
+        (OpCodes.MOVE, 0x01, 'MOVE'),
+        (OpCodes.GOTO_DIR, 0x01, 'GOTO_DIR'),
+    )
+    for opcode, params, name in commands:
+        for value in range(256):
+            if value & ~params == opcode:
+                names[value] = name
+    for name in ('GOTO', 'GO_HOME', 'GO_MARK', 'RESET_POS', 'RESET_DEVICE', 'SOFT_STOP', 'HARD_STOP',
+                 'SOFT_HIZ', 'HARD_HIZ', 'GET_STATUS'):
+        names[getattr(OpCodes, name)] = name
+    names[OpCodes.NOP] = 'NOP'
+    return [n or '0x%02x' % i for i, n in enumerate(names)]
+
+#: the command name associated with each opcode byte
+OPCODE_NAMES = _opcode_names()
+
+
+class Counter(object):
+    """ A monotonic counter. """
+    kind = 'counter'
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Histogram(object):
+    """ Distribution of observed values, in cumulative buckets as Prometheus does. """
+    kind = 'histogram'
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        :param tuple buckets: the upper bounds of the buckets, in ascending order
+        """
+        self.buckets = tuple(buckets)
+        # the last slot counts the values above the highest bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def _cumulative(self):
+        total, result = 0, []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': [(bound, count) for bound, count in self._cumulative()]
+        }
+
+    def samples(self, name, labels):
+        for bound, count in self._cumulative():
+            yield name + '_bucket', labels + (('le', '+Inf' if bound == float('inf') else repr(bound)),), count
+        yield name + '_sum', labels, self.sum
+        yield name + '_count', labels, self.count
+
+
+class CommandCounter(object):
+    """ Counts the commands sent, per opcode.
+
+    Counts are kept per opcode byte, so that counting costs a list item increment. They are
+    aggregated per command name when read.
+    """
+    kind = 'counter'
+    __slots__ = ('counts',)
+
+    def __init__(self):
+        self.counts = [0] * 256
+
+    def count(self, opcode):
+        self.counts[opcode] += 1
+
+    def snapshot(self):
+        result = {}
+        for opcode, count in enumerate(self.counts):
+            if count:
+                name = OPCODE_NAMES[opcode]
+                result[name] = result.get(name, 0) + count
+        return result
+
+    def samples(self, name, labels):
+        for command, count in sorted(self.snapshot().items()):
+            yield name, labels + (('command', command),), count
+
+
+class MetricsRegistry(object):
+    """ A set of metrics families, each one being made of metrics distinguished by their labels.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {}
+
+    def get(self, name, factory, help_text='', **labels):
+        """ Returns the metric of a family having the given labels, creating it if needed.
+
+        :param str name: the family name
+        :param factory: the callable creating the metric
+        :param str help_text: the description of the family
+        :param labels: the labels of the metric
+        """
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = (help_text, {})
+            metrics = family[1]
+            metric = metrics.get(key)
+            if metric is None:
+                metric = metrics[key] = factory()
+            return metric
+
+    def counter(self, name, help_text='', **labels):
+        return self.get(name, Counter, help_text, **labels)
+
+    def histogram(self, name, help_text='', buckets=LATENCY_BUCKETS, **labels):
+        return self.get(name, lambda: Histogram(buckets), help_text, **labels)
+
+    def command_counter(self, name, help_text='', **labels):
+        return self.get(name, CommandCounter, help_text, **labels)
+
+    def clear(self):
+        """ Forgets all the metrics. The ones in use by instrumented objects are no more
+        reported until their metrics are enabled again.
+        """
+        with self._lock:
+            self._families.clear()
+
+    def _items(self):
+        with self._lock:
+            return sorted((name, help_text, list(metrics.items())) for name, (help_text, metrics) in self._families.items())
+
+    def snapshot(self):
+        """ Returns the current value of all the metrics.
+
+        :return: a dictionary of dictionaries, giving the values by family name, and then by
+        labels (as a 'name=value,...' string)
+        :rtype: dict
+        """
+        return dict(
+            (name, dict((','.join('%s=%s' % kv for kv in labels), metric.snapshot()) for labels, metric in metrics))
+            for name, _, metrics in self._items()
+        )
+
+    def prometheus_text(self):
+        """ Returns the metrics in the Prometheus text exposition format.
+
+        :rtype: str
+        """
+        lines = []
+        for name, help_text, metrics in self._items():
+            if not metrics:
+                continue
+            if help_text:
+                lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, metrics[0][1].kind))
+            for labels, metric in metrics:
+                for sample_name, sample_labels, value in metric.samples(name, labels):
+                    if sample_labels:
+                        label_text = '{%s}' % ','.join('%s="%s"' % kv for kv in sample_labels)
+                    else:
+                        label_text = ''
+                    lines.append('%s%s %s' % (sample_name, label_text, value))
+        lines.append('')
+        return '\n'.join(lines)
+
+    def write_prometheus(self, path):
+        """ Writes the metrics in a file, in the Prometheus text format (e.g. for the textfile
+        collector of the node exporter). The file is replaced atomically.
+
+        :param str path: the file path
+        """
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as fp:
+            fp.write(self.prometheus_text())
+        os.rename(tmp_path, path)
+
+    def send_prometheus(self, address, timeout=1.):
+        """ Sends the metrics to a socket, in the Prometheus text format.
+
+        :param address: the path of a Unix socket, or a (host, port) tuple for a TCP one
+        :param float timeout: the connection and sending timeout (seconds)
+        """
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(address)
+            sock.sendall(self.prometheus_text().encode('utf-8'))
+        finally:
+            sock.close()
+
+#: the default registry
+REGISTRY = MetricsRegistry()
+
+
+class SpiMetrics(object):
+    """ The metrics of a SPI device. """
+    __slots__ = ('transfers', 'bytes', 'latency', 'lock_waits')
+
+    #: the names of the bus access priorities, by level (see :py:class:`arbiter.Priority`)
+    PRIORITIES = ('URGENT', 'COMMAND', 'BACKGROUND')
+
+    def __init__(self, registry, **labels):
+        self.transfers = registry.counter('dspin_spi_transfers_total', 'SPI transfers', **labels)
+        self.bytes = registry.counter('dspin_spi_bytes_total', 'bytes transferred on the SPI bus', **labels)
+        self.latency = registry.histogram('dspin_spi_transfer_seconds', 'SPI transfers latency', **labels)
+        self.lock_waits = [
+            registry.histogram(
+                'dspin_spi_lock_wait_seconds', 'bus lock waits, when contended', priority=priority, **labels
+            )
+            for priority in self.PRIORITIES
+        ]
+
+    def record(self, length, elapsed):
+        self.transfers.value += 1
+        self.bytes.value += length
+        self.latency.observe(elapsed)
+
+
+class DeviceMetrics(object):
+    """ The metrics of a :py:class:`DSPIN` or :py:class:`DaisyChain` instance. """
+    __slots__ = ('commands', 'wait', 'overshoot', 'timeouts', 'stop_latency')
+
+    def __init__(self, registry, **labels):
+        self.commands = registry.command_counter('dspin_commands_total', 'commands sent, per command', **labels)
+        self.wait = registry.histogram('dspin_move_wait_seconds', 'moves completion waits duration', **labels)
+        self.overshoot = registry.histogram(
+            'dspin_move_end_overshoot_seconds', 'delay between the expected and the detected end of the moves',
+            buckets=OVERSHOOT_BUCKETS, **labels
+        )
+        self.timeouts = registry.counter('dspin_move_timeouts_total', 'moves completion waits timeouts', **labels)
+        self.stop_latency = registry.histogram(
+            'dspin_emergency_stop_latency_seconds', 'delay between the emergency stops trigger and their sending',
+            **labels
+        )
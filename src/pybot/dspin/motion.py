@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+""" Model of the motion executed by the dSPIN for positioning commands (Move, GoTo,...).
+
+The chip moves along a trapezoidal speed profile: it starts at the minimal speed,
+accelerates up to the maximal speed, cruises and decelerates down to the minimal speed
+when reaching the target. When the distance is too short for reaching the maximal speed,
+the profile is triangular.
+
+This module computes the profiles from the content of the ACC, DEC, MAX_SPEED and
+MIN_SPEED registers, which allows predicting the duration of the moves and the position
+of the motor at a given time without any bus transaction. The functions processing
+many moves at once require NumPy.
+
+Speeds and accelerations use the same units as the conversion functions of :py:mod:`defs`,
+i.e. steps per second, a step being the unit of the ABS_POS register.
+"""
+
+from collections import namedtuple
+import math
+
+from .defs import Register, Direction
+from .defs import acc_from_reg, dec_from_reg, max_spd_from_reg, min_spd_from_reg
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'Eric Pascual'
+
+#: ABS_POS wraps around on 22 bits
+POS_RANGE = 1 << Register.ABS_POS.size
+
+#: the registers defining the motion profile
+PROFILE_REGISTERS = (Register.MIN_SPEED, Register.MAX_SPEED, Register.ACC, Register.DEC)
+
+#: the lowest maximal speed used for the profiles, i.e. the one of the smallest non-null
+#: MAX_SPEED value, since the profile of a null one would never end (steps/s)
+V_MAX_MIN = max_spd_from_reg(1)
+
+
+class ProfileParameters(namedtuple('ProfileParameters', 'v_min v_max acc dec')):
+    """ The parameters of the speed profile, in physical units.
+
+    Fields can be NumPy arrays for describing the profiles of several devices.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_registers(cls, min_speed, max_speed, acc, dec):
+        """ Builds the parameters from the content of the registers.
+
+        The values can be scalars or NumPy arrays. Null accelerations and maximal speeds
+        are replaced by the smallest possible value, as the chip does for the former.
+
+        :param min_speed: the MIN_SPEED register value(s)
+        :param max_speed: the MAX_SPEED register value(s)
+        :param acc: the ACC register value(s)
+        :param dec: the DEC register value(s)
+        :rtype: ProfileParameters
+        """
+        if numpy is not None and any(isinstance(v, numpy.ndarray) for v in (min_speed, max_speed, acc, dec)):
+            acc, dec, max_speed = numpy.maximum(acc, 1), numpy.maximum(dec, 1), numpy.maximum(max_speed, 1)
+        else:
+            acc, dec, max_speed = max(acc, 1), max(dec, 1), max(max_speed, 1)
+        return cls(min_spd_from_reg(min_speed), max_spd_from_reg(max_speed), acc_from_reg(acc), dec_from_reg(dec))
+
+
+def goto_distance(position, target, direction=None):
+    """ Returns the direction and distance of a GoTo or GoToDir move, taking the position
+    wrap-around in account.
+
+    :param int position: the current position
+    :param int target: the target position
+    :param int direction: the forced direction (GoToDir), or None for the shortest path (GoTo)
+    :return: a tuple (direction, distance)
+    :rtype: tuple
+    """
+    delta = (target - position) % POS_RANGE
+    if direction is None:
+        if delta > POS_RANGE >> 1:
+            return Direction.REV, POS_RANGE - delta
+        return Direction.FWD, delta
+    if direction == Direction.FWD:
+        return direction, delta
+    return direction, (POS_RANGE - delta) % POS_RANGE
+
+
+def trapezoid(distance, v0, v_min, v_max, acc, dec):
+    """ Computes the speed profile of a positioning move.
+
+    The move starts at the current speed (or the minimal one if lower), accelerates up to the
+    maximum speed if the distance is long enough, and decelerates down to the minimal speed
+    before stopping on the target.
+
+    :param float distance: the length of the move (steps)
+    :param float v0: the initial speed (steps/s)
+    :param float v_min: the minimal speed (steps/s)
+    :param float v_max: the maximal speed (steps/s)
+    :param float acc: the acceleration (steps/s^2)
+    :param float dec: the deceleration (steps/s^2)
+    :return: the list of the profile phases, as tuples (duration, initial speed, acceleration)
+    :rtype: list
+    """
+    phases = []
+    if distance <= 0:
+        return phases
+
+    v_max = max(v_max, v_min, V_MAX_MIN)
+    vs = max(v0, v_min)
+    ve = v_min
+
+    if vs > v_max:
+        # slow down to the max speed first
+        d = (vs * vs - v_max * v_max) / (2 * dec)
+        if d < distance:
+            phases.append(((vs - v_max) / dec, vs, -dec))
+            distance -= d
+            vs = v_max
+
+    d_acc = (v_max * v_max - vs * vs) / (2 * acc)
+    d_dec = (v_max * v_max - ve * ve) / (2 * dec)
+    if d_acc + d_dec <= distance:
+        vp = v_max
+        cruise = (distance - d_acc - d_dec) / v_max
+    else:
+        # triangular profile
+        vp = math.sqrt(max((2 * acc * dec * distance + dec * vs * vs + acc * ve * ve) / (acc + dec), 0))
+        cruise = 0
+        if vp < vs:
+            # too short for the nominal deceleration: brake harder to stop on the target
+            a = (vs * vs - ve * ve) / (2 * distance)
+            phases.append(((vs - ve) / a, vs, -a))
+            return phases
+
+    if vp > vs:
+        phases.append(((vp - vs) / acc, vs, acc))
+    if cruise > 0:
+        phases.append((cruise, vp, 0.))
+    if vp > ve:
+        phases.append(((vp - ve) / dec, vp, -dec))
+    return phases
+
+
+def speed_change(v0, v1, acc, dec):
+    """ Computes the single phase profile going from a speed to another one.
+
+    :return: the list of phases (empty if speeds are equal)
+    :rtype: list
+    """
+    if v1 > v0:
+        return [((v1 - v0) / acc, v0, acc)]
+    elif v1 < v0:
+        return [((v0 - v1) / dec, v0, -dec)]
+    return []
+
+
+def profile_duration(phases):
+    """ Returns the total duration of a profile.
+    """
+    return sum(p[0] for p in phases)
+
+
+def profile_position(phases, t):
+    """ Returns the distance travelled at a given time along a profile.
+
+    :param list phases: the profile, as returned by :py:func:`trapezoid`
+    :param float t: the time elapsed since the start of the move
+    :rtype: float
+    """
+    position = 0.
+    for duration, v0, accel in phases:
+        if t < duration:
+            return position + v0 * t + accel * t * t / 2
+        position += v0 * duration + accel * duration * duration / 2
+        t -= duration
+    return position
+
+
+def move_duration(distance, params, v0=0.):
+    """ Returns the duration of a positioning move.
+
+    :param float distance: the length of the move (steps)
+    :param ProfileParameters params: the profile parameters
+    :param float v0: the initial speed (steps/s)
+    :rtype: float
+    """
+    return profile_duration(trapezoid(distance, v0, *params))
+
+
+def _check_numpy():
+    if numpy is None:
+        raise RuntimeError('NumPy not available')
+
+
+def _profiles(distances, params):
+    """ Computes the characteristics of the profiles of moves started at rest, as arrays
+    (distances, v_min, peak speed, acc, dec, accel time, cruise time, decel time).
+    """
+    d = numpy.maximum(numpy.asarray(distances, dtype=numpy.float64), 0)
+    v_min, v_max, acc, dec = (numpy.asarray(p, dtype=numpy.float64) for p in params)
+    v_max = numpy.maximum(numpy.maximum(v_max, v_min), V_MAX_MIN)
+
+    d_acc = (v_max * v_max - v_min * v_min) / (2 * acc)
+    d_dec = (v_max * v_max - v_min * v_min) / (2 * dec)
+    trapezoidal = d_acc + d_dec <= d
+    v_peak = numpy.where(
+        trapezoidal, v_max,
+        numpy.sqrt((2 * acc * dec * d + (acc + dec) * v_min * v_min) / (acc + dec))
+    )
+    t_cruise = numpy.where(trapezoidal, (d - d_acc - d_dec) / v_max, 0.)
+    t_acc = (v_peak - v_min) / acc
+    t_dec = (v_peak - v_min) / dec
+    return d, v_min, v_peak, acc, dec, t_acc, t_cruise, t_dec
+
+
+def move_durations(distances, params):
+    """ Vectorized version of :py:func:`move_duration`, for moves started at rest.
+
+    :param distances: the lengths of the moves (steps)
+    :param ProfileParameters params: the profile parameters (scalars or arrays broadcastable with distances)
+    :return: the durations (null for null distances)
+    :rtype: numpy.ndarray
+    """
+    _check_numpy()
+    d, _, _, _, _, t_acc, t_cruise, t_dec = _profiles(distances, params)
+    return numpy.where(d > 0, t_acc + t_cruise + t_dec, 0.)
+
+
+def move_positions(distances, params, t):
+    """ Returns the distance travelled at given times by moves started at rest.
+
+    :param distances: the lengths of the moves (steps)
+    :param ProfileParameters params: the profile parameters (scalars or arrays broadcastable with distances)
+    :param t: the times elapsed since the start of the moves (broadcastable with distances, e.g. a column
+    vector for sampling the position-vs-time curves of all the moves)
+    :return: the travelled distances
+    :rtype: numpy.ndarray
+    """
+    _check_numpy()
+    d, v_min, v_peak, acc, dec, t_acc, t_cruise, t_dec = _profiles(distances, params)
+    t = numpy.maximum(numpy.asarray(t, dtype=numpy.float64), 0)
+
+    t1 = numpy.minimum(t, t_acc)
+    accelerating = v_min * t1 + acc * t1 * t1 / 2
+    cruising = v_peak * numpy.clip(t - t_acc, 0, t_cruise)
+    # the deceleration phase is computed backward from the target
+    remaining = numpy.clip(t_acc + t_cruise + t_dec - t, 0, t_dec)
+    decelerating = numpy.where(t > t_acc + t_cruise, d - (v_min * remaining + dec * remaining * remaining / 2), 0.)
+
+    return numpy.where(
+        d <= 0, 0.,
+        numpy.where(t > t_acc + t_cruise, decelerating, accelerating + cruising)
+    )
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+""" Coordinated multi-axis moves on a daisy-chain.
+
+When moving several axes with :py:meth:`DaisyChain.goto`, each device follows its own
+speed profile, and the axes thus do not arrive at the same time. The
+:py:class:`LinearMovePlanner` scales instead the profile registers of each axis according
+to the length of its move, so that all the profiles are homothetic: the axes start and
+stop together, and the path is a straight line.
+
+The profile of the longest move is the fastest one respecting the nominal limits of all
+the axes. The nominal limits are the content of the MIN_SPEED, MAX_SPEED, ACC and DEC
+registers when the planner is created, or explicitly provided ones. They must be used
+in place of the registers values, since these ones are overwritten by the coordinated
+moves (see :py:meth:`LinearMovePlanner.restore`).
+
+The SetParam commands and the GoTo command of all the devices are sent in a single chain
+frame. As the ACC, DEC and MIN_SPEED registers can be written only when the motor is
+stopped, the involved axes must be at rest when the move is started.
+
+The synchronization accuracy is limited by the resolution of the registers, which is
+coarse for the small speeds of the axes having a short move (about 15 steps/s for
+MAX_SPEED). The durations predicted for each axis are available in the move plan.
+
+NumPy is required.
+"""
+
+from collections import namedtuple
+
+from . import pkg_log
+from .core import DSPIN
+from .defs import Register
+from .motion import POS_RANGE, PROFILE_REGISTERS, ProfileParameters, move_durations
+from . import vectorized
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'Eric Pascual'
+
+#: the LSPD_OPT flag of the MIN_SPEED register
+_LSPD_OPT = 0x1000
+
+
+def _check_numpy():
+    if numpy is None:
+        raise RuntimeError('NumPy not available')
+
+
+class LinearMove(namedtuple('LinearMove', 'targets distances mask min_speed max_speed acc dec durations')):
+    """ The plan of a coordinated move.
+
+    All the fields are arrays indexed by device position. The `mask` field tells which
+    devices are actually moving, and the profile registers values are relevant only for them.
+    """
+    __slots__ = ()
+
+    @property
+    def duration(self):
+        """ The predicted duration of the move (seconds). """
+        return float(self.durations.max()) if self.durations.size else 0.
+
+
+class LinearMovePlanner(object):
+    """ Plans and executes coordinated moves of the devices of a chain.
+    """
+    def __init__(self, chain, limits=None, logger=None):
+        """
+        :param DaisyChain chain: the chain
+        :param limits: the nominal MIN_SPEED, MAX_SPEED, ACC and DEC registers values of the
+        devices, as a sequence of 4 vectors. If None, the current content of the registers is used.
+        :param logger: optional logger. If None, a new one will be created
+        """
+        _check_numpy()
+        self._chain = chain
+        self.logger = logger or pkg_log.getChild(self.__class__.__name__)
+
+        count = chain.device_count
+        if limits is None:
+            snapshot = chain.read_registers(PROFILE_REGISTERS)
+            limits = [snapshot[reg] for reg in PROFILE_REGISTERS]
+        limits = [vectorized._as_vector(v, count) for v in limits]
+        if len(limits) != len(PROFILE_REGISTERS) or any(v.shape != (count,) for v in limits):
+            raise ValueError('limits must be 4 vectors of %d values' % count)
+
+        min_speed, max_speed, acc, dec = limits
+        self._lspd_opt = min_speed & _LSPD_OPT
+        # null accelerations and speeds would prevent any move
+        self.limits = (
+            min_speed & ~_LSPD_OPT,
+            numpy.maximum(max_speed, 1),
+            numpy.maximum(acc, 1),
+            numpy.maximum(dec, 1),
+        )
+        #: the plan of the last executed move
+        self.last_move = None
+
+    def plan(self, targets, positions, mask=None):
+        """ Computes the profile registers values of a coordinated move.
+
+        :param targets: the target positions
+        :param positions: the current positions
+        :param mask: the devices involved in the move (default: all)
+        :rtype: LinearMove
+        """
+        targets = vectorized._as_vector(targets)
+        positions = vectorized._as_vector(positions, len(targets))
+        mask = vectorized._as_mask(mask, len(targets))
+
+        # shortest path, as taken by GoTo
+        delta = (targets - positions) % POS_RANGE
+        distances = numpy.where(delta > POS_RANGE >> 1, POS_RANGE - delta, delta)
+        distances[~mask] = 0
+        moving = distances > 0
+
+        if not moving.any():
+            zeros = numpy.zeros_like(distances)
+            return LinearMove(targets, distances, moving, zeros, zeros, zeros, zeros, numpy.zeros(len(targets)))
+
+        # the ratio of the move of each axis with respect to the longest one
+        ratios = distances / float(distances.max())
+        registers = []
+        for limit, lowest in zip(self.limits, (0, 1, 1, 1)):
+            # the fastest profile of the longest move which respects the limits of all the axes
+            common = (limit[moving] / ratios[moving]).min()
+            registers.append(numpy.clip(numpy.rint(common * ratios), lowest, limit).astype(numpy.int64))
+        min_speed, max_speed, acc, dec = registers
+
+        durations = numpy.where(
+            moving,
+            move_durations(distances, ProfileParameters.from_registers(min_speed, max_speed, acc, dec)),
+            0.
+        )
+        return LinearMove(targets, distances, moving, min_speed | self._lspd_opt, max_speed, acc, dec, durations)
+
+    def frame(self, move):
+        """ Builds the frame executing a planned move.
+
+        :param LinearMove move: the move
+        :return: the frame, made of the SetParam commands followed by the GoTo one
+        :rtype: numpy.ndarray
+        """
+        return numpy.hstack(
+            self._profile_frames((move.min_speed, move.max_speed, move.acc, move.dec), move.mask) +
+            [vectorized.goto_frame(move.targets, move.mask)]
+        )
+
+    @staticmethod
+    def _profile_frames(values, mask=None):
+        return [vectorized.set_param_frame(reg, v, mask) for reg, v in zip(PROFILE_REGISTERS, values)]
+
+    def _update_shadow(self, values, devices):
+        shadow = self._chain.shadow
+        if shadow is not None:
+            for reg, v in zip(PROFILE_REGISTERS, values):
+                for d in devices:
+                    shadow.update(d, reg, int(v[d]))
+
+    def goto(self, targets, wait=True, wait_cb=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT, mask=None, positions=None):
+        """ Executes a coordinated move.
+
+        The plan of the move is available in :py:attr:`last_move` once started.
+
+        :param targets: the target positions
+        :param bool wait: wait until the move is finished before returning
+        :param wait_cb: an optional callback to be called while waiting
+        :param timeout: the max wait time in seconds, None for deriving it from the planned duration
+        :param mask: the devices involved in the move (default: all)
+        :param positions: the current positions, if known. They are read otherwise.
+        :return: the moves completions if the chain tracks them (see :py:meth:`DaisyChain.goto`)
+        """
+        chain = self._chain
+        if positions is None:
+            positions = chain.read_registers((Register.ABS_POS,))[Register.ABS_POS]
+        move = self.last_move = self.plan(targets, positions, mask)
+        self.logger.debug('goto(%s) planned durations: %s', targets, move.durations)
+        if not move.mask.any():
+            return None
+
+        chain._xfer_array(self.frame(move))
+        devices = [int(d) for d in numpy.flatnonzero(move.mask)]
+        self._update_shadow((move.min_speed, move.max_speed, move.acc, move.dec), devices)
+
+        return chain._move_started(
+            devices, wait, wait_cb, timeout,
+            targets=[int(t) if m else None for t, m in zip(move.targets, move.mask)],
+            durations=[float(t) if m else None for t, m in zip(move.durations, move.mask)]
+        )
+
+    def restore(self):
+        """ Writes back the nominal limits in the profile registers of all the devices, in a
+        single frame.
+        """
+        min_speed, max_speed, acc, dec = self.limits
+        values = (min_speed | self._lspd_opt, max_speed, acc, dec)
+        self._chain._xfer_array(numpy.hstack(self._profile_frames(values)))
+        self._update_shadow(values, range(self._chain.device_count))
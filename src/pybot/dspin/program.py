@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+
+""" Motion programs compiled into pre-encoded frames.
+
+Repetitive cycles send the same commands over and over. A :py:class:`MotionProgram`
+describes such a sequence once, either with Python calls or as text, and compiles it into
+a binary file containing the chain frames ready to be sent, separated by wait markers::
+
+    program = MotionProgram.parse(open('cycle.txt').read())
+    program.save('cycle.bin')
+
+    runner = ProgramRunner(chain, 'cycle.bin')
+    runner.run(repeat=1000)
+
+The :py:class:`ProgramRunner` memory-maps the file and copies the frames straight into the
+transmit buffer of the SPI device, without any encoding at execution time. The consecutive
+steps not separated by a wait are merged into a single burst.
+
+Text format: one step per line, `#` starting a comment. The parameters of the commands
+are given per device, `-` standing for the devices not involved::
+
+    devices 3
+    set MAX_SPEED 0x41                  # a single value is used for all the devices
+    set ACC 0x8a - 0x40
+    goto 1000 -2000 -
+    move fwd:400 rev:200 -
+    goto_dir fwd:0 - -
+    run fwd:800 - -
+    soft_stop                           # parameter-less commands, for all the devices
+    hard_hiz 0 2                        # ... or for the given ones
+    wait 5                              # waits for the moves end (optional timeout, seconds)
+    sleep 0.2
+
+The `devices` line, if present, must come first. The parameter-less commands are:
+`soft_stop`, `hard_stop`, `soft_hiz`, `hard_hiz`, `go_home`, `go_mark` and `reset_pos`.
+
+Compiled programs can be listed with :py:func:`disassemble`::
+
+    python -m pybot.dspin.program disasm cycle.bin
+
+File format: a header made of the magic string, the format version, the number of devices
+and the number of steps, followed by the steps. Each step is made of its kind and the
+length of its data, followed by the data: the chain frame bytes (column-major, one byte
+per device in each column) for the FRAME steps, and the duration or timeout (double,
+seconds) for the SLEEP and WAIT ones.
+"""
+
+import argparse
+import mmap
+import struct
+import textwrap
+import time
+
+from . import commands, pkg_log
+from .defs import Direction
+from .recorder import Record, SEGMENTS, TrafficDecoder
+from .snapshot import as_register
+
+__author__ = 'Eric Pascual'
+
+MAGIC = b'DSPP'
+VERSION = 1
+
+_FILE_HEADER = struct.Struct('<4sBBI')
+_STEP_HEADER = struct.Struct('<BI')
+_DURATION = struct.Struct('<d')
+
+#: the kinds of steps
+FRAME, WAIT, SLEEP = range(1, 4)
+STEP_NAMES = {FRAME: 'frame', WAIT: 'wait', SLEEP: 'sleep'}
+
+_SIMPLE_COMMANDS = {
+    'soft_stop': commands.SOFT_STOP,
+    'hard_stop': commands.HARD_STOP,
+    'soft_hiz': commands.SOFT_HIZ,
+    'hard_hiz': commands.HARD_HIZ,
+    'go_home': commands.GO_HOME,
+    'go_mark': commands.GO_MARK,
+    'reset_pos': commands.RESET_POS,
+}
+
+_DIRECTIONS = {'fwd': Direction.FWD, 'rev': Direction.REV}
+
+
+class ProgramError(ValueError):
+    """ Raised when a program text is invalid, with the line number. """
+    def __init__(self, line_num, message):
+        super(ProgramError, self).__init__('line %d: %s' % (line_num, message))
+        self.line_num = line_num
+
+
+class MotionProgram(object):
+    """ A sequence of commands and waits, compiled into pre-encoded frames.
+
+    The methods adding commands accept per device parameters as sequences, `None` being
+    used for the devices not involved, or as a single value used for all the devices.
+    """
+    def __init__(self, device_count=1):
+        """
+        :param int device_count: the number of devices of the chain (1 for a single device)
+        """
+        if device_count < 1:
+            raise ValueError('invalid device count (%s)' % device_count)
+        self.device_count = device_count
+        # the steps, as (kind, data) tuples
+        self._steps = []
+
+    def __len__(self):
+        return len(self._steps)
+
+    def _per_device(self, values):
+        if isinstance(values, (list, tuple)):
+            if len(values) != self.device_count:
+                raise ValueError('expected %d values, got %d' % (self.device_count, len(values)))
+            return list(values)
+        return [values] * self.device_count
+
+    def _add_commands(self, cmds):
+        """ Encodes a command per device (None for devices not involved) as a frame, merged
+        with the previous one if not separated by a wait.
+
+        :raise: ValueError if no device is involved
+        """
+        n = self.device_count
+        sizes = [cmd.size for cmd in cmds if cmd is not None]
+        if not sizes:
+            raise ValueError('no device involved')
+        size = max(sizes)
+        frame = bytearray(size * n)
+        for i, cmd in enumerate(cmds):
+            if cmd is not None:
+                cmd.encode_into(frame, i, n)
+        if self._steps and self._steps[-1][0] == FRAME:
+            self._steps[-1][1].extend(frame)
+        else:
+            self._steps.append((FRAME, frame))
+        return self
+
+    def set_param(self, reg, values):
+        """ Writes a register.
+
+        :param reg: the register, as a definition or a name
+        :param values: the register values
+        """
+        reg = as_register(reg)
+        return self._add_commands([
+            commands.SetParam(reg, v) if v is not None else None for v in self._per_device(values)
+        ])
+
+    def goto(self, positions):
+        return self._add_commands([commands.GoTo(p) if p is not None else None for p in self._per_device(positions)])
+
+    def goto_dir(self, directions, positions):
+        return self._add_commands([
+            commands.GoToDir(d, p) if p is not None else None
+            for d, p in zip(self._per_device(directions), self._per_device(positions))
+        ])
+
+    def move(self, directions, steps):
+        return self._add_commands([
+            commands.Move(d, s) if s is not None else None
+            for d, s in zip(self._per_device(directions), self._per_device(steps))
+        ])
+
+    def run(self, directions, speeds):
+        """ Starts the motors (speeds in steps/s).
+        """
+        return self._add_commands([
+            commands.Run(d, s) if s is not None else None
+            for d, s in zip(self._per_device(directions), self._per_device(speeds))
+        ])
+
+    def command(self, command, devices=None):
+        """ Sends a parameter-less command (e.g. :py:data:`commands.SOFT_STOP`).
+
+        :param commands.Command command: the command
+        :param iterable devices: the positions of the devices (default: all)
+        """
+        return self._add_commands([
+            command if devices is None or d in devices else None for d in range(self.device_count)
+        ])
+
+    def wait(self, timeout=None):
+        """ Waits for the end of the moves in progress.
+
+        :param float timeout: the max wait time (seconds). If None, the default one of
+        :py:meth:`DSPIN.wait_for_move_complete` is used.
+        """
+        self._steps.append((WAIT, timeout or 0.))
+        return self
+
+    def sleep(self, duration):
+        """ Pauses the execution.
+
+        :param float duration: the pause duration (seconds)
+        """
+        self._steps.append((SLEEP, duration))
+        return self
+
+    def compile(self):
+        """ Returns the binary form of the program.
+
+        :rtype: bytes
+        """
+        chunks = [_FILE_HEADER.pack(MAGIC, VERSION, self.device_count, len(self._steps))]
+        for kind, data in self._steps:
+            data = bytes(data) if kind == FRAME else _DURATION.pack(data)
+            chunks.append(_STEP_HEADER.pack(kind, len(data)))
+            chunks.append(data)
+        return b''.join(chunks)
+
+    def save(self, path):
+        with open(path, 'wb') as fp:
+            fp.write(self.compile())
+
+    @classmethod
+    def parse(cls, text):
+        """ Builds a program from its text form (see the module documentation).
+
+        :param str text: the program text
+        :rtype: MotionProgram
+        :raise: ProgramError if the text is invalid
+        """
+        program = None
+        for line_num, line in enumerate(text.splitlines(), 1):
+            words = line.split('#', 1)[0].split()
+            if not words:
+                continue
+            keyword, args = words[0].lower(), words[1:]
+            try:
+                if keyword == 'devices':
+                    if program is not None:
+                        raise ValueError('the devices count must be given first')
+                    program = cls(int(args[0]))
+                    continue
+                if program is None:
+                    program = cls()
+                program._parse_step(keyword, args)
+            except (ValueError, IndexError, KeyError) as e:
+                raise ProgramError(line_num, '%s (%s)' % (e.__class__.__name__, e))
+        return program or cls()
+
+    def _parse_values(self, args, parse):
+        values = [None if a == '-' else parse(a) for a in args]
+        return values[0] if len(values) == 1 else values
+
+    def _parse_step(self, keyword, args):
+        def directed(arg):
+            direction, value = arg.lower().split(':')
+            return _DIRECTIONS[direction], int(value, 0)
+
+        if keyword in _SIMPLE_COMMANDS:
+            self.command(_SIMPLE_COMMANDS[keyword], [int(a) for a in args] or None)
+        elif keyword == 'set':
+            self.set_param(args[0].upper(), self._parse_values(args[1:], lambda a: int(a, 0)))
+        elif keyword == 'goto':
+            self.goto(self._parse_values(args, lambda a: int(a, 0)))
+        elif keyword in ('goto_dir', 'move', 'run'):
+            values = self._parse_values(args, directed)
+            if isinstance(values, list):
+                directions = [v[0] if v else None for v in values]
+                params = [v[1] if v else None for v in values]
+            else:
+                directions, params = values
+            getattr(self, keyword)(directions, params)
+        elif keyword == 'wait':
+            self.wait(float(args[0]) if args else None)
+        elif keyword == 'sleep':
+            self.sleep(float(args[0]))
+        else:
+            raise ValueError('unknown command %s' % keyword)
+
+
+def _read_steps(data):
+    """ Parses the binary form of a program.
+
+    :param data: the program bytes (or an mmap)
+    :return: the number of devices and the list of steps, as (kind, offset, length, duration)
+    tuples, the duration being None for the frames
+    :rtype: tuple
+    :raise: ValueError if not a valid program
+    """
+    if len(data) < _FILE_HEADER.size:
+        raise ValueError('truncated program header')
+    magic, version, device_count, count = _FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a motion program, or unsupported version')
+    steps = []
+    offset = _FILE_HEADER.size
+    for _ in range(count):
+        kind, length = _STEP_HEADER.unpack_from(data, offset)
+        offset += _STEP_HEADER.size
+        if offset + length > len(data) or kind not in STEP_NAMES:
+            raise ValueError('corrupted program')
+        duration = _DURATION.unpack_from(data, offset)[0] if kind != FRAME else None
+        steps.append((kind, offset, length, duration))
+        offset += length
+    return device_count, steps
+
+
+class ProgramRunner(object):
+    """ Executes a compiled program on a :py:class:`DSPIN` or :py:class:`DaisyChain`.
+
+    The frames are copied from the memory-mapped file into the transmit buffer of the SPI
+    device, and sent in a single transfer each (or in several ones for those exceeding the
+    buffer size).
+    """
+    def __init__(self, dspin, path, logger=None):
+        """
+        :param DSPIN dspin: the device (single or daisy-chain)
+        :param str path: the path of the compiled program
+        :param logger: optional logger. If None, a new one will be created
+        :raise: ValueError if the program is invalid, or compiled for another number of devices
+        """
+        self._dspin = dspin
+        self.logger = logger or pkg_log.getChild(self.__class__.__name__)
+        with open(path, 'rb') as fp:
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            device_count, self._steps = _read_steps(self._map)
+            if device_count != dspin.device_count:
+                raise ValueError('program compiled for %d device(s), not %d' % (device_count, dspin.device_count))
+        except ValueError:
+            self._map.close()
+            raise
+        try:
+            self._view = memoryview(self._map)
+        except TypeError:
+            # Python 2 mmaps do not support the new buffer protocol, and are sliced instead
+            self._view = self._map
+
+        spi = dspin._spi
+        self._use_buffer = hasattr(spi, 'xfer_buffer') and getattr(dspin, '_frame_burst', True)
+        if self._use_buffer:
+            # the transfers must end on a column boundary
+            self._max_length = len(spi.tx_buffer) - len(spi.tx_buffer) % device_count
+
+    def close(self):
+        if self._map is not None:
+            if self._view is not self._map:
+                self._view.release()
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _send_frame(self, offset, length):
+        dspin = self._dspin
+        n = dspin.device_count
+        if not self._use_buffer:
+            frame = bytearray(self._view[offset:offset + length])
+            if n == 1:
+                dspin._spi.xfer(list(frame))
+            else:
+                dspin._xfer_frame(frame)
+            return
+
+        spi, view, max_length = dspin._spi, self._view, self._max_length
+        tx_buffer = spi.tx_buffer
+        end = offset + length
+        with spi.lock:
+            while offset < end:
+                size = min(max_length, end - offset)
+                tx_buffer[:size] = view[offset:offset + size]
+                spi.xfer_buffer(size, n)
+                offset += size
+
+    def run(self, repeat=1, wait_cb=None):
+        """ Executes the program.
+
+        Since the program writes registers behind the back of the device instance, its
+        registers shadow is invalidated.
+
+        :param int repeat: the number of executions
+        :param wait_cb: an optional callback invoked while waiting (see
+        :py:meth:`DSPIN.wait_for_move_complete`)
+        :raise: CommandTimeOut if a move is not complete in time
+        """
+        dspin = self._dspin
+        default_timeout = dspin.DEFAULT_MOVE_TIMEOUT
+        send_frame = self._send_frame
+        try:
+            for _ in range(repeat):
+                for kind, offset, length, duration in self._steps:
+                    if kind == FRAME:
+                        send_frame(offset, length)
+                    elif kind == WAIT:
+                        dspin.wait_for_move_complete(wait_cb, timeout=duration or default_timeout)
+                    else:
+                        time.sleep(duration)
+        finally:
+            dspin.invalidate_shadow()
+
+
+def disassemble(path_or_data):
+    """ Decodes a compiled program.
+
+    :param path_or_data: the path of the program, or its binary form
+    :return: an iterator on the steps, as (step index, kind name, details) tuples, where
+    details is the list of decoded commands (see :py:class:`recorder.Operation`) for the
+    frames, and the duration for the waits and sleeps
+    :raise: ValueError if not a valid program
+    """
+    # paths are bytes too with Python 2
+    if isinstance(path_or_data, bytearray) or path_or_data[:len(MAGIC)] == MAGIC:
+        data = path_or_data
+    else:
+        with open(path_or_data, 'rb') as fp:
+            data = fp.read()
+    device_count, steps = _read_steps(data)
+    decoder = TrafficDecoder(device_count)
+    for i, (kind, offset, length, duration) in enumerate(steps):
+        if kind == FRAME:
+            frame = bytearray(data[offset:offset + length])
+            ops = decoder.feed(Record(float(i), SEGMENTS, device_count, frame, bytearray(length)))
+            yield i, STEP_NAMES[kind], ops
+        else:
+            yield i, STEP_NAMES[kind], duration
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(__doc__)
+    )
+    subparsers = parser.add_subparsers(dest='action')
+    parser_compile = subparsers.add_parser('compile', help='compile a program text')
+    parser_compile.add_argument('source', help='the program text file')
+    parser_compile.add_argument('-o', '--output', help='the compiled program (default: source with .bin extension)')
+    parser_disasm = subparsers.add_parser('disasm', help='list a compiled program')
+    parser_disasm.add_argument('program', help='the compiled program')
+    parser_run = subparsers.add_parser('run', help='execute a compiled program on the active backend')
+    parser_run.add_argument('program', help='the compiled program')
+    parser_run.add_argument('-r', '--repeat', type=int, default=1, help='the number of executions')
+    args = parser.parse_args()
+
+    if args.action == 'compile':
+        with open(args.source) as fp:
+            program = MotionProgram.parse(fp.read())
+        output = args.output or args.source.rsplit('.', 1)[0] + '.bin'
+        program.save(output)
+        print('%d step(s) compiled in %s' % (len(program), output))
+
+    elif args.action == 'disasm':
+        for i, kind, details in disassemble(args.program):
+            if kind == 'frame':
+                print('%04d frame' % i)
+                for op in details:
+                    print('       [%d] %s%s%s' % (
+                        op.device, op.command,
+                        '(%s)' % op.register.name if op.register else '',
+                        ' 0x%x' % op.value if op.value is not None else ''
+                    ))
+            else:
+                print('%04d %s %s' % (i, kind, details or ''))
+
+    elif args.action == 'run':
+        from .core import DSPIN, DSPinSpiDev
+        from .daisychain import DaisyChain
+        with open(args.program, 'rb') as fp:
+            device_count = _FILE_HEADER.unpack(fp.read(_FILE_HEADER.size))[2]
+        spi = DSPinSpiDev()
+        if device_count > 1:
+            dspin = DaisyChain(device_count, spi, 11, 13, logger=None)
+        else:
+            dspin = DSPIN(spi, 11, 13)
+        if not dspin.initialize():
+            raise SystemExit('devices initialization failed')
+        with ProgramRunner(dspin, args.program) as runner:
+            start = time.time()
+            runner.run(args.repeat)
+            print('executed %d time(s) in %.3fs' % (args.repeat, time.time() - start))
+
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
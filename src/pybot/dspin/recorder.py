@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+
+""" Recording, replay and decoding of the SPI traffic.
+
+A :py:class:`RecordingSpiDev` is used in place of a :py:class:`DSPinSpiDev`, and appends
+every transfer (request, reply, CS toggling mode and timestamp) to a binary log through a
+:py:class:`TrafficRecorder`::
+
+    with TrafficRecorder('/var/log/dspin.bin') as recorder:
+        spi = RecordingSpiDev(recorder)
+        chain = DaisyChain(4, spi, ...)
+        ...
+
+The records are packed in a preallocated buffer, written to the file only when full, so
+that recording costs a few copies per transfer.
+
+The log can then be replayed through the emulator, or on explicit request through the real
+bus, with the original timing or at full speed, the replies being compared with the recorded
+ones (:py:class:`Replayer`), or decoded into dSPIN commands and registers accesses
+(:py:class:`TrafficDecoder`)::
+
+    python -m pybot.dspin.recorder /var/log/dspin.bin --chain-length 4
+    python -m pybot.dspin.recorder /var/log/dspin.bin --chain-length 4 --replay
+
+Log format: a header made of the magic string, the format version and the wall-clock time
+of the recording start, followed by the records. Each record is made of the timestamp
+(seconds since the start, from the monotonic clock when available), the transfer method,
+the CS segment length and the data length, followed by the request and reply bytes.
+"""
+
+import argparse
+from collections import namedtuple
+import struct
+import sys
+import threading
+import textwrap
+import time
+
+from . import pkg_log
+from .core import DSPinSpiDev
+from .codec import codec_for
+from .commands import OpCodes
+from .defs import Register
+from .snapshot import ALL_REGISTERS
+
+__author__ = 'Eric Pascual'
+
+MAGIC = b'DSPR'
+VERSION = 1
+
+_FILE_HEADER = struct.Struct('<4sBd')
+_RECORD_HEADER = struct.Struct('<dBHI')
+
+#: the recorded transfer methods
+XFER, XFER2, SEGMENTS = range(3)
+METHOD_NAMES = ('xfer', 'xfer2', 'segments')
+
+#: the clock used for timestamping the records
+clock = getattr(time, 'monotonic', time.time)
+
+
+class Record(namedtuple('Record', 'timestamp method seg_len request reply')):
+    """ A recorded transfer.
+
+    :ivar float timestamp: the time of the transfer, in seconds since the recording start
+    :ivar int method: the transfer method (XFER, XFER2 or SEGMENTS)
+    :ivar int seg_len: the number of bytes sent between CS toggles
+    :ivar bytearray request: the sent bytes
+    :ivar bytearray reply: the received bytes
+    """
+    __slots__ = ()
+
+
+class TrafficRecorder(object):
+    """ Writes the transfers records in a binary log.
+    """
+    def __init__(self, path_or_file, buffer_size=65536):
+        """
+        :param path_or_file: the path of the log, or a binary file object opened for writing
+        :param int buffer_size: the size of the records buffer (bytes)
+        """
+        if hasattr(path_or_file, 'write'):
+            self._file, self._owned = path_or_file, False
+        else:
+            self._file, self._owned = open(path_or_file, 'wb'), True
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._offset = 0
+        self._lock = threading.Lock()
+        self._t0 = clock()
+        #: the number of recorded transfers
+        self.records = 0
+
+        self._file.write(_FILE_HEADER.pack(MAGIC, VERSION, time.time()))
+
+    def record(self, method, seg_len, request, reply):
+        """ Appends a transfer to the log.
+
+        :param int method: the transfer method
+        :param int seg_len: the number of bytes sent between CS toggles
+        :param request: the sent bytes (any bytes-like object or list of ints)
+        :param reply: the received bytes, of the same length
+        """
+        timestamp = clock() - self._t0
+        length = len(request)
+        size = _RECORD_HEADER.size + 2 * length
+        with self._lock:
+            if self._offset + size > len(self._buf):
+                self._flush()
+                if size > len(self._buf):
+                    # too large for the buffer: written directly
+                    self._file.write(_RECORD_HEADER.pack(timestamp, method, seg_len, length))
+                    self._file.write(bytearray(request))
+                    self._file.write(bytearray(reply))
+                    self.records += 1
+                    return
+            offset = self._offset
+            _RECORD_HEADER.pack_into(self._buf, offset, timestamp, method, seg_len, length)
+            offset += _RECORD_HEADER.size
+            self._buf[offset:offset + length] = request
+            offset += length
+            self._buf[offset:offset + length] = reply
+            self._offset = offset + length
+            self.records += 1
+
+    def _flush(self):
+        if self._offset:
+            self._file.write(self._view[:self._offset])
+            self._offset = 0
+
+    def flush(self):
+        """ Writes the buffered records to the log. """
+        with self._lock:
+            self._flush()
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush()
+            if self._owned:
+                self._file.close()
+            else:
+                self._file.flush()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RecordingSpiDev(DSPinSpiDev):
+    """ A SPI device recording all its transfers.
+    """
+    def __init__(self, recorder, *args, **kwargs):
+        """
+        :param TrafficRecorder recorder: the recorder
+        Other parameters are the ones of :py:class:`DSPinSpiDev`.
+        """
+        super(RecordingSpiDev, self).__init__(*args, **kwargs)
+        self.recorder = recorder
+
+    def xfer_buffer(self, length, seg_len=1):
+        with self.lock:
+            result = super(RecordingSpiDev, self).xfer_buffer(length, seg_len)
+            self.recorder.record(SEGMENTS, seg_len, memoryview(self._tx_buf)[:length], memoryview(result)[:length])
+            return result
+
+    def xfer_segments(self, values, seg_len):
+        with self.lock:
+            result = super(RecordingSpiDev, self).xfer_segments(values, seg_len)
+            self.recorder.record(SEGMENTS, seg_len, values, result)
+            return result
+
+    def xfer(self, values=None):
+        with self.lock:
+            result = super(RecordingSpiDev, self).xfer(values)
+            self.recorder.record(XFER, 1, values, result)
+            return result
+
+    def xfer2(self, values=None):
+        with self.lock:
+            result = super(RecordingSpiDev, self).xfer2(values)
+            self.recorder.record(XFER2, len(result), values, result)
+            return result
+
+
+def read_records(path_or_file):
+    """ Reads a log.
+
+    :param path_or_file: the path of the log, or a binary file object opened for reading
+    :return: the start time of the recording (wall-clock) and an iterator on the records
+    :rtype: tuple
+    :raise: ValueError if the file is not a valid log
+    """
+    fp = path_or_file if hasattr(path_or_file, 'read') else open(path_or_file, 'rb')
+    header = fp.read(_FILE_HEADER.size)
+    if len(header) < _FILE_HEADER.size:
+        raise ValueError('truncated log header')
+    magic, version, start_time = _FILE_HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a traffic log, or unsupported version')
+
+    def records():
+        try:
+            while True:
+                header = fp.read(_RECORD_HEADER.size)
+                if len(header) < _RECORD_HEADER.size:
+                    return
+                timestamp, method, seg_len, length = _RECORD_HEADER.unpack(header)
+                data = bytearray(fp.read(2 * length))
+                if len(data) < 2 * length:
+                    # truncated by a crash of the recording process
+                    return
+                yield Record(timestamp, method, seg_len, data[:length], data[length:])
+        finally:
+            if fp is not path_or_file:
+                fp.close()
+
+    return start_time, records()
+
+
+class EmulatedBus(object):
+    """ A device of the emulated board (see :py:mod:`emulator`), with the transfer methods
+    of :py:class:`DSPinSpiDev`, whatever the active backend is.
+    """
+    def __init__(self, spi_bus=0, spi_dev=0):
+        """
+        :param int spi_bus: the SPI bus id
+        :param int spi_dev: the SPI device id
+        """
+        from . import emulator
+        self._spi = emulator.SpiDev()
+        self._spi.open(spi_bus, spi_dev)
+
+    def xfer(self, values):
+        return self._spi.transfer_message(values, 1)
+
+    def xfer2(self, values):
+        return self._spi.xfer(values)
+
+    def xfer_segments(self, values, seg_len):
+        return self._spi.transfer_message(values, seg_len)
+
+
+class Replayer(object):
+    """ Sends the requests of a log through a SPI device, and checks the replies.
+
+    Since a replay moves the motors as the original traffic did, the real bus is only used
+    when explicitly requested.
+    """
+    def __init__(self, records, spi=None, speed=1., logger=None, real_bus=False):
+        """
+        :param iterable records: the records
+        :param DSPinSpiDev spi: the device used for the replay. If None, a device is opened
+        on bus 0, device 0 of the emulated board, or of the active backend if `real_bus` is
+        set.
+        :param float speed: the replay speed with respect to the original one, None or 0 for
+        replaying as fast as possible
+        :param logger: optional logger. If None, a new one will be created
+        :param bool real_bus: if True and no device is provided, replay through the active
+        backend, i.e. on the real hardware when running on a RasPi
+        """
+        self._records = records
+        if spi is None:
+            if real_bus:
+                spi = DSPinSpiDev()
+                spi.open()
+            else:
+                spi = EmulatedBus()
+        self._spi = spi
+        self._speed = speed
+        self.logger = logger or pkg_log.getChild(self.__class__.__name__)
+
+    def run(self):
+        """ Replays the log.
+
+        :return: the list of the records which reply differs from the one obtained, as tuples
+        (record, reply)
+        :rtype: list
+        """
+        spi, speed = self._spi, self._speed
+        methods = (
+            lambda r: spi.xfer(list(r.request)),
+            lambda r: spi.xfer2(list(r.request)),
+            lambda r: spi.xfer_segments(r.request, r.seg_len),
+        )
+        mismatches = []
+        count = 0
+        t0 = clock()
+        for record in self._records:
+            if speed:
+                delay = record.timestamp / speed - (clock() - t0)
+                if delay > 0:
+                    time.sleep(delay)
+            reply = bytearray(methods[record.method](record))
+            if reply != record.reply:
+                mismatches.append((record, reply))
+            count += 1
+        self.logger.info('%d transfers replayed, %d mismatches', count, len(mismatches))
+        return mismatches
+
+
+class Operation(namedtuple('Operation', 'timestamp device opcode command register value')):
+    """ A decoded command.
+
+    :ivar float timestamp: the time of the transfer containing the end of the command
+    :ivar int device: the position of the device in the chain
+    :ivar int opcode: the raw opcode, including the embedded parameters (direction,...)
+    :ivar str command: the command name
+    :ivar RegisterDefinition register: the register, for GetParam and SetParam, None otherwise
+    :ivar int value: the parameter of the command, or the value read for GetParam and
+    GetStatus (None for commands without parameter)
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return '%10.6f [%d] %s%s%s' % (
+            self.timestamp, self.device, self.command,
+            '(%s)' % self.register.name if self.register else '',
+            ' 0x%x' % self.value if self.value is not None else ''
+        )
+
+
+_REGISTERS_BY_ADDR = dict((r.addr, r) for r in ALL_REGISTERS)
+
+
+def _command_formats():
+    """ Returns the name, the register, the parameter size and the definition used for
+    decoding the parameter of the commands, by opcode byte.
+
+    The parameters of the motion commands have the format of the register they are
+    related to (ABS_POS for the positions and steps counts, SPEED for the speeds).
+    """
+    formats = [None] * 256
+    for opcode, params, name, size, value_def in (
+            (OpCodes.GET_PARAM, 0x1f, 'GET_PARAM', None, None),
+            (OpCodes.SET_PARAM, 0x1f, 'SET_PARAM', None, None),
+            (OpCodes.GO_UNTIL, 0x09, 'GO_UNTIL', 3, Register.SPEED),
+            (OpCodes.RELEASE_SW, 0x09, 'RELEASE_SW', 0, None),
+            (OpCodes.RUN, 0x01, 'RUN', 3, Register.SPEED),
+            (OpCodes.STEP_CLOCK, 0x01, 'STEP_CLOCK', 0, None),
+            (OpCodes.MOVE, 0x01, 'MOVE', 3, Register.ABS_POS),
+            (OpCodes.GOTO_DIR, 0x01, 'GOTO_DIR', 3, Register.ABS_POS),
+            (OpCodes.GOTO, 0, 'GOTO', 3, Register.ABS_POS),
+            (OpCodes.GO_HOME, 0, 'GO_HOME', 0, None),
+            (OpCodes.GO_MARK, 0, 'GO_MARK', 0, None),
+            (OpCodes.RESET_POS, 0, 'RESET_POS', 0, None),
+            (OpCodes.RESET_DEVICE, 0, 'RESET_DEVICE', 0, None),
+            (OpCodes.SOFT_STOP, 0, 'SOFT_STOP', 0, None),
+            (OpCodes.HARD_STOP, 0, 'HARD_STOP', 0, None),
+            (OpCodes.SOFT_HIZ, 0, 'SOFT_HIZ', 0, None),
+            (OpCodes.HARD_HIZ, 0, 'HARD_HIZ', 0, None),
+            (OpCodes.GET_STATUS, 0, 'GET_STATUS', 2, Register.STATUS),
+    ):
+        for value in range(256):
+            if value & ~params == opcode and formats[value] is None:
+                if size is None:
+                    reg = _REGISTERS_BY_ADDR.get(value & 0x1f)
+                    if reg is None:
+                        continue
+                    formats[value] = (name, reg, reg.nbytes, reg)
+                else:
+                    formats[value] = (name, None, size, value_def)
+    return formats
+
+_COMMAND_FORMATS = _command_formats()
+
+
+class _DeviceStream(object):
+    """ Decoding state of the bytes stream of a device. """
+    __slots__ = ('opcode', 'format', 'request', 'reply')
+
+    def __init__(self):
+        self.opcode = None
+        self.format = None
+        self.request = []
+        self.reply = []
+
+
+class TrafficDecoder(object):
+    """ Decodes the commands contained in the transfers.
+
+    The bytes streams of the devices are extracted from the chain frames, and decoded
+    across the transfers, so that commands split over several of them (e.g. chain frames
+    sent column by column) are correctly processed.
+    """
+    def __init__(self, chain_length=1):
+        """
+        :param int chain_length: the number of devices on the bus
+        """
+        self._chain_length = chain_length
+        self._streams = [_DeviceStream() for _ in range(chain_length)]
+        #: the number of bytes which are not a valid opcode
+        self.errors = 0
+
+    def feed(self, record):
+        """ Decodes a record.
+
+        :param Record record: the record
+        :return: the commands completed by this transfer
+        :rtype: list
+        """
+        result = []
+        n = self._chain_length
+        for device, stream in enumerate(self._streams):
+            for tx, rx in zip(record.request[device::n], record.reply[device::n]):
+                op = self._feed_byte(stream, tx, rx)
+                if op is not None:
+                    result.append(Operation(record.timestamp, device, *op))
+        return result
+
+    def decode(self, records):
+        """ Decodes a sequence of records.
+
+        :return: an iterator on the decoded operations
+        """
+        for record in records:
+            for op in self.feed(record):
+                yield op
+
+    def _feed_byte(self, stream, tx, rx):
+        if stream.opcode is None:
+            if tx == OpCodes.NOP:
+                return None
+            fmt = _COMMAND_FORMATS[tx]
+            if fmt is None:
+                self.errors += 1
+                return None
+            stream.opcode, stream.format = tx, fmt
+            del stream.request[:], stream.reply[:]
+        else:
+            stream.request.append(tx)
+            stream.reply.append(rx)
+
+        name, reg, size, value_def = stream.format
+        if len(stream.request) < size:
+            return None
+
+        opcode = stream.opcode
+        stream.opcode = None
+        if not size:
+            return opcode, name, reg, None
+
+        # the value is in the reply for the read commands
+        data = stream.reply if name in ('GET_PARAM', 'GET_STATUS') else stream.request
+        return opcode, name, reg, codec_for(value_def).decode(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(__doc__)
+    )
+    parser.add_argument('log', help='the traffic log')
+    parser.add_argument('-n', '--chain-length', type=int, default=1, help='the number of devices on the bus')
+    parser.add_argument('-r', '--raw', action='store_true', help='dump the raw transfers instead of decoding them')
+    parser.add_argument('--replay', action='store_true', help='replay the log through the emulator')
+    parser.add_argument('--real-bus', action='store_true',
+                        help='replay through the active backend instead, i.e. on the real hardware on a RasPi')
+    parser.add_argument('-s', '--speed', type=float, default=0,
+                        help='replay speed with respect to the original one (default: as fast as possible)')
+    args = parser.parse_args()
+
+    start_time, records = read_records(args.log)
+    print('recording started at %s' % time.ctime(start_time))
+
+    if args.replay:
+        if not args.real_bus:
+            from . import emulator
+            emulator.configure(chain_length=args.chain_length)
+        mismatches = Replayer(records, speed=args.speed, real_bus=args.real_bus).run()
+        for record, reply in mismatches:
+            print('%10.6f %s: expected %s, got %s' % (
+                record.timestamp, METHOD_NAMES[record.method], list(record.reply), list(reply)
+            ))
+        print('%d mismatch(es)' % len(mismatches))
+        sys.exit(1 if mismatches else 0)
+
+    if args.raw:
+        for record in records:
+            print('%10.6f %-8s %3d %s -> %s' % (
+                record.timestamp, METHOD_NAMES[record.method], record.seg_len,
+                ' '.join('%02x' % b for b in record.request), ' '.join('%02x' % b for b in record.reply)
+            ))
+        return
+
+    decoder = TrafficDecoder(args.chain_length)
+    for op in decoder.decode(records):
+        print(op)
+    if decoder.errors:
+        print('%d invalid byte(s)' % decoder.errors)
+
+
+if __name__ == '__main__':
+    main()
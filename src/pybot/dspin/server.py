@@ -0,0 +1,880 @@
+# -*- coding: utf-8 -*-
+
+""" Sharing a dSPIN bus between several processes.
+
+Only one process can own the :py:class:`DSPinSpiDev` and the GPIOs. The
+:py:class:`MotionServer` owns a :py:class:`DSPIN` or :py:class:`DaisyChain` instance,
+and serves it to local clients over a Unix socket::
+
+    $ dspin-server -n 3 -s /tmp/dspin.sock -t 0.05
+
+The clients use a :py:class:`RemoteDSPIN` per device, which has the same API as a
+local :py:class:`DSPIN`::
+
+    client = MotionClient('/tmp/dspin.sock')
+    x = client.dspin(0)
+    x.MAX_SPEED = max_spd_calc(800)
+    x.goto(12800)
+
+The dSPIN requests are encoded by the clients and relayed as is by the server, which
+gathers the requests of the clients addressing different devices of a chain in the same
+frames. Stop requests (i.e. sent by a thread having the URGENT priority, see
+:py:mod:`arbiter`) bypass the batching and are sent immediately. The moves completion
+waits are done by the server, which polls the STATUS registers of the waited devices in
+the frames it sends anyway.
+
+When started with a telemetry period, the server samples the registers (see
+:py:class:`TelemetrySampler`) and pushes the samples to the subscribed clients.
+
+Protocol
+--------
+
+All the messages start with the same header (little endian), followed by the payload:
+
+    ====== ====== ==========================================================
+    offset format content
+    ====== ====== ==========================================================
+    0      B      the operation code
+    1      B      the device position (requests) or the status (replies)
+    2      H      the sequence number, echoed in the reply (0 for pushes)
+    4      H      the length of the payload
+    ====== ====== ==========================================================
+
+The operations are:
+
+    - HELLO: the reply gives the number of devices (`B`) and the comma separated names
+      of the telemetry registers (empty if no telemetry)
+    - XFER, XFER_URGENT: the payload is a dSPIN request, the reply one is the bytes
+      returned by the device
+    - WAIT: the payload is the max wait time (`f`, seconds), the reply one tells if the
+      move is complete (`B`)
+    - STOP: hard stop of all the devices, the payload telling if the bridges are put in
+      HiZ state (`B`)
+    - SUBSCRIBE: subscription (`B` = 1) or unsubscription (`B` = 0) to the telemetry
+    - TELEMETRY (push): the timestamp (`d`) followed by the values (`i`), as stored in
+      the :py:class:`RegisterSnapshot` of the sample
+
+Errors are reported with a status other than OK, the payload containing the message.
+"""
+
+import argparse
+from collections import deque
+import errno
+import os
+import socket
+import struct
+import textwrap
+import threading
+import time
+
+from pybot.core import log
+
+from . import commands, metrics, pkg_log
+from .arbiter import BusLock, Priority, get_thread_priority, set_thread_priority, thread_priority
+from .core import DSPIN, DSPinSpiDev, CommandTimeOut, UnsupportedOperation
+from .defs import Register, Status
+from .snapshot import RegisterSnapshot, as_register
+from .telemetry import TelemetrySampler
+
+__author__ = 'Eric Pascual'
+
+DEFAULT_SOCKET_PATH = '/tmp/dspin.sock'
+
+_HEADER = struct.Struct('<BBHH')
+
+
+class Op(object):
+    """ The operation codes of the protocol. """
+    HELLO = 1
+    XFER = 2
+    XFER_URGENT = 3
+    WAIT = 4
+    STOP = 5
+    SUBSCRIBE = 6
+    TELEMETRY = 7
+
+
+class ReplyStatus(object):
+    OK = 0
+    ERROR = 1
+
+
+class ServerError(Exception):
+    """ Raised by the client when the server reports an error. """
+    pass
+
+
+def _recv_exactly(sock, size):
+    """ Receives a given number of bytes.
+
+    :return: the received bytes, or None if the connection has been closed
+    :rtype: bytearray
+    """
+    buf = bytearray(size)
+    view = memoryview(buf)
+    got = 0
+    while got < size:
+        n = sock.recv_into(view[got:], size - got)
+        if not n:
+            return None
+        got += n
+    return buf
+
+
+def _recv_message(sock):
+    """ Receives a message.
+
+    :return: a tuple (op, device or status, sequence number, payload), or None if the
+    connection has been closed
+    """
+    header = _recv_exactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    op, arg, seq, length = _HEADER.unpack_from(header)
+    payload = _recv_exactly(sock, length) if length else bytearray()
+    if payload is None:
+        return None
+    return op, arg, seq, payload
+
+
+def _pack_message(op, arg, seq, payload=b''):
+    return _HEADER.pack(op, arg, seq, len(payload)) + bytes(payload)
+
+
+class _Connection(object):
+    """ A client connection, on the server side. """
+    def __init__(self, sock):
+        self.sock = sock
+        self._send_lock = threading.Lock()
+        self.closed = False
+
+    def send(self, op, arg, seq, payload=b''):
+        message = _pack_message(op, arg, seq, payload)
+        with self._send_lock:
+            if self.closed:
+                return
+            try:
+                self.sock.sendall(message)
+            except (IOError, OSError):
+                self.closed = True
+
+    def reply_error(self, op, seq, error):
+        self.send(op, ReplyStatus.ERROR, seq, str(error).encode('utf-8'))
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except (IOError, OSError):
+            pass
+        self.sock.close()
+
+
+class MotionServer(object):
+    """ Serves a :py:class:`DSPIN` or :py:class:`DaisyChain` instance to the clients
+    connected to a Unix socket.
+
+    The requests are sent by a single bus thread, which gathers in the same frame the
+    pending requests of the different devices, the requests of a given device being
+    sent in their arrival order.
+    """
+    #: the STATUS polling period of the moves completion waits (seconds)
+    POLL_PERIOD = DSPIN.WAIT_POLL_PERIOD
+    #: how long the listening and bus threads wait for their termination (seconds)
+    JOIN_TIMEOUT = 1.
+
+    def __init__(self, dspin, path=DEFAULT_SOCKET_PATH, telemetry_period=None, logger=None):
+        """
+        :param DSPIN dspin: the device (single or daisy-chain), already initialized
+        :param str path: the path of the Unix socket
+        :param float telemetry_period: the sampling period of the telemetry pushed to the
+        subscribers (seconds). If None, no telemetry is provided.
+        :param logger: optional logger. If None, a new one will be created
+        """
+        self._dspin = dspin
+        self.path = path
+        self.logger = logger or pkg_log.getChild(self.__class__.__name__)
+        self.device_count = dspin.device_count
+        self._status_request = commands.GetParam(Register.STATUS).as_request()
+
+        self._sampler = TelemetrySampler(dspin, period=telemetry_period) if telemetry_period else None
+        self._subscribers = []
+
+        # the pending requests, as (device, request, callback) tuples
+        self._pending = deque()
+        # the pending moves completion waits, as [device, deadline, callback] lists
+        self._waits = []
+        self._next_poll = 0
+        self._cond = threading.Condition()
+
+        self._sock = None
+        self._connections = set()
+        self._threads = []
+        self._running = False
+
+        #: the number of frames sent by the bus thread
+        self.frames = 0
+        #: the number of client requests they contained
+        self.requests = 0
+
+    @property
+    def running(self):
+        return self._running
+
+    def stats(self):
+        """ Returns the batching statistics.
+
+        :return: a dictionary giving the number of frames and requests, and the average
+        number of requests per frame
+        :rtype: dict
+        """
+        return {
+            'frames': self.frames,
+            'requests': self.requests,
+            'requests_per_frame': float(self.requests) / self.frames if self.frames else 0.,
+        }
+
+    def start(self):
+        """ Starts serving in background threads.
+        """
+        if self._running:
+            return
+        self._remove_stale_socket()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        self._sock.listen(8)
+        # for being able to check the termination request
+        self._sock.settimeout(0.5)
+        self._running = True
+
+        self._threads = [
+            threading.Thread(target=target, name=name)
+            for target, name in ((self._run_bus, 'dspin-server-bus'), (self._run_listener, 'dspin-server'))
+        ]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        if self._sampler is not None:
+            self._sampler.subscribe(self._push_telemetry)
+            self._sampler.start()
+        self.logger.info('serving %d device(s) on %s', self.device_count, self.path)
+
+    def stop(self):
+        """ Stops serving, closes the connections and removes the socket.
+        """
+        if not self._running:
+            return
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler.unsubscribe(self._push_telemetry)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(self.JOIN_TIMEOUT)
+        self._threads = []
+        self._sock.close()
+        self._sock = None
+        for conn in list(self._connections):
+            conn.close()
+        self._connections.clear()
+        self._subscribers = []
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self.logger.info('stopped')
+
+    def serve_forever(self):
+        """ Serves until interrupted by a KeyboardInterrupt.
+        """
+        self.start()
+        try:
+            while self._running:
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def _remove_stale_socket(self):
+        """ Removes the socket file left by a server which did not terminate properly.
+
+        :raise: IOError if another server is running
+        """
+        if not os.path.exists(self.path):
+            return
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except (IOError, OSError):
+            os.unlink(self.path)
+        else:
+            raise IOError(errno.EADDRINUSE, 'a server is already running on %s' % self.path)
+        finally:
+            sock.close()
+
+    def _run_listener(self):
+        while self._running:
+            try:
+                sock, _ = self._sock.accept()
+            except socket.timeout:
+                continue
+            except (IOError, OSError) as e:
+                if self._running:
+                    self.logger.error('accept failed (%s)', e)
+                break
+            sock.settimeout(None)
+            conn = _Connection(sock)
+            self._connections.add(conn)
+            thread = threading.Thread(target=self._serve_connection, args=(conn,), name='dspin-server-client')
+            thread.daemon = True
+            thread.start()
+
+    def _serve_connection(self, conn):
+        self.logger.info('client connected')
+        handlers = {
+            Op.HELLO: self._handle_hello,
+            Op.XFER: self._handle_xfer,
+            Op.XFER_URGENT: self._handle_xfer_urgent,
+            Op.WAIT: self._handle_wait,
+            Op.STOP: self._handle_stop,
+            Op.SUBSCRIBE: self._handle_subscribe,
+        }
+        try:
+            while self._running:
+                try:
+                    message = _recv_message(conn.sock)
+                except (IOError, OSError):
+                    break
+                if message is None:
+                    break
+                op, device, seq, payload = message
+                handler = handlers.get(op)
+                try:
+                    if handler is None:
+                        raise ValueError('invalid operation (%d)' % op)
+                    handler(conn, op, device, seq, payload)
+                except Exception as e:
+                    conn.reply_error(op, seq, e)
+        finally:
+            if conn in self._subscribers:
+                self._subscribers = [c for c in self._subscribers if c is not conn]
+            self._connections.discard(conn)
+            conn.close()
+            self.logger.info('client disconnected')
+
+    def _check_device(self, device):
+        if device >= self.device_count:
+            raise ValueError('invalid device (%d)' % device)
+
+    def _handle_hello(self, conn, op, device, seq, payload):
+        registers = ','.join(r.name for r in self._sampler.registers) if self._sampler else ''
+        conn.send(op, ReplyStatus.OK, seq, struct.pack('<B', self.device_count) + registers.encode('ascii'))
+
+    def _handle_xfer(self, conn, op, device, seq, payload):
+        self._check_device(device)
+        if not payload:
+            raise ValueError('empty request')
+
+        def reply(data, error):
+            if error is None:
+                conn.send(op, ReplyStatus.OK, seq, bytearray(data))
+            else:
+                conn.reply_error(op, seq, error)
+
+        with self._cond:
+            self._pending.append((device, payload, reply))
+            self._cond.notify()
+
+    def _handle_xfer_urgent(self, conn, op, device, seq, payload):
+        self._check_device(device)
+        if not payload:
+            raise ValueError('empty request')
+        with thread_priority(Priority.URGENT):
+            reply = self._transfer_one(device, payload)
+        conn.send(op, ReplyStatus.OK, seq, bytearray(reply))
+
+    def _handle_wait(self, conn, op, device, seq, payload):
+        self._check_device(device)
+        max_wait, = struct.unpack('<f', bytes(payload))
+
+        def reply(complete):
+            conn.send(op, ReplyStatus.OK, seq, struct.pack('<B', complete))
+
+        with self._cond:
+            self._waits.append([device, time.time() + max_wait, reply])
+            self._cond.notify()
+
+    def _handle_stop(self, conn, op, device, seq, payload):
+        self._dspin.emergency_stop(hi_z=bool(payload and payload[0]))
+        conn.send(op, ReplyStatus.OK, seq)
+
+    def _handle_subscribe(self, conn, op, device, seq, payload):
+        if self._sampler is None:
+            raise ValueError('telemetry not available')
+        # copy on write, so that the sampling thread can iterate without locking
+        others = [c for c in self._subscribers if c is not conn]
+        self._subscribers = others + [conn] if payload and payload[0] else others
+        conn.send(op, ReplyStatus.OK, seq)
+
+    def _push_telemetry(self, timestamp, snapshot):
+        subscribers = self._subscribers
+        if not subscribers:
+            return
+        values = snapshot.values
+        payload = struct.pack('<d%di' % len(values), timestamp, *values)
+        for conn in subscribers:
+            conn.send(Op.TELEMETRY, ReplyStatus.OK, 0, payload)
+
+    def _transfer_one(self, device, request):
+        """ Sends a request to a single device, outside of the batching.
+        """
+        if self.device_count == 1:
+            return self._dspin._xfer(list(request))
+        requests = [None] * self.device_count
+        requests[device] = request
+        return self._dspin._xfer(requests)[device]
+
+    def _transfer(self, requests):
+        """ Sends a frame made of one request per device, None for the idle ones.
+
+        :return: the replies, None for the idle devices
+        :rtype: list
+        """
+        if self.device_count == 1:
+            return [self._dspin._xfer(list(requests[0]))]
+        return self._dspin._xfer(requests)
+
+    def _next_batch(self):
+        """ Waits for something to send and builds the next frame.
+
+        :return: a tuple (requests, callbacks, polled devices), or None if the server is stopped
+        """
+        count = self.device_count
+        with self._cond:
+            while self._running:
+                if self._pending:
+                    break
+                if self._waits:
+                    delay = self._next_poll - time.time()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                else:
+                    self._cond.wait()
+            if not self._running:
+                return None
+
+            requests, callbacks = [None] * count, [None] * count
+            deferred = deque()
+            for item in self._pending:
+                device, request, callback = item
+                if requests[device] is None:
+                    requests[device], callbacks[device] = request, callback
+                else:
+                    deferred.append(item)
+            self._pending = deferred
+
+            # the STATUS of the waited devices is read in the free slots
+            polled = []
+            if self._waits:
+                now = time.time()
+                if now >= self._next_poll:
+                    self._next_poll = now + self.POLL_PERIOD
+                    for device in set(w[0] for w in self._waits):
+                        if requests[device] is None:
+                            requests[device] = self._status_request
+                            polled.append(device)
+            return requests, callbacks, polled
+
+    def _run_bus(self):
+        set_thread_priority(Priority.COMMAND)
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            requests, callbacks, polled = batch
+            try:
+                replies = self._transfer(requests)
+            except (IOError, OSError) as e:
+                self.logger.error('transfer failed (%s)', e)
+                for callback in callbacks:
+                    if callback is not None:
+                        callback(None, e)
+                continue
+            self.frames += 1
+            for callback, reply in zip(callbacks, replies):
+                if callback is not None:
+                    self.requests += 1
+                    callback(reply, None)
+            if self._waits:
+                self._check_waits(polled, replies)
+
+    def _check_waits(self, polled, replies):
+        idle = set(
+            d for d in polled
+            if self._dspin.parse_register_reply(Register.STATUS, replies[d][1:]) & Status.BUSY
+        )
+        now = time.time()
+        complete, expired = [], []
+        with self._cond:
+            waits = []
+            for wait in self._waits:
+                device, deadline, callback = wait
+                if device in idle:
+                    complete.append(callback)
+                elif now >= deadline:
+                    expired.append(callback)
+                else:
+                    waits.append(wait)
+            self._waits = waits
+        for callback in complete:
+            callback(True)
+        for callback in expired:
+            callback(False)
+
+
+class _PendingReply(object):
+    __slots__ = ('event', 'status', 'payload')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.status = self.payload = None
+
+
+class MotionClient(object):
+    """ A connection to a :py:class:`MotionServer`.
+
+    It can be shared by several threads, the replies being dispatched to the requesters
+    by a receiving thread, which also invokes the telemetry subscribers.
+    """
+    #: the max wait time of the replies (seconds)
+    REPLY_TIMEOUT = 5.
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, logger=None):
+        """
+        :param str path: the path of the server socket
+        :param logger: optional logger. If None, a new one will be created
+        """
+        self.logger = logger or pkg_log.getChild(self.__class__.__name__)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._seq = 0
+        self._subscribers = []
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run_receiver, name='dspin-client')
+        self._thread.daemon = True
+        self._thread.start()
+
+        payload = self.request(Op.HELLO)
+        #: the number of devices of the server
+        self.device_count = payload[0]
+        names = bytes(payload[1:]).decode('ascii')
+        #: the registers included in the telemetry samples
+        self.telemetry_registers = tuple(as_register(n) for n in names.split(',')) if names else ()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except (IOError, OSError):
+            pass
+        self._sock.close()
+        self._thread.join(1.)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def request(self, op, device=0, payload=b'', timeout=REPLY_TIMEOUT):
+        """ Sends a request and waits for its reply.
+
+        :param int op: the operation code (see :py:class:`Op`)
+        :param int device: the device position
+        :param payload: the payload of the request
+        :param float timeout: the max wait time of the reply (seconds)
+        :return: the payload of the reply
+        :rtype: bytearray
+        :raise: ServerError if the server reported an error, IOError if the connection is lost
+        """
+        pending = _PendingReply()
+        with self._send_lock:
+            if self._closed:
+                raise IOError(errno.EPIPE, 'connection closed')
+            self._seq = self._seq % 0xffff + 1
+            seq = self._seq
+            self._pending[seq] = pending
+            try:
+                self._sock.sendall(_pack_message(op, device, seq, payload))
+            except (IOError, OSError):
+                del self._pending[seq]
+                raise
+        if not pending.event.wait(timeout):
+            self._pending.pop(seq, None)
+            raise IOError(errno.ETIMEDOUT, 'no reply from the server')
+        if pending.status is None:
+            raise IOError(errno.EPIPE, 'connection closed')
+        if pending.status != ReplyStatus.OK:
+            raise ServerError(bytes(pending.payload).decode('utf-8'))
+        return pending.payload
+
+    def _run_receiver(self):
+        try:
+            while True:
+                try:
+                    message = _recv_message(self._sock)
+                except (IOError, OSError):
+                    break
+                if message is None:
+                    break
+                op, status, seq, payload = message
+                if op == Op.TELEMETRY:
+                    self._dispatch_telemetry(payload)
+                    continue
+                pending = self._pending.pop(seq, None)
+                if pending is not None:
+                    pending.status, pending.payload = status, payload
+                    pending.event.set()
+        finally:
+            self._closed = True
+            # wake up the requesters still waiting
+            for pending in list(self._pending.values()):
+                pending.event.set()
+            self._pending.clear()
+
+    def _dispatch_telemetry(self, payload):
+        count = len(self.telemetry_registers) * self.device_count
+        values = struct.unpack_from('<d%di' % count, bytes(payload))
+        snapshot = RegisterSnapshot(self.telemetry_registers, self.device_count, values[1:])
+        for callback in self._subscribers:
+            try:
+                callback(values[0], snapshot)
+            except Exception as e:
+                self.logger.exception('subscriber %s failed (%s)', callback, e)
+
+    def xfer(self, device, request, urgent=False):
+        """ Sends a dSPIN request to a device.
+
+        :param int device: the device position
+        :param request: the request bytes
+        :param bool urgent: send it immediately, without waiting for the next frame
+        :return: the reply bytes
+        :rtype: bytearray
+        """
+        return self.request(Op.XFER_URGENT if urgent else Op.XFER, device, bytearray(request))
+
+    def wait(self, device, max_wait):
+        """ Waits for the end of the move of a device.
+
+        :param int device: the device position
+        :param float max_wait: the max wait time (seconds)
+        :return: True if the move is complete, False if still in progress after `max_wait`
+        :rtype: bool
+        """
+        reply = self.request(Op.WAIT, device, struct.pack('<f', max_wait), timeout=max_wait + self.REPLY_TIMEOUT)
+        return bool(reply[0])
+
+    def emergency_stop(self, hi_z=False):
+        """ Stops all the devices of the server immediately (see :py:meth:`DSPIN.emergency_stop`).
+        """
+        self.request(Op.STOP, 0, struct.pack('<B', hi_z))
+
+    def subscribe(self, callback):
+        """ Registers a callback invoked for each telemetry sample pushed by the server.
+
+        The callbacks are invoked in the receiving thread, and must thus return quickly.
+
+        :param callable callback: a callable accepting the timestamp and the snapshot
+        :raise: ServerError if the server does not provide telemetry
+        """
+        if not self._subscribers:
+            self.request(Op.SUBSCRIBE, 0, struct.pack('<B', 1))
+        self._subscribers = self._subscribers + [callback]
+
+    def unsubscribe(self, callback):
+        self._subscribers = [cb for cb in self._subscribers if cb != callback]
+        if not self._subscribers:
+            self.request(Op.SUBSCRIBE, 0, struct.pack('<B', 0))
+
+    def dspin(self, device=0, **kwargs):
+        """ Returns the proxy of a device of the server.
+
+        :param int device: the device position
+        :param kwargs: the other arguments of :py:class:`RemoteDSPIN`
+        :rtype: RemoteDSPIN
+        """
+        return RemoteDSPIN(self, device, **kwargs)
+
+
+class _RemoteSpi(object):
+    """ The SPI device of a :py:class:`RemoteDSPIN`, which relays the transfers to the server.
+    """
+    BUFFER_SIZE = 256
+
+    def __init__(self, client, device):
+        self._client = client
+        self._device = device
+        self.tx_buffer = bytearray(self.BUFFER_SIZE)
+        self.rx_buffer = bytearray(self.BUFFER_SIZE)
+        #: protects the transfer buffers
+        self.lock = BusLock()
+
+    def open(self):
+        pass
+
+    def xfer(self, values=None):
+        urgent = get_thread_priority() == Priority.URGENT
+        return list(self._client.xfer(self._device, values, urgent))
+
+    xfer2 = xfer
+
+    def xfer_buffer(self, length, seg_len=1):
+        with self.lock:
+            self.rx_buffer[:length] = self.xfer(self.tx_buffer[:length])
+            return self.rx_buffer
+
+
+class RemoteDSPIN(DSPIN):
+    """ A device served by a :py:class:`MotionServer`, with the same API as a local one.
+
+    The devices being reset by the server, and the standby signal being shared, the
+    initialization and power management methods are not available. The moves completion
+    waits are done by the server.
+
+    .. note::
+
+        The registers shadow must be used only if this proxy is the only one writing
+        the registers of the device.
+    """
+    def __init__(self, client, device=0, logger=None, shadow=False):
+        """
+        :param MotionClient client: the connection to the server
+        :param int device: the device position
+        :param logger: optional logger. If None, a new one will be created
+        :param bool shadow: if True, keep a shadow of the registers for skipping redundant writes
+        """
+        if device >= client.device_count:
+            raise ValueError('invalid device (%d)' % device)
+        self._client = client
+        self.device = device
+        super(RemoteDSPIN, self).__init__(_RemoteSpi(client, device), None, None, logger=logger, shadow=shadow)
+
+    def power_on_reset(self):
+        raise UnsupportedOperation('devices are reset by the server')
+
+    def initialize(self):
+        """ Does nothing, since the devices are initialized by the server.
+
+        :return: True
+        """
+        return True
+
+    def standby(self):
+        raise UnsupportedOperation('the standby signal is owned by the server')
+
+    def awake(self):
+        raise UnsupportedOperation('the standby signal is owned by the server')
+
+    def shutdown(self):
+        """ Stops the motor and puts the bridge in HiZ state. The device is not put in standby.
+        """
+        self.clear_status()
+        self.hard_hi_Z()
+
+    def emergency_stop(self, hi_z=False, triggered_at=None):
+        """ Stops this device immediately, bypassing the batching of the server as well as
+        the transactions in progress.
+
+        :param bool hi_z: if True, the bridges are put in HiZ state
+        :param float triggered_at: the time of the event triggering the stop, as given by
+        :py:func:`metrics.clock`. If None, the latency is measured from the call.
+        :return: the delay between the trigger and the acknowledgement of the server (seconds)
+        :rtype: float
+        """
+        start = metrics.clock() if triggered_at is None else triggered_at
+        request = commands.HARD_HIZ_REQUEST if hi_z else commands.HARD_STOP_REQUEST
+        self._client.xfer(self.device, request, urgent=True)
+        latency = self.last_stop_latency = metrics.clock() - start
+        return latency
+
+    def is_moving(self):
+        return not self.STATUS & Status.BUSY
+
+    def wait_for_move_complete(self, callback=None, timeout=DSPIN.DEFAULT_MOVE_TIMEOUT, expected_duration=None):
+        """ See :py:meth:`DSPIN.wait_for_move_complete`.
+
+        The wait is done by the server, in slices of :py:attr:`WAIT_CB_PERIOD` seconds when a
+        callback is provided.
+        """
+        self.logger.info('wait for move completion... (%s callback)', 'with' if callback else 'no')
+        started = metrics.clock()
+        now = time.time()
+        time_limit = now + timeout
+
+        if expected_duration is not None:
+            wake_up = min(now + expected_duration - self.PRE_COMPLETION_MARGIN, time_limit)
+            while now < wake_up:
+                if callback and callback(self):
+                    self.logger.debug('callback returned True')
+                    return
+                time.sleep(min(wake_up - now, self.WAIT_CB_PERIOD))
+                now = time.time()
+
+        while True:
+            remaining = time_limit - time.time()
+            if remaining <= 0:
+                self.logger.error('timeout reached (%s seconds)', timeout)
+                if self.metrics is not None:
+                    self.metrics.timeouts.inc()
+                raise CommandTimeOut()
+            if self._client.wait(self.device, min(remaining, self.WAIT_CB_PERIOD) if callback else remaining):
+                break
+            if callback and callback(self):
+                self.logger.debug('callback returned True')
+                return
+
+        if self.metrics is not None:
+            self._record_wait(started, expected_duration)
+        self.logger.info('wait complete')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(__doc__.split('Protocol')[0])
+    )
+    parser.add_argument('-s', '--socket', default=DEFAULT_SOCKET_PATH,
+                        help='path of the Unix socket (default: %s)' % DEFAULT_SOCKET_PATH)
+    parser.add_argument('-n', '--chain-length', type=int, default=1, help='number of daisy-chained devices')
+    parser.add_argument('-t', '--telemetry', type=float, help='telemetry sampling period (seconds)')
+    parser.add_argument('--spi-bus', type=int, default=0, help='SPI bus id (default: 0)')
+    parser.add_argument('--spi-dev', type=int, default=0, help='SPI device id (default: 0)')
+    parser.add_argument('--standby-pin', type=int, default=11, help='GPIO of the standby signal (default: 11)')
+    parser.add_argument('--busyn-pin', type=int, default=13, help='GPIO of the busy signal (default: 13)')
+    parser.add_argument('-d', '--debug', action='store_true', help='activates debug messages')
+    args = parser.parse_args()
+
+    log.getLogger('pybot.dspin').setLevel(log.DEBUG if args.debug else log.INFO)
+
+    spi = DSPinSpiDev(args.spi_bus, args.spi_dev)
+    if args.chain_length > 1:
+        from .daisychain import DaisyChain
+        dspin = DaisyChain(args.chain_length, spi, args.standby_pin, args.busyn_pin, logger=None)
+    else:
+        dspin = DSPIN(spi, args.standby_pin, args.busyn_pin)
+    if not dspin.initialize():
+        raise SystemExit('devices initialization failed')
+
+    server = MotionServer(dspin, args.socket, telemetry_period=args.telemetry)
+    try:
+        server.serve_forever()
+    finally:
+        dspin.shutdown()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+""" Write-through shadow of the dSPIN registers, used for skipping writes which would
+not change anything.
+"""
+
+from .defs import Register
+
+__author__ = 'Eric Pascual'
+
+
+class RegisterShadow(object):
+    """ Keeps track of the last known content of the writable registers, for one or
+    several devices.
+
+    Only the registers which are never modified by the chip itself are shadowed. The
+    position related ones (ABS_POS, EL_POS, MARK) are thus excluded.
+
+    .. note::
+
+        The shadow trusts the writes. If a write can have been rejected by the chip (e.g.
+        a configuration register written while the bridges are active), the corresponding
+        entry must be invalidated.
+    """
+    #: the registers which content is changed by the chip while operating
+    VOLATILE = frozenset((Register.ABS_POS, Register.EL_POS, Register.MARK))
+
+    def __init__(self, device_count=1):
+        """
+        :param int device_count: the number of devices tracked
+        """
+        self._values = [{} for _ in range(device_count)]
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    @classmethod
+    def is_shadowed(cls, reg):
+        """ Tells if a register can be shadowed.
+        """
+        return not reg.read_only and reg not in cls.VOLATILE
+
+    @staticmethod
+    def _normalized(reg, value):
+        return value & reg.mask
+
+    def is_current(self, device, reg, value):
+        """ Tells if a register of a given device is known to contain a value already,
+        and updates the hit/miss counters accordingly.
+
+        :param int device: the device position
+        :param RegisterDefinition reg: the register
+        :param int value: the value to be written
+        :rtype: bool
+        """
+        if self._values[device].get(reg) == self._normalized(reg, value):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def update(self, device, reg, value):
+        """ Records the content of a register for a given device.
+
+        The request is ignored for registers which cannot be shadowed.
+        """
+        if self.is_shadowed(reg):
+            self._values[device][reg] = self._normalized(reg, value)
+
+    def get(self, device, reg):
+        """ Returns the shadowed value of a register, None if not known.
+        """
+        return self._values[device].get(reg)
+
+    def invalidate(self, devices=None):
+        """ Forgets the register values of some or all of the devices.
+
+        :param iterable devices: the positions of the devices (default: all)
+        """
+        for d in (range(len(self._values)) if devices is None else devices):
+            self._values[d].clear()
+
+    def reset_counters(self):
+        self.hits = self.misses = 0
+
+    def stats(self):
+        """ Returns the usage statistics.
+
+        :return: a dictionary containing the hits and misses counts, and the hit ratio
+        :rtype: dict
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / total if total else 0.
+        }
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+""" Compact storage of the content of a set of registers, read at once on one or
+several devices.
+"""
+
+from array import array
+
+from .defs import Register, RegisterDefinition
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'Eric Pascual'
+
+#: the definitions of all the registers, in the same order as `Register.ALL`
+ALL_REGISTERS = tuple(getattr(Register, n) for n in Register.ALL)
+
+
+def as_register(reg):
+    """ Returns the definition of a register given by its name or its definition.
+
+    :param reg: the register name or definition
+    :rtype: RegisterDefinition
+    :raise: ValueError if not a valid register name
+    """
+    if isinstance(reg, RegisterDefinition):
+        return reg
+    try:
+        return getattr(Register, reg)
+    except (AttributeError, TypeError):
+        raise ValueError('invalid register (%s)' % reg)
+
+
+class RegisterSnapshot(object):
+    """ The values of a set of registers for a set of devices.
+
+    Values are stored in a flat array, row-major by device. They can be accessed by
+    device and register, using either register definitions or names::
+
+        snap[2, 'ACC']          # ACC register of device 2
+        snap[Register.ACC]      # ACC register of all the devices, as a list
+    """
+    def __init__(self, registers, device_count=1, values=None):
+        """
+        :param iterable registers: the registers included in the snapshot
+        :param int device_count: the number of devices
+        :param iterable values: the values, row-major by device (default: all 0)
+        """
+        self.registers = tuple(as_register(r) for r in registers)
+        self.device_count = device_count
+        self._index = dict((r, i) for i, r in enumerate(self.registers))
+        self._index.update((r.name, i) for i, r in enumerate(self.registers))
+        count = len(self.registers) * device_count
+        self.values = array('i', values if values is not None else [0] * count)
+        if len(self.values) != count:
+            raise ValueError('values count mismatch')
+
+    def __len__(self):
+        return self.device_count
+
+    def _column(self, reg):
+        try:
+            return self._index[reg]
+        except KeyError:
+            raise KeyError('register not in snapshot (%s)' % (getattr(reg, 'name', reg),))
+
+    def __getitem__(self, key):
+        # beware that register definitions are tuples too
+        if isinstance(key, tuple) and not isinstance(key, RegisterDefinition):
+            device, reg = key
+            return self.values[device * len(self.registers) + self._column(reg)]
+        column = self._column(key)
+        return list(self.values[column::len(self.registers)])
+
+    def __setitem__(self, key, value):
+        device, reg = key
+        self.values[device * len(self.registers) + self._column(reg)] = value
+
+    def device(self, device):
+        """ Returns the register values of a device.
+
+        :param int device: the device position
+        :return: a list of tuples (register name, value)
+        :rtype: list
+        """
+        start = device * len(self.registers)
+        return list(zip((r.name for r in self.registers), self.values[start:start + len(self.registers)]))
+
+    def as_numpy(self):
+        """ Returns the snapshot as a NumPy structured array, with one record per device
+        and one field per register.
+
+        :rtype: numpy.ndarray
+        :raise: RuntimeError if NumPy is not available
+        """
+        if numpy is None:
+            raise RuntimeError('NumPy not available')
+        dtype = numpy.dtype([(r.name, numpy.int32) for r in self.registers])
+        return numpy.frombuffer(self.values, dtype=numpy.int32).copy().view(dtype)
+
+    def __repr__(self):
+        return '%s(%d devices, %s)' % (
+            self.__class__.__name__, self.device_count, ', '.join(r.name for r in self.registers)
+        )
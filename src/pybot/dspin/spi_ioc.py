@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+""" Low level SPI transfer engine, based on the ``SPI_IOC_MESSAGE`` ioctl of the
+Linux spidev driver.
+
+The spidev Python binding offers no way to toggle the CS line between the bytes of
+a transfer, which forces :py:class:`DSPinSpiDev` to issue one system call per byte.
+The kernel API does allow it however: a message is an array of ``spi_ioc_transfer``
+segments, and setting the ``cs_change`` field of a segment releases CS after it. A
+whole dSPIN request can thus be sent with a single ioctl, CS still being toggled for
+each byte (or each chain column in daisy-chain configuration).
+"""
+
+import ctypes
+import fcntl
+import struct
+
+__author__ = 'Eric Pascual'
+
+#: the spidev ioctls magic number
+SPI_IOC_MAGIC = ord('k')
+
+#: layout of the kernel ``struct spi_ioc_transfer`` (see linux/spi/spidev.h)
+#: tx_buf, rx_buf, len, speed_hz, delay_usecs, bits_per_word, cs_change, tx_nbits, rx_nbits, word_delay_usecs, pad
+SPI_IOC_TRANSFER = struct.Struct('=QQIIHBBBBBB')
+
+#: the maximum number of segments a single message can contain (SPI_MSGSIZE must fit in 14 bits)
+MAX_SEGMENTS = ((1 << 14) - 1) // SPI_IOC_TRANSFER.size
+
+#: the default value of the spidev driver ``bufsiz`` module parameter
+DEFAULT_MAX_MESSAGE_SIZE = 4096
+
+_IOC_WRITE = 1
+_IOC_NRSHIFT = 0
+_IOC_TYPESHIFT = 8
+_IOC_SIZESHIFT = 16
+_IOC_DIRSHIFT = 30
+
+
+def SPI_IOC_MESSAGE(n):
+    """ Returns the ioctl request code for a message made of `n` segments.
+
+    This is the Python equivalent of the macro defined in linux/spi/spidev.h.
+
+    :param int n: the number of segments of the message
+    :return: the ioctl request code
+    :rtype: int
+    """
+    size = n * SPI_IOC_TRANSFER.size if n <= MAX_SEGMENTS else 0
+    return (_IOC_WRITE << _IOC_DIRSHIFT) | (size << _IOC_SIZESHIFT) | \
+           (SPI_IOC_MAGIC << _IOC_TYPESHIFT) | (0 << _IOC_NRSHIFT)
+
+
+def buffer_address(buf):
+    """ Returns the memory address of a bytearray content.
+
+    The bytearray cannot be resized as long as the ctypes view created here is alive,
+    which guarantees the address remains valid.
+
+    :param bytearray buf: the buffer
+    :return: a tuple containing the address and the view keeping it pinned
+    """
+    view = (ctypes.c_char * len(buf)).from_buffer(buf)
+    return ctypes.addressof(view), view
+
+
+class IocTransferEngine(object):
+    """ Sends messages with CS toggled between fixed size segments, using a single
+    ``SPI_IOC_MESSAGE`` ioctl per message.
+
+    The engine works on the transmit and receive buffers owned by the SPI device. The
+    segments descriptors are cached per message geometry, since they only depend on the
+    buffers addresses, the message length and the segment size.
+    """
+    def __init__(self, fd, tx_buf, rx_buf, delay_usecs=0, max_message_size=DEFAULT_MAX_MESSAGE_SIZE):
+        """
+        :param int fd: the file descriptor of the spidev device
+        :param bytearray tx_buf: the transmit buffer
+        :param bytearray rx_buf: the receive buffer (same size as tx_buf)
+        :param int delay_usecs: optional delay after each segment, before CS is released
+        :param int max_message_size: the maximum number of bytes accepted by the driver in a message
+        """
+        self._fd = fd
+        self._max_message_size = max_message_size
+        self._delay_usecs = delay_usecs
+        self._tx_addr, self._tx_pin = buffer_address(tx_buf)
+        self._rx_addr, self._rx_pin = buffer_address(rx_buf)
+        self._descriptors = {}
+
+    def release(self):
+        """ Unpins the buffers, so that they can be reallocated.
+        """
+        self._tx_pin = self._rx_pin = None
+        self._descriptors.clear()
+
+    def _build_descriptors(self, start, length, seg_len):
+        seg_count = (length + seg_len - 1) // seg_len
+        desc = bytearray(seg_count * SPI_IOC_TRANSFER.size)
+        for i in range(seg_count):
+            offset = start + i * seg_len
+            # cs_change has opposite meanings for inner and last segments: on the inner
+            # ones it releases CS after the segment, while on the last one it would keep
+            # it asserted up to the next message
+            SPI_IOC_TRANSFER.pack_into(
+                desc, i * SPI_IOC_TRANSFER.size,
+                self._tx_addr + offset, self._rx_addr + offset,
+                min(seg_len, start + length - offset), 0, self._delay_usecs, 0,
+                1 if i < seg_count - 1 else 0,
+                0, 0, 0, 0
+            )
+        return desc, SPI_IOC_MESSAGE(seg_count)
+
+    def transfer(self, length, seg_len):
+        """ Transfers the first `length` bytes of the transmit buffer, CS being
+        toggled every `seg_len` bytes. Replies are stored in the receive buffer.
+
+        Messages exceeding the kernel limit are split into several ioctls.
+
+        :param int length: the number of bytes to transfer
+        :param int seg_len: the segment size
+        :return: the number of system calls issued
+        :rtype: int
+        """
+        chunk = max(1, min(MAX_SEGMENTS, self._max_message_size // seg_len)) * seg_len
+        calls = 0
+        for start in range(0, length, chunk):
+            key = (start, min(chunk, length - start), seg_len)
+            try:
+                desc, request = self._descriptors[key]
+            except KeyError:
+                desc, request = self._descriptors[key] = self._build_descriptors(*key)
+            fcntl.ioctl(self._fd, request, desc)
+            calls += 1
+        return calls
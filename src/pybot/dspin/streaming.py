@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+
+""" Streaming of waypoints sequences, without idle time between the moves.
+
+A :py:class:`TrajectoryStreamer` holds a queue of waypoints per device, and a dispatcher
+thread which sends the next GoTo command to a device as soon as it has completed the
+previous one::
+
+    streamer = TrajectoryStreamer(dspin)
+    streamer.start()
+    for position in path:
+        streamer.enqueue(position)
+    streamer.enqueue(home, max_speed=500, acc=1000)
+    streamer.wait_done()
+
+The requests of each segment, including the SetParam commands changing the speed profile
+when the waypoint overrides it, are encoded when the waypoint is queued, so that the
+dispatcher has only to send them. They are concatenated in a single transaction.
+
+Moves end detection uses the BUSYN signal for single devices, and the STATUS register of
+all the devices (read in one frame) for daisy-chains. In both cases, the expected end of
+the running segments, given by the motion model, is used for sleeping until shortly
+before.
+
+.. note::
+
+    The streamer keeps track of the profile registers values it writes, for skipping
+    redundant changes. They must thus not be modified by other means while streaming.
+"""
+
+from collections import deque, namedtuple
+import threading
+import time
+
+from . import GPIO, commands, pkg_log
+from .daisychain import DaisyChain
+from .defs import Register, Status, max_spd_calc, acc_calc, dec_calc
+from .motion import PROFILE_REGISTERS, ProfileParameters, goto_distance, move_duration
+
+__author__ = 'Eric Pascual'
+
+
+class Waypoint(namedtuple('Waypoint', 'position max_speed acc dec')):
+    """ A target position, with optional overrides of the speed profile of the segment
+    leading to it (in steps/s and steps/s^2). Overrides remain active for the next segments.
+    """
+    __slots__ = ()
+
+    def __new__(cls, position, max_speed=None, acc=None, dec=None):
+        return super(Waypoint, cls).__new__(cls, position, max_speed, acc, dec)
+
+
+class _Segment(object):
+    """ A queued segment, with its pre-encoded request.
+    """
+    __slots__ = ('waypoint', 'request', 'duration', 'registers')
+
+    def __init__(self, waypoint, request, duration, registers):
+        self.waypoint = waypoint
+        self.request = request
+        self.duration = duration
+        #: the profile registers values written by the segment
+        self.registers = registers
+
+
+class TrajectoryStreamer(object):
+    """ Streams waypoints to the devices of a :py:class:`DSPIN` or a :py:class:`DaisyChain`.
+    """
+    #: the bounds of the STATUS polling period, used for daisy-chains (seconds)
+    MIN_POLL_PERIOD = 0.001
+    MAX_POLL_PERIOD = 0.05
+    #: how long before the expected end of a segment the busy watch starts (seconds)
+    PRE_COMPLETION_MARGIN = 0.005
+    #: max duration of the BUSYN edge waits, so that new waypoints are not left pending
+    EDGE_WAIT_PERIOD = 0.05
+
+    def __init__(self, dspin, depth=256, logger=None):
+        """
+        :param DSPIN dspin: the device, or the daisy-chain
+        :param int depth: the maximum number of waypoints queued per device
+        :param logger: optional logger. If None, a new one will be created
+        """
+        self._dspin = dspin
+        self._chained = isinstance(dspin, DaisyChain)
+        self.device_count = dspin.device_count
+        self.depth = depth
+        self.logger = logger or pkg_log.getChild(self.__class__.__name__)
+
+        n = self.device_count
+        self._queues = [deque() for _ in range(n)]
+        self._changed = threading.Condition()
+        self._thread = None
+        self._stop = False
+
+        # the state of the devices at the end of the queued segments, for encoding the next one
+        self._planned_position = [None] * n
+        self._planned_registers = [{} for _ in range(n)]
+
+        # dispatcher state
+        self._running = [None] * n          # the segment being executed
+        self._expected_end = [None] * n
+        self._last_busy = [None] * n        # last time the device was seen busy
+        self._starved = [False] * n
+
+        self.reset_stats()
+
+    # statistics
+
+    def reset_stats(self):
+        #: the number of dispatched segments
+        self.segments = 0
+        #: the number of times a device completed a segment before the next waypoint was queued
+        self.underruns = 0
+        self._gaps_count = 0
+        self._gaps_sum = 0.
+        self._gaps_max = 0.
+        self._gaps_min = None
+        self._last_gap = None
+
+    def queue_depth(self, device=None):
+        """ Returns the number of waypoints queued for a device, or for all of them if
+        device is not specified.
+        """
+        with self._changed:
+            if device is None:
+                return [len(q) for q in self._queues]
+            return len(self._queues[device])
+
+    def stats(self):
+        """ Returns the streaming statistics.
+
+        The inter-segment gap is the time between the last observation of the device
+        being busy and the sending of the next segment. It is thus an upper bound of the
+        idle time of the motor.
+
+        :rtype: dict
+        """
+        return {
+            'segments': self.segments,
+            'underruns': self.underruns,
+            'queue_depth': self.queue_depth(),
+            'gap_last': self._last_gap,
+            'gap_min': self._gaps_min,
+            'gap_max': self._gaps_max if self._gaps_count else None,
+            'gap_avg': self._gaps_sum / self._gaps_count if self._gaps_count else None,
+        }
+
+    # control
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """ Starts the dispatcher thread, after having read the current position and profile
+        of the devices.
+        """
+        if self.running:
+            return
+
+        snapshot = self._dspin.read_registers((Register.ABS_POS,) + PROFILE_REGISTERS)
+        with self._changed:
+            for d in range(self.device_count):
+                if not self._queues[d]:
+                    self._planned_position[d] = snapshot[d, Register.ABS_POS]
+                    self._planned_registers[d] = dict((r, snapshot[d, r]) for r in PROFILE_REGISTERS)
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, name='dspin-streamer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """ Stops the dispatcher. The queued waypoints are kept, and the running moves are
+        not interrupted.
+        """
+        with self._changed:
+            if self._thread is None:
+                return
+            self._stop = True
+            self._changed.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def clear(self, device=None):
+        """ Discards the queued waypoints of a device, or of all of them.
+        """
+        with self._changed:
+            for d in (range(self.device_count) if device is None else (device,)):
+                self._queues[d].clear()
+                running = self._running[d]
+                if running is not None:
+                    self._planned_position[d] = running.waypoint.position
+            self._changed.notify_all()
+
+    # waypoints queuing
+
+    def _encode(self, device, waypoint):
+        """ Builds the segment leading to a waypoint, given the state planned at the end
+        of the previous one.
+        """
+        registers = dict(self._planned_registers[device])
+        request = []
+        for reg, value in (
+                (Register.MAX_SPEED, max_spd_calc(waypoint.max_speed) if waypoint.max_speed is not None else None),
+                (Register.ACC, acc_calc(waypoint.acc) if waypoint.acc is not None else None),
+                (Register.DEC, dec_calc(waypoint.dec) if waypoint.dec is not None else None),
+        ):
+            if value is not None and registers.get(reg) != value:
+                request.extend(commands.SetParam(reg, value).as_request())
+                registers[reg] = value
+        request.extend(commands.GoTo(waypoint.position).as_request())
+
+        duration = None
+        position = self._planned_position[device]
+        if position is not None and all(r in registers for r in PROFILE_REGISTERS):
+            params = ProfileParameters.from_registers(*(registers[r] for r in PROFILE_REGISTERS))
+            duration = move_duration(goto_distance(position, waypoint.position)[1], params)
+
+        return _Segment(waypoint, request, duration, registers)
+
+    def enqueue(self, position, max_speed=None, acc=None, dec=None, device=0, timeout=None):
+        """ Queues a waypoint for a device.
+
+        :param int position: the target position
+        :param float max_speed: the max speed override (steps/s)
+        :param float acc: the acceleration override (steps/s^2)
+        :param float dec: the deceleration override (steps/s^2)
+        :param int device: the device position in the chain
+        :param float timeout: the max time to wait for room in the queue (default: no limit)
+        :raise: RuntimeError if the queue is still full at the end of the timeout
+        """
+        waypoint = Waypoint(position, max_speed, acc, dec)
+        time_limit = time.time() + timeout if timeout is not None else None
+        with self._changed:
+            queue = self._queues[device]
+            while len(queue) >= self.depth:
+                remaining = time_limit - time.time() if time_limit is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise RuntimeError('waypoints queue full (device=%d)' % device)
+                self._changed.wait(remaining)
+
+            segment = self._encode(device, waypoint)
+            queue.append(segment)
+            self._planned_position[device] = position
+            self._planned_registers[device] = segment.registers
+            self._changed.notify_all()
+
+    def enqueue_many(self, waypoints, device=0):
+        """ Queues a sequence of waypoints, given as positions or :py:class:`Waypoint` instances.
+        """
+        for waypoint in waypoints:
+            if isinstance(waypoint, Waypoint):
+                self.enqueue(*waypoint, device=device)
+            else:
+                self.enqueue(waypoint, device=device)
+
+    def wait_done(self, timeout=None):
+        """ Waits until all the queued waypoints have been reached.
+
+        :param float timeout: the max wait time in seconds (default: no limit)
+        :return: True if done, False if timeout
+        :rtype: bool
+        """
+        time_limit = time.time() + timeout if timeout is not None else None
+        with self._changed:
+            while any(self._queues) or any(s is not None for s in self._running):
+                remaining = time_limit - time.time() if time_limit is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+            return True
+
+    # dispatching
+
+    def _busy_devices(self):
+        """ Returns the busy state of each device.
+        """
+        if self._chained:
+            snapshot = self._dspin.read_registers((Register.STATUS,))
+            # BUSY flag is active low
+            return [not s & Status.BUSY for s in snapshot[Register.STATUS]]
+        return [GPIO.input(self._dspin._busyn_pin) == GPIO.LOW]
+
+    def _send(self, requests):
+        if self._chained:
+            self._dspin._xfer(requests)
+        else:
+            self._dspin._xfer(requests[0])
+
+    def _run(self):
+        fake = hasattr(GPIO, 'FAKE')
+        if fake:
+            self.logger.warn('not on a real RasPi => moves are considered as immediately complete')
+
+        n = self.device_count
+        period = self.MIN_POLL_PERIOD
+        while True:
+            with self._changed:
+                if self._stop:
+                    return
+                if not any(self._queues) and all(s is None for s in self._running):
+                    self._changed.wait()
+                    continue
+
+            try:
+                busy = [False] * n if fake else self._busy_devices()
+            except (IOError, OSError) as e:
+                self.logger.error('busy state reading failed (%s)', e)
+                busy = [True] * n
+            now = time.time()
+
+            requests = [None] * n
+            dispatched = []
+            with self._changed:
+                for d in range(n):
+                    if busy[d]:
+                        self._last_busy[d] = now
+                        continue
+                    if self._running[d] is not None:
+                        # end of segment
+                        self._running[d] = self._expected_end[d] = None
+                        if not self._queues[d]:
+                            self._starved[d] = True
+                    if self._queues[d]:
+                        segment = self._queues[d].popleft()
+                        requests[d] = segment.request
+                        dispatched.append((d, segment))
+                self._changed.notify_all()
+
+            if dispatched:
+                self._send(requests)
+                sent = time.time()
+                self.segments += len(dispatched)
+                shadow = self._dspin.shadow
+                if shadow is not None:
+                    for d, segment in dispatched:
+                        for reg, value in segment.registers.items():
+                            shadow.update(d, reg, value)
+                with self._changed:
+                    for d, segment in dispatched:
+                        self._running[d] = segment
+                        self._expected_end[d] = sent + segment.duration if segment.duration is not None else None
+                        if self._starved[d]:
+                            self.underruns += 1
+                            self._starved[d] = False
+                        elif self._last_busy[d] is not None:
+                            self._record_gap(sent - self._last_busy[d])
+                        self._last_busy[d] = sent
+                period = self.MIN_POLL_PERIOD
+                continue
+
+            if self._wait_next_event(now, period):
+                period = self.MIN_POLL_PERIOD
+            else:
+                period = min(period * 2, self.MAX_POLL_PERIOD)
+
+    def _record_gap(self, gap):
+        self._last_gap = gap
+        self._gaps_count += 1
+        self._gaps_sum += gap
+        self._gaps_max = max(self._gaps_max, gap)
+        self._gaps_min = gap if self._gaps_min is None else min(self._gaps_min, gap)
+
+    def _wait_next_event(self, now, period):
+        """ Waits until the next check of the devices state.
+
+        :return: True if the wait lasted until the vicinity of an expected segment end
+        """
+        with self._changed:
+            running = [e for s, e in zip(self._running, self._expected_end) if s is not None]
+            if not running:
+                # nothing else to do than waiting for new waypoints
+                if not any(self._queues):
+                    self._changed.wait()
+                return False
+
+            # sleep until shortly before the earliest expected end, if all are known
+            near_end = False
+            if None not in running:
+                delay = min(running) - now - self.PRE_COMPLETION_MARGIN
+                if delay > 0:
+                    self._changed.wait(delay)
+                    return True
+                # poll at the fastest rate around the expected end
+                near_end = delay > -2 * self.PRE_COMPLETION_MARGIN
+
+        if self._chained or hasattr(GPIO, 'FAKE'):
+            with self._changed:
+                self._changed.wait(self.MIN_POLL_PERIOD if near_end else period)
+            return near_end
+        else:
+            # the level is checked again once the detection is armed, so that a release
+            # occurring since the state check returns at once
+            if self._dspin._wait_busyn_edge(self.EDGE_WAIT_PERIOD):
+                # the device was busy until now
+                self._last_busy[0] = time.time()
+            return False
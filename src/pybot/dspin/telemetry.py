@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+""" Background sampling of the dSPIN registers.
+
+A :py:class:`TelemetrySampler` periodically reads a set of registers of a
+:py:class:`DSPIN` or :py:class:`DaisyChain` instance in a dedicated thread, and
+stores the samples in a preallocated ring buffer. Consumers can then access the
+most recent values or the recent history without performing any SPI transaction
+themselves::
+
+    sampler = TelemetrySampler(dspin, period=0.01)
+    sampler.start()
+    ...
+    ts, snap = sampler.latest()
+    position = snap[0, 'ABS_POS']
+
+The sampler transactions use the lock of the shared :py:class:`DSPinSpiDev`, and
+are thus safely interleaved with the commands issued by the other threads.
+"""
+
+from array import array
+import threading
+import time
+
+from . import pkg_log
+from .arbiter import Priority, set_thread_priority
+from .defs import Register
+from .snapshot import RegisterSnapshot, as_register
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'Eric Pascual'
+
+#: the registers sampled by default
+DEFAULT_REGISTERS = (Register.ABS_POS, Register.SPEED, Register.STATUS)
+
+
+class TelemetryHistory(object):
+    """ A sequence of samples extracted from the ring buffer of a sampler.
+
+    Values are stored in a flat array, sample by sample, each sample having the
+    same layout as the :py:class:`RegisterSnapshot` values.
+    """
+    def __init__(self, registers, device_count, timestamps, values):
+        """
+        :param tuple registers: the sampled registers
+        :param int device_count: the number of devices
+        :param array timestamps: the timestamps of the samples
+        :param array values: the values of the samples
+        """
+        self.registers = registers
+        self.device_count = device_count
+        self.timestamps = timestamps
+        self.values = values
+        self._row = len(registers) * device_count
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def sample(self, i):
+        """ Returns a sample as a snapshot.
+
+        :param int i: the sample index (negative values count from the end)
+        :rtype: RegisterSnapshot
+        """
+        if i < 0:
+            i += len(self)
+        return RegisterSnapshot(
+            self.registers, self.device_count, self.values[i * self._row:(i + 1) * self._row]
+        )
+
+    def series(self, reg, device=0):
+        """ Returns the values of a register across the samples.
+
+        :param reg: the register, as a definition or a name
+        :param int device: the device position
+        :rtype: list
+        """
+        column = self.registers.index(as_register(reg))
+        return list(self.values[device * len(self.registers) + column::self._row])
+
+    def as_numpy(self):
+        """ Returns the timestamps and the values as NumPy arrays, the values being a structured
+        array of shape (samples, devices) with one field per register.
+
+        :rtype: tuple
+        :raise: RuntimeError if NumPy is not available
+        """
+        if numpy is None:
+            raise RuntimeError('NumPy not available')
+        dtype = numpy.dtype([(r.name, numpy.int32) for r in self.registers])
+        values = numpy.frombuffer(self.values, dtype=numpy.int32).copy().view(dtype)
+        return numpy.frombuffer(self.timestamps, dtype=numpy.float64).copy(), values.reshape(len(self), -1)
+
+
+class TelemetrySampler(object):
+    """ Samples registers at a fixed rate in a background thread.
+
+    The samples are stored in a ring buffer made of preallocated arrays. The sampling
+    thread being the only writer, readers do not use any lock: they check after having
+    copied the data that the samples have not been overwritten meanwhile, and retry or
+    drop them if this happened.
+
+    Subscribers are invoked in the sampling thread, with the timestamp and the snapshot
+    of each sample as arguments. They must thus return quickly.
+    """
+    def __init__(self, dspin, registers=DEFAULT_REGISTERS, period=0.01, capacity=1000, logger=None):
+        """
+        :param DSPIN dspin: the device (single or daisy-chain) to be sampled
+        :param iterable registers: the sampled registers, as definitions or names
+        :param float period: the sampling period (seconds)
+        :param int capacity: the number of samples kept in the ring buffer (at least 2)
+        :param logger: optional logger. If None, a new one will be created
+        """
+        if period <= 0:
+            raise ValueError('invalid period (%s)' % period)
+        if capacity < 2:
+            raise ValueError('invalid capacity (%s)' % capacity)
+
+        self._dspin = dspin
+        self.registers = tuple(as_register(r) for r in registers)
+        self.device_count = dspin.device_count
+        self.period = period
+        self.capacity = capacity
+        self.logger = logger or pkg_log.getChild(self.__class__.__name__)
+
+        self._row = len(self.registers) * self.device_count
+        self._timestamps = array('d', [0.]) * capacity
+        self._values = array('i', [0]) * (capacity * self._row)
+        # the number of samples published so far. The sample n is stored in slot n % capacity
+        self._count = 0
+
+        self._subscribers = []
+        self._thread = None
+        self._stop = threading.Event()
+
+        #: the number of periods which could not be honored because the sampling took too long
+        self.overruns = 0
+        #: the number of failed samplings
+        self.errors = 0
+
+    @property
+    def sample_count(self):
+        """ The total number of samples acquired since the creation. """
+        return self._count
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """ Starts the sampling thread.
+        """
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='dspin-telemetry')
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info('sampling started (period=%s)', self.period)
+
+    def stop(self, timeout=None):
+        """ Stops the sampling thread and waits for its termination.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+        self.logger.info('sampling stopped')
+
+    def subscribe(self, callback):
+        """ Registers a callback invoked for each new sample.
+
+        :param callable callback: a callable accepting the timestamp and the snapshot
+        """
+        # copy on write, so that the sampling thread can iterate without locking
+        self._subscribers = self._subscribers + [callback]
+
+    def unsubscribe(self, callback):
+        self._subscribers = [cb for cb in self._subscribers if cb != callback]
+
+    def _run(self):
+        # sampling must not delay the commands issued by the other threads
+        set_thread_priority(Priority.BACKGROUND)
+        next_time = time.time()
+        while not self._stop.is_set():
+            self.sample()
+            next_time += self.period
+            delay = next_time - time.time()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                self.overruns += 1
+                next_time = time.time()
+
+    def sample(self):
+        """ Acquires a sample and stores it in the ring buffer.
+
+        It is called periodically by the sampling thread, but can be used directly when
+        the sampler is not started.
+
+        :return: the snapshot, or None if the registers could not be read
+        :rtype: RegisterSnapshot
+        """
+        try:
+            snapshot = self._dspin.read_registers(self.registers)
+        except (IOError, OSError) as e:
+            self.errors += 1
+            self.logger.error('sampling failed (%s)', e)
+            return None
+        timestamp = time.time()
+
+        count, row = self._count, self._row
+        slot = count % self.capacity
+        self._timestamps[slot] = timestamp
+        self._values[slot * row:(slot + 1) * row] = snapshot.values
+        # publish the sample
+        self._count = count + 1
+
+        for callback in self._subscribers:
+            try:
+                callback(timestamp, snapshot)
+            except Exception as e:
+                self.logger.exception('subscriber %s failed (%s)', callback, e)
+
+        return snapshot
+
+    def latest(self):
+        """ Returns the most recent sample without blocking.
+
+        :return: a tuple (timestamp, snapshot), or None if nothing has been sampled yet
+        :rtype: tuple
+        """
+        row, capacity = self._row, self.capacity
+        while True:
+            count = self._count
+            if not count:
+                return None
+            slot = (count - 1) % capacity
+            timestamp = self._timestamps[slot]
+            values = self._values[slot * row:(slot + 1) * row]
+            # the slot is being overwritten as soon as the writer starts the sample count - 1 + capacity
+            if self._count < count + capacity - 1:
+                return timestamp, RegisterSnapshot(self.registers, self.device_count, values)
+
+    def latest_value(self, reg, device=0):
+        """ Returns the most recent value of a register without blocking.
+
+        :param reg: the register, as a definition or a name
+        :param int device: the device position
+        :return: the value, or None if nothing has been sampled yet
+        """
+        sample = self.latest()
+        return sample[1][device, as_register(reg)] if sample else None
+
+    def history(self, count=None, seconds=None):
+        """ Returns the most recent samples without blocking.
+
+        :param int count: the maximum number of samples (default: all the buffered ones)
+        :param float seconds: if provided, only the samples of the last `seconds` seconds are returned
+        :rtype: TelemetryHistory
+        """
+        row, capacity = self._row, self.capacity
+        end = self._count
+        start = max(end - min(capacity, count or capacity), 0)
+
+        timestamps, values = array('d'), array('i')
+        for n in range(start, end):
+            slot = n % capacity
+            timestamps.append(self._timestamps[slot])
+            values.extend(self._values[slot * row:(slot + 1) * row])
+
+        # drop the samples which may have been overwritten while copying them
+        lost = self._count - capacity + 1 - start
+        if lost > 0:
+            del timestamps[:lost]
+            del values[:lost * row]
+
+        if seconds is not None and len(timestamps):
+            limit = timestamps[-1] - seconds
+            first = next((i for i, t in enumerate(timestamps) if t >= limit), len(timestamps))
+            del timestamps[:first]
+            del values[:first * row]
+
+        return TelemetryHistory(self.registers, self.device_count, timestamps, values)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+""" Deferred register writes and commands.
+
+Configuring a device implies a bunch of register writes, each one being a separate bus
+transaction. Inside a transaction, they are queued instead, and sent at once when the
+transaction ends::
+
+    with dspin.transaction():
+        dspin.STEP_MODE = StepMode.step_sel(128)
+        dspin.MAX_SPEED = max_spd_calc(800)
+        dspin.ACC = dspin.DEC = 0x4f
+        dspin.goto(12800, wait=False)
+
+The queued requests of a device are sent in a single message, and the ones of the devices
+of a chain are merged in the same frames, the whole being sent in a single burst. Writes
+to a register already written since the last command of the device are collapsed. If the
+registers shadow is used, the writes of values already in the registers are skipped when
+the transaction is flushed.
+
+If the block raises an exception, nothing is sent. Commands issued inside the block are
+queued like the writes, except the stops sent by :py:meth:`DSPIN.emergency_stop` (which
+is used by `hard_stop` and `hard_hi_Z`). Since the reply of register reads and status
+requests is needed, they are executed immediately, and thus do not see the queued writes.
+For the same reason, motion commands must be issued with `wait=False` inside a transaction.
+
+A transaction concerns only the thread which started it.
+"""
+
+from .commands import SetParam
+
+__author__ = 'Eric Pascual'
+
+
+class Transaction(object):
+    """ The requests queued by a transaction, per device.
+
+    The queue of a device contains `[register, value]` items for the writes, and
+    `[None, request]` ones for the commands.
+    """
+    def __init__(self, dspin):
+        """
+        :param DSPIN dspin: the device (single or daisy-chain)
+        """
+        self._dspin = dspin
+        self._queues = [[] for _ in range(dspin.device_count)]
+        #: the number of writes collapsed with a previous one
+        self.collapsed = 0
+
+    def __len__(self):
+        return sum(len(q) for q in self._queues)
+
+    def write(self, device, reg, value):
+        """ Queues a register write, replacing the value of a write queued since the last
+        command of the device, if any.
+        """
+        queue = self._queues[device]
+        for item in reversed(queue):
+            if item[0] is None:
+                break
+            if item[0] is reg:
+                item[1] = value
+                self.collapsed += 1
+                return
+        queue.append([reg, value])
+
+    def command(self, device, request):
+        """ Queues a request.
+        """
+        self._queues[device].append([None, request])
+
+    def clear(self):
+        for queue in self._queues:
+            del queue[:]
+
+    def requests(self):
+        """ Returns the requests to be sent, the writes already known by the registers shadow
+        being skipped.
+
+        :return: a tuple containing the list of requests of each device, and the list of
+        the writes of each device, as (register, value) tuples
+        :rtype: tuple
+        """
+        shadow = self._dspin.shadow
+        requests, writes = [], []
+        for device, queue in enumerate(self._queues):
+            device_requests, device_writes = [], []
+            for reg, value in queue:
+                if reg is None:
+                    device_requests.append(value)
+                elif shadow is None or not shadow.is_current(device, reg, value):
+                    device_requests.append(SetParam(reg, value).as_request())
+                    device_writes.append((reg, value))
+            requests.append(device_requests)
+            writes.append(device_writes)
+        return requests, writes
+
+    def messages(self):
+        """ Returns the message to be sent to each device, made of the concatenation of its
+        requests, and the writes they contain.
+
+        The n-th request of each device is padded with NOPs to the length of the longest
+        n-th request, so that the requests of the different devices are aligned in the
+        chain frames.
+
+        :return: a tuple containing the message of each device (None if nothing to be sent),
+        and the list of the writes of each device
+        :rtype: tuple
+        """
+        requests, writes = self.requests()
+        count = max(len(r) for r in requests)
+        if not count:
+            return [None] * len(requests), writes
+        if len(requests) == 1:
+            return [bytearray().join(bytearray(r) for r in requests[0])], writes
+
+        lengths = [0] * count
+        for device_requests in requests:
+            for i, r in enumerate(device_requests):
+                if len(r) > lengths[i]:
+                    lengths[i] = len(r)
+        messages = []
+        for device_requests in requests:
+            if not device_requests:
+                messages.append(None)
+                continue
+            message = bytearray(sum(lengths))
+            offset = 0
+            for r, length in zip(device_requests, lengths):
+                message[offset:offset + len(r)] = bytearray(r)
+                offset += length
+            messages.append(message)
+        return messages, writes
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+""" NumPy based encoding of the chain frames, for commands sent to many devices at once.
+
+The frames are built as `(n_devices, n_bytes)` uint8 arrays, one row per device,
+using only vectorized operations. Devices not involved in the transaction are
+designated by a boolean mask (instead of the `None` markers used by the list
+based API) and receive NOPs.
+
+NumPy is an optional dependency. Calling the encoders without it being installed
+raises a RuntimeError.
+"""
+
+from .defs import Register, Direction, GoUntilAction
+from .commands import OpCodes, SpeedCommandMixin
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'Eric Pascual'
+
+
+def is_array(value):
+    """ Tells if a parameter is a NumPy array, and must thus be processed by the vectorized path.
+    """
+    return numpy is not None and isinstance(value, numpy.ndarray)
+
+
+def _check_numpy():
+    if numpy is None:
+        raise RuntimeError('NumPy not available')
+
+
+def _as_mask(mask, count):
+    """ Returns the mask as a boolean array, all True if not provided.
+    """
+    if mask is None:
+        return numpy.ones(count, dtype=bool)
+    mask = numpy.asarray(mask, dtype=bool)
+    if mask.shape != (count,):
+        raise ValueError('mask length (%d) does not match parameters one (%d)' % (mask.size, count))
+    return mask
+
+
+def _as_vector(values, count=None):
+    """ Returns a parameter as an int64 vector, scalars being broadcast to `count` items.
+    """
+    values = numpy.asarray(values)
+    if values.ndim == 0 and count is not None:
+        return numpy.full(count, values, dtype=numpy.int64)
+    if values.ndim != 1:
+        raise ValueError('parameters must be scalars or 1-D arrays')
+    return values.astype(numpy.int64)
+
+
+def _check_directions(directions, mask):
+    if not numpy.all((directions[mask] == Direction.FWD) | (directions[mask] == Direction.REV)):
+        raise ValueError('invalid direction(s) (%s)' % directions[mask])
+
+
+def _check_speeds(speeds, mask):
+    speeds = numpy.asarray(speeds)[mask]
+    if not numpy.all((speeds > 0) & (speeds <= SpeedCommandMixin.MAX_VALUE)):
+        raise ValueError('out of bounds speed(s) (%s)' % speeds)
+
+
+def spd_calc(steps_per_sec):
+    """ Vectorized version of :py:func:`defs.spd_calc`.
+
+    :param steps_per_sec: speeds in steps/s
+    :return: the SPEED register values
+    :rtype: numpy.ndarray
+    """
+    _check_numpy()
+    return numpy.minimum(
+        (numpy.abs(numpy.asarray(steps_per_sec, dtype=numpy.float64)) * 67.106).astype(numpy.int64),
+        0x0fffff
+    )
+
+
+def encode_frame(opcodes, values, reg, mask=None):
+    """ Builds the frame of a command made of an opcode followed by a register sized value.
+
+    :param numpy.ndarray opcodes: the opcode of each device
+    :param numpy.ndarray values: the parameter value of each device
+    :param RegisterDefinition reg: the register defining the parameter size and format
+    :param numpy.ndarray mask: the devices involved in the transaction (default: all)
+    :return: the `(n_devices, 1 + reg.nbytes)` frame, MSB first
+    :rtype: numpy.ndarray
+    """
+    _check_numpy()
+    count = len(opcodes)
+    frame = numpy.empty((count, 1 + reg.nbytes), dtype=numpy.uint8)
+    frame[:, 0] = opcodes
+    # negative values are two's complement encoded by the masking, as in Register.value_as_bytes
+    shifts = numpy.arange(8 * (reg.nbytes - 1), -1, -8, dtype=numpy.int64)
+    frame[:, 1:] = (numpy.asarray(values, dtype=numpy.int64)[:, None] & reg.mask) >> shifts & 0xff
+    if mask is not None:
+        frame[~mask] = OpCodes.NOP
+    return frame
+
+
+def set_param_frame(reg, values, mask=None):
+    """ Builds the frame of a SetParam command writing the same register of all the devices.
+
+    :param RegisterDefinition reg: the written register
+    :param values: the register values
+    :param mask: the devices involved in the transaction (default: all)
+    :rtype: numpy.ndarray
+    """
+    _check_numpy()
+    values = _as_vector(values)
+    mask = _as_mask(mask, len(values))
+    return encode_frame(numpy.full(len(values), OpCodes.SET_PARAM | reg.addr, dtype=numpy.int64), values, reg, mask)
+
+
+def goto_frame(positions, mask=None):
+    """ Builds the frame of a GoTo command.
+
+    :param positions: the absolute positions
+    :param mask: the devices involved in the transaction (default: all)
+    :rtype: numpy.ndarray
+    """
+    _check_numpy()
+    positions = _as_vector(positions)
+    mask = _as_mask(mask, len(positions))
+    return encode_frame(numpy.full(len(positions), OpCodes.GOTO, dtype=numpy.int64), positions, Register.ABS_POS, mask)
+
+
+def move_frame(directions, steps, mask=None):
+    """ Builds the frame of a Move command.
+
+    :param directions: the move directions (broadcast if scalar)
+    :param steps: the numbers of steps (their absolute value is used)
+    :param mask: the devices involved in the transaction (default: all)
+    :rtype: numpy.ndarray
+    """
+    _check_numpy()
+    steps = _as_vector(steps)
+    directions = _as_vector(directions, len(steps))
+    mask = _as_mask(mask, len(steps))
+    _check_directions(directions, mask)
+    return encode_frame(OpCodes.MOVE | directions, numpy.abs(steps), Register.ABS_POS, mask)
+
+
+def run_frame(directions, speeds, mask=None):
+    """ Builds the frame of a Run command.
+
+    :param directions: the move directions (broadcast if scalar)
+    :param speeds: the speeds, in steps/s
+    :param mask: the devices involved in the transaction (default: all)
+    :rtype: numpy.ndarray
+    """
+    _check_numpy()
+    speeds = numpy.asarray(speeds, dtype=numpy.float64)
+    directions = _as_vector(directions, len(speeds))
+    mask = _as_mask(mask, len(speeds))
+    _check_directions(directions, mask)
+    _check_speeds(speeds, mask)
+    return encode_frame(OpCodes.RUN | directions, spd_calc(speeds), Register.SPEED, mask)
+
+
+def go_until_frame(actions, directions, speeds, mask=None):
+    """ Builds the frame of a GoUntil command.
+
+    :param actions: the actions performed when the switch closes (broadcast if scalar)
+    :param directions: the move directions (broadcast if scalar)
+    :param speeds: the speeds, in steps/s
+    :param mask: the devices involved in the transaction (default: all)
+    :rtype: numpy.ndarray
+    """
+    _check_numpy()
+    speeds = numpy.asarray(speeds, dtype=numpy.float64)
+    directions = _as_vector(directions, len(speeds))
+    actions = _as_vector(actions, len(speeds))
+    mask = _as_mask(mask, len(speeds))
+    _check_directions(directions, mask)
+    _check_speeds(speeds, mask)
+    if not numpy.all((actions[mask] == GoUntilAction.COPY) | (actions[mask] == GoUntilAction.RESET)):
+        raise ValueError('invalid action(s) (%s)' % actions[mask])
+    return encode_frame(OpCodes.GO_UNTIL | directions | actions, spd_calc(speeds), Register.SPEED, mask)
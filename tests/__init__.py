@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+""" Tests of the dSPIN package.
+
+They run against the behavioral emulator of the hardware (see :py:mod:`pybot.dspin.emulator`),
+selected here before any test module imports the package, so that no motor is ever driven,
+even when they are run on a RasPi::
+
+    python -m unittest discover -t . -s tests
+"""
+
+import os
+
+os.environ['PYBOT_DSPIN_EMULATOR'] = '1'
+
+__author__ = 'Eric Pascual'
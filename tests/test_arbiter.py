@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+from pybot.dspin.arbiter import BusLock, Priority, get_thread_priority, set_thread_priority, thread_priority
+
+__author__ = 'Eric Pascual'
+
+
+class BusLockTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lock = BusLock()
+        self.order = []
+
+    def _waiter(self, name, priority):
+        def run():
+            set_thread_priority(priority)
+            with self.lock:
+                self.order.append(name)
+
+        count = self.lock.waiting()
+        thread = threading.Thread(target=run)
+        thread.start()
+        # wait for the thread to be queued, for its arrival order to be known
+        while self.lock.waiting() == count:
+            time.sleep(0.001)
+        return thread
+
+    def test_priority_handoff(self):
+        self.lock.acquire()
+        threads = [
+            self._waiter('background', Priority.BACKGROUND),
+            self._waiter('command 1', Priority.COMMAND),
+            self._waiter('urgent', Priority.URGENT),
+            self._waiter('command 2', Priority.COMMAND),
+        ]
+        self.lock.release()
+        for thread in threads:
+            thread.join(1)
+        self.assertEqual(self.order, ['urgent', 'command 1', 'command 2', 'background'])
+
+        stats = self.lock.stats()
+        self.assertEqual(stats['acquisitions'], 5)
+        self.assertEqual(stats['COMMAND']['contended'], 2)
+        self.assertEqual(stats['URGENT']['contended'], 1)
+        self.assertTrue(stats['BACKGROUND']['wait_max'] > 0)
+
+    def test_reentrant(self):
+        with self.lock:
+            with self.lock:
+                pass
+            thread = threading.Thread(target=self.lock.acquire)
+            thread.start()
+            thread.join(0.05)
+            # still held by this thread
+            self.assertTrue(thread.is_alive())
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+
+    def test_release_not_owned(self):
+        self.assertRaises(RuntimeError, self.lock.release)
+
+
+class ThreadPriorityTestCase(unittest.TestCase):
+    def test_block_priority(self):
+        previous = get_thread_priority()
+        with thread_priority(Priority.URGENT):
+            self.assertEqual(get_thread_priority(), Priority.URGENT)
+        self.assertEqual(get_thread_priority(), previous)
+
+    def test_invalid_priority(self):
+        self.assertRaises(ValueError, set_thread_priority, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
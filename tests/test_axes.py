@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+
+from pybot.dspin import core, daisychain, emulator
+from pybot.dspin.defs import Direction, acc_calc, max_spd_calc
+
+__author__ = 'Eric Pascual'
+
+
+class AxisProxyTestCase(unittest.TestCase):
+    LENGTH = 4
+
+    def setUp(self):
+        emulator.configure(chain_length=self.LENGTH, time_scale=10.)
+        self.chain = daisychain.DaisyChain(self.LENGTH, core.DSPinSpiDev(), 11, 13, None)
+        self.chain.initialize()
+        self.chain.MAX_SPEED = max_spd_calc(4000)
+        self.chain.ACC = self.chain.DEC = acc_calc(20000)
+        self.axes = self.chain.axes()
+
+    def test_moves(self):
+        for i, axis in enumerate(self.axes):
+            axis.goto((i + 1) * 100, wait=False)
+        for axis in self.axes:
+            axis.wait_for_move_complete()
+        self.assertEqual(self.chain.ABS_POS, [100, 200, 300, 400])
+
+    def test_coalescing(self):
+        coalescer = self.chain.coalescer
+        coalescer.window = 0.05
+        coalescer.frames = coalescer.requests = 0
+        barrier = threading.Barrier(self.LENGTH) if hasattr(threading, 'Barrier') else None
+
+        def read(axis):
+            if barrier is not None:
+                barrier.wait()
+            axis.STATUS
+
+        threads = [threading.Thread(target=read, args=(axis,)) for axis in self.axes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(coalescer.requests, self.LENGTH)
+        self.assertEqual(coalescer.frames, 1)
+
+    def test_batch(self):
+        coalescer = self.chain.coalescer
+        coalescer.frames = coalescer.requests = 0
+        with self.chain.batch():
+            for axis in self.axes:
+                axis.MARK = 1000
+        self.assertEqual(coalescer.requests, self.LENGTH)
+        self.assertEqual(coalescer.frames, 1)
+        self.assertEqual(self.chain.MARK, [1000] * self.LENGTH)
+
+    def test_emergency_stop_in_aborted_transaction(self):
+        axis = self.axes[1]
+        axis.run(Direction.FWD, 1000)
+        self.assertTrue(axis.is_moving())
+        try:
+            with axis.transaction():
+                axis.emergency_stop()
+                raise RuntimeError('aborted')
+        except RuntimeError:
+            pass
+        self.assertFalse(axis.is_moving())
+
+    def test_emergency_stop_of_a_single_axis(self):
+        for axis in self.axes:
+            axis.run(Direction.FWD, 1000)
+        self.axes[2].emergency_stop()
+        self.assertEqual([axis.is_moving() for axis in self.axes], [True, True, False, True])
+        self.chain.hard_stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from pybot.dspin import core, daisychain, emulator
+from pybot.dspin.clocktune import ClockCalibrator, IntegrityMonitor
+
+__author__ = 'Eric Pascual'
+
+
+class ClockTuneTestCase(unittest.TestCase):
+    LENGTH = 3
+
+    def setUp(self):
+        self.board = emulator.configure(chain_length=self.LENGTH)
+        self.chain = daisychain.DaisyChain(self.LENGTH, core.DSPinSpiDev(), 11, 13, None)
+        self.chain.initialize()
+        self.spi = self.chain._spi
+
+    def test_calibration(self):
+        self.board.spi_speed_limit = 2000000
+        self.chain.MARK = [1, 2, 3]
+        calibrator = ClockCalibrator(self.chain)
+        self.assertEqual(calibrator.calibrate(rounds=2), 1000000)
+        self.assertEqual(self.spi.speed_hz, 1000000)
+        self.assertEqual(calibrator.passing_speeds(), [500000, 1000000, 2000000])
+        self.assertFalse(calibrator.results[-1].passed)
+        self.assertEqual(len(calibrator.report().splitlines()), 1 + len(calibrator.results))
+        # the test registers are restored
+        self.assertEqual(self.chain.MARK, [1, 2, 3])
+
+    def test_calibration_failure(self):
+        self.board.spi_speed_limit = 100000
+        initial_speed = self.spi.speed_hz
+        calibrator = ClockCalibrator(self.chain)
+        self.assertRaises(IOError, calibrator.calibrate, rounds=2)
+        self.assertEqual(self.spi.speed_hz, initial_speed)
+        self.assertEqual(calibrator.passing_speeds(), [])
+
+    def test_read_only_register(self):
+        self.assertRaises(ValueError, ClockCalibrator, self.chain, registers=['STATUS'])
+
+    def test_monitor_drop(self):
+        self.spi.speed_hz = 5000000
+        monitor = IntegrityMonitor(self.chain)
+        self.assertTrue(monitor.check())
+        self.assertTrue(monitor.check())
+        self.board.spi_speed_limit = 1000000
+        for _ in range(10):
+            monitor.check()
+        self.assertEqual(self.spi.speed_hz, 1000000)
+        self.assertEqual(monitor.drops, 4)
+        self.assertEqual(monitor.stats()['speed_hz'], 1000000)
+
+    def test_monitor_thread(self):
+        self.spi.speed_hz = 5000000
+        monitor = IntegrityMonitor(self.chain, period=0.01)
+        monitor.start()
+        self.addCleanup(monitor.stop)
+        self.assertTrue(monitor.running)
+        time.sleep(0.05)
+        self.board.spi_speed_limit = 2000000
+        limit = time.time() + 5
+        while self.spi.speed_hz > 2000000 and time.time() < limit:
+            time.sleep(0.01)
+        self.assertEqual(self.spi.speed_hz, 2000000)
+        monitor.stop()
+        self.assertFalse(monitor.running)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pybot.dspin import codec
+from pybot.dspin.codec import RegisterSetCodec, codec_for
+from pybot.dspin.defs import Register
+
+__author__ = 'Eric Pascual'
+
+
+def _reference_decode(reg, value_bytes):
+    # the generic decoding, as done before the codecs
+    raw_value = 0
+    for b in value_bytes:
+        raw_value = (raw_value << 8) | b
+    raw_value &= 0xffffffff >> (32 - reg.size)
+    if reg.signed and raw_value & (1 << (reg.size - 1)):
+        return raw_value - (1 << reg.size)
+    return raw_value
+
+
+def _samples(reg):
+    values = [0, 1, reg.mask, reg.mask >> 1, 0x5a5a5a & reg.mask]
+    if reg.signed:
+        values += [-1, -(reg.mask >> 1) - 1, -2000]
+    return values
+
+
+class RegisterCodecTestCase(unittest.TestCase):
+    REGISTERS = [getattr(Register, name) for name in Register.ALL]
+
+    def test_encode(self):
+        for reg in self.REGISTERS:
+            for value in _samples(reg):
+                self.assertEqual(codec_for(reg).encode(value), Register.value_as_bytes(reg, value),
+                                 '%s: %d' % (reg.name, value))
+
+    def test_encode_into(self):
+        for reg in self.REGISTERS:
+            for value in _samples(reg):
+                buf = bytearray(2 + 3 * reg.nbytes)
+                offset = codec_for(reg).encode_into(value, buf, 2, 3)
+                self.assertEqual(offset, 2 + 3 * reg.nbytes)
+                self.assertEqual(list(buf[2::3]), Register.value_as_bytes(reg, value),
+                                 '%s: %d' % (reg.name, value))
+
+    def test_decode(self):
+        for reg in self.REGISTERS:
+            for value in _samples(reg):
+                value_bytes = Register.value_as_bytes(reg, value)
+                expected = _reference_decode(reg, value_bytes)
+                self.assertEqual(codec_for(reg).decode(value_bytes), expected, reg.name)
+                self.assertEqual(codec_for(reg).decode([0xff] + value_bytes, 1), expected, reg.name)
+
+    def test_signed_round_trip(self):
+        abs_pos = codec_for(Register.ABS_POS)
+        self.assertEqual(abs_pos.encode(-1000), [0x3f, 0xfc, 0x18])
+        self.assertEqual(abs_pos.decode(abs_pos.encode(-2000)), -2000)
+
+
+class RegisterSetCodecTestCase(unittest.TestCase):
+    REGISTERS = (Register.STATUS, Register.ABS_POS, Register.SPEED, Register.MARK)
+
+    def _replies(self, count):
+        replies = []
+        for d in range(count):
+            reply = []
+            for reg in self.REGISTERS:
+                reply += [0] + Register.value_as_bytes(reg, -d * 1000 if reg.signed else d * 1000)
+            replies.append(bytearray(reply))
+        return replies
+
+    def _expected(self, reply):
+        offsets = RegisterSetCodec.get(self.REGISTERS).offsets
+        return [_reference_decode(reg, reply[s]) for reg, s in zip(self.REGISTERS, offsets)]
+
+    def test_decode(self):
+        set_codec = RegisterSetCodec.get(self.REGISTERS)
+        self.assertIs(RegisterSetCodec.get(self.REGISTERS), set_codec)
+        replies = self._replies(4)
+        self.assertEqual(set_codec.size, len(replies[0]))
+        for reply in replies:
+            self.assertEqual(set_codec.decode(reply), self._expected(reply))
+        self.assertEqual(set_codec.decode_replies(replies), sum((self._expected(r) for r in replies), []))
+
+    @unittest.skipIf(codec.numpy is None, 'NumPy not available')
+    def test_decode_array(self):
+        set_codec = RegisterSetCodec.get(self.REGISTERS)
+        replies = self._replies(RegisterSetCodec.NUMPY_MIN_DEVICES + 2)
+        expected = sum((self._expected(r) for r in replies), [])
+        self.assertEqual(set_codec.decode_array(replies).ravel().tolist(), expected)
+        self.assertEqual(set_codec.decode_replies(replies), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pybot.dspin import commands
+from pybot.dspin.commands import OpCodes
+from pybot.dspin.defs import Direction, Register
+
+__author__ = 'Eric Pascual'
+
+
+class EncodingTestCase(unittest.TestCase):
+    COMMANDS = [
+        commands.SetParam(Register.MARK, 1234),
+        commands.GetParam(Register.ABS_POS),
+        commands.Run(Direction.REV, 1000),
+        commands.StepClock(Direction.FWD),
+        commands.StepClock(Direction.REV),
+        commands.Move(Direction.REV, 2000),
+        commands.GoTo(-2000),
+        commands.GoToDir(Direction.FWD, 2000),
+        commands.GoUntil(),
+        commands.ReleaseSW(),
+    ]
+
+    def test_step_clock(self):
+        self.assertEqual(commands.StepClock(Direction.FWD).as_request(), [OpCodes.STEP_CLOCK | Direction.FWD])
+        buf = bytearray(1)
+        commands.StepClock(Direction.REV).encode_into(buf)
+        self.assertEqual(buf[0], OpCodes.STEP_CLOCK | Direction.REV)
+
+    def test_move_steps(self):
+        cmd = commands.Move(Direction.REV, -2000)
+        self.assertEqual(cmd.steps, 2000)
+        # reused commands are updated through the setter
+        cmd.steps = -100
+        self.assertEqual(cmd.as_request(), commands.Move(Direction.REV, 100).as_request())
+
+    def test_encode_into(self):
+        for cmd in self.COMMANDS:
+            request = cmd.as_request()
+            # interleaved, as in the frames of a chain of 2 devices
+            buf = bytearray(2 * len(request))
+            self.assertEqual(cmd.encode_into(buf, 1, 2), 1 + 2 * len(request))
+            self.assertEqual(list(buf[1::2]), request, cmd)
+            self.assertEqual(list(buf[0::2]), [0] * len(request), cmd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pybot.dspin import core, daisychain, emulator
+from pybot.dspin.completion import wait_all
+from pybot.dspin.defs import acc_calc, max_spd_calc
+
+__author__ = 'Eric Pascual'
+
+
+class CompletionTrackerTestCase(unittest.TestCase):
+    LENGTH = 3
+
+    def setUp(self):
+        emulator.configure(chain_length=self.LENGTH, time_scale=5.)
+        self.chain = daisychain.DaisyChain(self.LENGTH, core.DSPinSpiDev(), 11, 13, None, track_completion=True)
+        self.chain.initialize()
+        self.chain.MAX_SPEED = max_spd_calc(4000)
+        self.chain.ACC = self.chain.DEC = acc_calc(20000)
+
+    def tearDown(self):
+        tracker = self.chain.completion_tracker
+        tracker.cancel()
+        thread = tracker._thread
+        if thread is not None:
+            # let the polling thread notice there is nothing left to track
+            thread.join(1)
+
+    def test_completion_per_device(self):
+        completions = self.chain.goto([100, None, 20000], wait=False)
+        self.assertIsNone(completions[1])
+        self.assertTrue(completions[0].wait(5))
+        self.assertFalse(completions[2].done())
+        self.assertEqual(self.chain.ABS_POS[0], 100)
+        self.assertTrue(wait_all(completions, 10))
+        self.assertEqual(self.chain.ABS_POS, [100, 0, 20000])
+        self.assertFalse(completions[2].superseded)
+
+    def test_superseded(self):
+        first = self.chain.goto([20000, None, None], wait=False)[0]
+        second = self.chain.goto([100, None, None], wait=False)[0]
+        self.assertTrue(first.done())
+        self.assertTrue(first.superseded)
+        self.assertTrue(second.wait(10))
+
+    def test_polling_error(self):
+        read_registers = self.chain.read_registers
+        failures = []
+
+        def failing_read_registers(*args, **kwargs):
+            if not failures:
+                failures.append(1)
+                raise ValueError('corrupted reply')
+            return read_registers(*args, **kwargs)
+
+        self.chain.read_registers = failing_read_registers
+        completions = self.chain.goto([100, 200, 300], wait=False)
+        self.assertTrue(wait_all(completions, 5))
+        self.assertEqual(failures, [1])
+        # the tracker is still working
+        self.assertTrue(wait_all(self.chain.goto([0, 0, 0], wait=False), 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
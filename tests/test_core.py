@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import sys
+import threading
+import time
+import unittest
+
+from pybot.dspin import core, emulator, metrics, GPIO
+from pybot.dspin.defs import Direction, acc_calc, max_spd_calc
+
+__author__ = 'Eric Pascual'
+
+
+class TransferEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        emulator.configure(chain_length=1)
+
+    def _open(self, use_ioc):
+        spi = core.DSPinSpiDev(use_ioc=use_ioc)
+        spi.open()
+        self.addCleanup(spi.close)
+        return spi
+
+    def test_single_syscall_per_xfer(self):
+        spi = self._open(use_ioc=True)
+        syscalls = spi.syscalls
+        spi.xfer([0] * 9)
+        self.assertEqual(spi.syscalls - syscalls, 1)
+
+    def test_loop_fallback(self):
+        spi = self._open(use_ioc=False)
+        syscalls = spi.syscalls
+        spi.xfer([0] * 9)
+        self.assertEqual(spi.syscalls - syscalls, 9)
+
+    def test_segments(self):
+        for use_ioc, expected in ((True, 1), (False, 3)):
+            spi = self._open(use_ioc=use_ioc)
+            syscalls = spi.syscalls
+            spi.xfer_segments([0] * 9, 3)
+            self.assertEqual(spi.syscalls - syscalls, expected)
+
+
+class MoveTestCase(unittest.TestCase):
+    def setUp(self):
+        emulator.configure(chain_length=1, time_scale=10.)
+        self.dspin = core.DSPIN(core.DSPinSpiDev(), 11, 13)
+        self.dspin.initialize()
+        self.dspin.MAX_SPEED = max_spd_calc(4000)
+        self.dspin.ACC = self.dspin.DEC = acc_calc(20000)
+
+    def test_wait_for_move_complete(self):
+        self.dspin.move(Direction.FWD, 1000, wait=False)
+        self.assertTrue(self.dspin.is_moving())
+        self.dspin.wait_for_move_complete()
+        self.assertFalse(self.dspin.is_moving())
+        self.assertEqual(self.dspin.ABS_POS, 1000)
+
+    def test_wait_metrics_clock(self):
+        registry = metrics.MetricsRegistry()
+        self.dspin.enable_metrics(registry)
+        self.addCleanup(setattr, metrics, 'clock', metrics.clock)
+        # a stopped clock shows if the waits are not timed with it
+        metrics.clock = lambda: 100.
+        self.dspin.move(Direction.FWD, 1000)
+        self.assertEqual(self.dspin.metrics.wait.count, 1)
+        self.assertEqual(self.dspin.metrics.wait.sum, 0)
+
+    def test_no_timeout_without_estimate(self):
+        self.dspin.move(Direction.FWD, 1000, timeout=None)
+        self.dspin.go_home(timeout=None)
+        self.assertEqual(self.dspin.ABS_POS, 0)
+
+    def test_busyn_edge_not_lost(self):
+        # the move ends between the first check of the level and the wait for the edge
+        read = GPIO.input
+        reads = []
+
+        def slow_input(channel):
+            level = read(channel)
+            if not reads:
+                time.sleep(0.1)
+            reads.append(level)
+            return level
+
+        self.dspin.WAIT_CB_PERIOD = 1.
+        self.dspin.move(Direction.FWD, 20, wait=False)
+        GPIO.input = slow_input
+        try:
+            started = time.time()
+            self.dspin.wait_for_move_complete()
+            elapsed = time.time() - started
+        finally:
+            GPIO.input = read
+        self.assertEqual(reads[0], GPIO.LOW)
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(self.dspin.ABS_POS, 20)
+
+    def test_concurrent_commands(self):
+        spi = self.dspin._spi
+        frames = collections.Counter()
+        xfer_buffer = spi.xfer_buffer
+
+        def recording_xfer_buffer(length, seg_len=1):
+            frames[bytes(spi.tx_buffer[:length])] += 1
+            return xfer_buffer(length, seg_len)
+
+        spi.xfer_buffer = recording_xfer_buffer
+        count = 2000
+        if hasattr(sys, 'setswitchinterval'):
+            # interleave the threads as much as possible
+            self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+            sys.setswitchinterval(1e-6)
+
+        def send(position):
+            for _ in range(count):
+                self.dspin.goto(position, wait=False)
+
+        threads = [threading.Thread(target=send, args=(position,)) for position in (0x1111, 0x2222)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.dspin.hard_stop()
+
+        goto_frames = dict((frame, n) for frame, n in frames.items() if bytearray(frame)[0] == 0x60)
+        self.assertEqual(goto_frames, {
+            bytes(bytearray([0x60, 0x00, 0x11, 0x11])): count,
+            bytes(bytearray([0x60, 0x00, 0x22, 0x22])): count,
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import logging
+import sys
+import threading
+import time
+import unittest
+
+from pybot.dspin import commands, core, daisychain, emulator, metrics
+from pybot.dspin.defs import Direction, Register, Status, acc_calc, max_spd_calc
+
+__author__ = 'Eric Pascual'
+
+
+class _FormattingHandler(logging.Handler):
+    """ Formats the messages of the records, collecting the formatting errors. """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.formatted = []
+        self.errors = []
+
+    def emit(self, record):
+        try:
+            self.formatted.append(record.getMessage())
+        except (TypeError, ValueError) as e:
+            self.errors.append(e)
+
+
+class DaisyChainTestCase(unittest.TestCase):
+    LENGTH = 3
+
+    def setUp(self):
+        emulator.configure(chain_length=self.LENGTH, time_scale=10.)
+        self.chain = self._chain()
+
+    def _chain(self, **kwargs):
+        chain = daisychain.DaisyChain(self.LENGTH, core.DSPinSpiDev(), 11, 13, None, **kwargs)
+        chain.initialize()
+        chain.MAX_SPEED = max_spd_calc(4000)
+        chain.ACC = chain.DEC = acc_calc(20000)
+        return chain
+
+    @staticmethod
+    def _stop_tracking(chain):
+        tracker = chain.completion_tracker
+        tracker.cancel()
+        thread = tracker._thread
+        if thread is not None:
+            # let the polling thread notice there is nothing left to track
+            thread.join(1)
+
+    def test_goto(self):
+        self.chain.goto([100, None, -300])
+        self.assertEqual(self.chain.ABS_POS, [100, 0, -300])
+
+    def test_no_device_involved(self):
+        self.chain.MARK = [1, 2, 3]
+        self.chain.write_register(Register.MARK, [None] * self.LENGTH)
+        self.assertEqual(self.chain.MARK, [1, 2, 3])
+
+    def test_no_timeout_without_estimate(self):
+        tracking_chain = self._chain(track_completion=True)
+        self.addCleanup(self._stop_tracking, tracking_chain)
+        for chain in (self.chain, tracking_chain):
+            chain.move([Direction.FWD] * self.LENGTH, [100, 0, 50], timeout=None)
+            chain.go_mark(timeout=None)
+            chain.go_home(timeout=None)
+            chain.soft_stop(timeout=None)
+            self.assertEqual(chain.ABS_POS, [0] * self.LENGTH)
+
+    def test_debug_traces(self):
+        handler = _FormattingHandler()
+        logger = self.chain.logger
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.DEBUG)
+
+        self.chain.go_home(timeout=None)
+        self.chain.go_mark(timeout=None)
+        self.chain.soft_hi_Z(timeout=None)
+        self.assertTrue(handler.formatted)
+        self.assertEqual(handler.errors, [])
+
+    def test_concurrent_commands(self):
+        spi = self.chain._spi
+        frames = collections.Counter()
+        xfer_buffer = spi.xfer_buffer
+
+        def recording_xfer_buffer(length, seg_len=1):
+            frames[bytes(spi.tx_buffer[:length])] += 1
+            return xfer_buffer(length, seg_len)
+
+        spi.xfer_buffer = recording_xfer_buffer
+        count = 2000
+        if hasattr(sys, 'setswitchinterval'):
+            # interleave the threads as much as possible
+            self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+            sys.setswitchinterval(1e-6)
+
+        def send(device, position):
+            positions = [None] * self.LENGTH
+            positions[device] = position
+            for _ in range(count):
+                self.chain.goto(positions, wait=False)
+
+        jobs = ((0, 0x1111), (2, 0x2222))
+        threads = [threading.Thread(target=send, args=job) for job in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.chain.hard_stop()
+
+        expected = {}
+        for device, position in jobs:
+            frame = bytearray(commands.GoTo.size * self.LENGTH)
+            commands.GoTo(position).encode_into(frame, device, self.LENGTH)
+            expected[bytes(frame)] = count
+        goto_frames = dict((frame, n) for frame, n in frames.items() if frame in expected)
+        self.assertEqual(goto_frames, expected)
+
+
+class EmergencyStopTestCase(unittest.TestCase):
+    LENGTH = 3
+
+    def setUp(self):
+        emulator.configure(chain_length=self.LENGTH, time_scale=10.)
+        self.chain = daisychain.DaisyChain(self.LENGTH, core.DSPinSpiDev(), 11, 13, None)
+        self.chain.initialize()
+        self.chain.run([Direction.FWD] * self.LENGTH, [1000] * self.LENGTH)
+        self.assertFalse(self._stopped())
+
+    def _stopped(self, hi_z=False):
+        return all(
+            not status & Status.MOT_STATUS and bool(status & Status.HiZ) == hi_z for status in self.chain.STATUS
+        )
+
+    def test_latency(self):
+        self.chain.enable_metrics(metrics.MetricsRegistry())
+        triggered_at = metrics.clock()
+        latency = self.chain.emergency_stop(triggered_at=triggered_at)
+        self.assertTrue(0 < latency <= metrics.clock() - triggered_at)
+        self.assertEqual(self.chain.last_stop_latency, latency)
+        self.assertEqual(self.chain.metrics.stop_latency.count, 1)
+        self.assertTrue(self._stopped())
+
+    def test_hi_z(self):
+        self.chain.emergency_stop(hi_z=True)
+        self.assertTrue(self._stopped(hi_z=True))
+
+    def test_transaction_bypassed(self):
+        try:
+            with self.chain.transaction():
+                self.chain.hard_stop()
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertTrue(self._stopped())
+
+    def test_queue_bypassed(self):
+        spi = self.chain._spi
+        opcodes = []
+        xfer_buffer = spi.xfer_buffer
+
+        def recording_xfer_buffer(length, seg_len=1):
+            opcodes.append(spi.tx_buffer[0])
+            return xfer_buffer(length, seg_len)
+
+        spi.xfer_buffer = recording_xfer_buffer
+
+        def start(target):
+            count = spi.lock.waiting()
+            thread = threading.Thread(target=target)
+            thread.start()
+            while spi.lock.waiting() == count:
+                time.sleep(0.001)
+            return thread
+
+        with spi.lock:
+            threads = [
+                start(lambda: self.chain.goto([100] * self.LENGTH, wait=False)),
+                start(self.chain.emergency_stop),
+            ]
+        for thread in threads:
+            thread.join(1)
+        self.assertEqual(opcodes, [commands.OpCodes.HARD_STOP, commands.OpCodes.GOTO])
+
+
+if __name__ == '__main__':
+    unittest.main()
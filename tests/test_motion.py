@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pybot.dspin import motion
+from pybot.dspin.motion import ProfileParameters, move_duration, profile_position, trapezoid
+
+__author__ = 'Eric Pascual'
+
+
+class TrapezoidTestCase(unittest.TestCase):
+    def test_trapezoidal_profile(self):
+        phases = trapezoid(1000, 0, 0, 100, 100, 100)
+        self.assertEqual([p[2] for p in phases], [100, 0, -100])
+        self.assertAlmostEqual(profile_position(phases, sum(p[0] for p in phases)), 1000)
+
+    def test_triangular_profile(self):
+        phases = trapezoid(10, 0, 0, 100, 100, 100)
+        self.assertEqual([p[2] for p in phases], [100, -100])
+        self.assertAlmostEqual(profile_position(phases, sum(p[0] for p in phases)), 10)
+
+    def test_null_max_speed(self):
+        params = ProfileParameters.from_registers(0, 0, 0, 0)
+        self.assertEqual(params.v_max, motion.V_MAX_MIN)
+        self.assertTrue(move_duration(100, params) > 0)
+        self.assertTrue(move_duration(100, (0., 0., 1., 1.)) > 0)
+
+    @unittest.skipIf(motion.numpy is None, 'NumPy not available')
+    def test_vectorized(self):
+        numpy = motion.numpy
+        distances = numpy.array([1000, 10, 100])
+        params = ProfileParameters.from_registers(*[numpy.array([0, 0, 0])] * 4)
+        expected = [move_duration(d, ProfileParameters.from_registers(0, 0, 0, 0)) for d in distances]
+        for value, reference in zip(motion.move_durations(distances, params), expected):
+            self.assertAlmostEqual(value, reference)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from pybot.dspin import core, daisychain, emulator, planner
+from pybot.dspin.completion import wait_all
+from pybot.dspin.defs import acc_calc, max_spd_calc
+
+numpy = planner.numpy
+
+__author__ = 'Eric Pascual'
+
+
+@unittest.skipIf(numpy is None, 'NumPy not available')
+class LinearMovePlannerTestCase(unittest.TestCase):
+    LENGTH = 4
+    TARGETS = [8000, 1000, 0, -3000]
+    MASK = [True, True, False, True]
+
+    def setUp(self):
+        emulator.configure(chain_length=self.LENGTH, time_scale=10.)
+        self.chain = daisychain.DaisyChain(self.LENGTH, core.DSPinSpiDev(), 11, 13, None, track_completion=True)
+        self.chain.initialize()
+        self.chain.MAX_SPEED = max_spd_calc(2000)
+        self.chain.ACC = self.chain.DEC = acc_calc(5000)
+        self.planner = planner.LinearMovePlanner(self.chain)
+
+    def test_plan(self):
+        move = self.planner.plan(numpy.array(self.TARGETS), numpy.zeros(self.LENGTH), numpy.array(self.MASK))
+        self.assertEqual(move.mask.tolist(), self.MASK)
+        self.assertEqual(move.distances.tolist(), [8000, 1000, 0, 3000])
+        for values, limit in zip((move.max_speed, move.acc, move.dec), self.planner.limits[1:]):
+            self.assertTrue(numpy.all(values <= limit))
+        # the longest move uses the nominal profile
+        self.assertEqual(move.max_speed[0], max_spd_calc(2000))
+        self.assertEqual(move.acc[0], acc_calc(5000))
+        durations = move.durations[move.mask]
+        self.assertTrue(durations.max() - durations.min() < 0.05 * move.duration, durations)
+        self.assertEqual(move.durations[2], 0)
+
+    def test_no_move(self):
+        self.assertIsNone(self.planner.goto(numpy.zeros(self.LENGTH, dtype=int)))
+        self.assertEqual(self.planner.last_move.duration, 0)
+
+    def test_arrivals(self):
+        ends = {}
+        started = time.time()
+        completions = self.planner.goto(numpy.array(self.TARGETS), wait=False, mask=numpy.array(self.MASK))
+        self.assertIsNone(completions[2])
+        for completion in completions:
+            if completion is not None:
+                completion.add_done_callback(lambda c: ends.__setitem__(c.device, time.time() - started))
+        self.assertTrue(wait_all(completions, 10))
+        self.assertEqual(self.chain.ABS_POS, [8000, 1000, 0, -3000])
+        # the shortest move would end much sooner with the nominal profile
+        self.assertTrue(max(ends.values()) - min(ends.values()) < 0.1 * max(ends.values()), ends)
+
+    def test_restore(self):
+        self.planner.goto(numpy.array(self.TARGETS), mask=numpy.array(self.MASK))
+        self.assertNotEqual(self.chain.MAX_SPEED[1], max_spd_calc(2000))
+        self.planner.restore()
+        self.assertEqual(self.chain.MAX_SPEED, [max_spd_calc(2000)] * self.LENGTH)
+        self.assertEqual(self.chain.ACC, [acc_calc(5000)] * self.LENGTH)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pybot.dspin.program import MotionProgram, ProgramError
+
+__author__ = 'Eric Pascual'
+
+
+class MotionProgramTestCase(unittest.TestCase):
+    def test_frames_merging(self):
+        program = MotionProgram(2)
+        program.goto([100, None]).goto([None, 200])
+        self.assertEqual(len(program), 1)
+        program.wait()
+        program.goto(0)
+        self.assertEqual(len(program), 3)
+
+    def test_no_device_involved(self):
+        program = MotionProgram(2)
+        self.assertRaises(ValueError, program.goto, [None, None])
+        self.assertEqual(len(program), 0)
+
+    def test_parse_errors(self):
+        with self.assertRaises(ProgramError) as context:
+            MotionProgram.parse('devices 2\ngoto 10 20\ngoto - -\n')
+        self.assertEqual(context.exception.line_num, 3)
+        self.assertIn('no device involved', str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pybot.dspin import daisychain, emulator, recorder
+from pybot.dspin.defs import Direction, max_spd_calc, spd_calc
+
+__author__ = 'Eric Pascual'
+
+
+class RecorderTestCase(unittest.TestCase):
+    LENGTH = 3
+
+    def setUp(self):
+        emulator.configure(chain_length=self.LENGTH)
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.path = os.path.join(tmp_dir, 'traffic.bin')
+
+    def _record(self):
+        with recorder.TrafficRecorder(self.path, buffer_size=256) as rec:
+            chain = daisychain.DaisyChain(self.LENGTH, recorder.RecordingSpiDev(rec), 11, 13, None)
+            chain.initialize()
+            chain.MAX_SPEED = [max_spd_calc(1000), max_spd_calc(2000), max_spd_calc(3000)]
+            chain.MARK = [1, 2, 3]
+            self.assertEqual(chain.MARK, [1, 2, 3])
+            return rec.records
+
+    def test_records(self):
+        count = self._record()
+        _, records = recorder.read_records(self.path)
+        records = list(records)
+        self.assertEqual(len(records), count)
+        self.assertTrue(all(len(r.request) == len(r.reply) for r in records))
+
+    def test_decoding(self):
+        self._record()
+        _, records = recorder.read_records(self.path)
+        decoder = recorder.TrafficDecoder(self.LENGTH)
+        marks = [op for op in decoder.decode(records) if op.command == 'SET_PARAM' and op.register.name == 'MARK']
+        self.assertEqual(sorted((op.device, op.value) for op in marks), [(0, 1), (1, 2), (2, 3)])
+        self.assertEqual(decoder.errors, 0)
+
+    def test_motion_parameters(self):
+        with recorder.TrafficRecorder(self.path, buffer_size=256) as rec:
+            chain = daisychain.DaisyChain(self.LENGTH, recorder.RecordingSpiDev(rec), 11, 13, None)
+            chain.initialize()
+            chain.goto([-2000, 100, None], wait=False)
+            chain.move([Direction.REV, None, Direction.FWD], [None, None, 300], wait=False)
+            chain.run([Direction.FWD, None, None], [500, None, None])
+            chain.hard_stop()
+        _, records = recorder.read_records(self.path)
+        decoder = recorder.TrafficDecoder(self.LENGTH)
+        ops = [
+            (op.device, op.command, op.value) for op in decoder.decode(records)
+            if op.command in ('GOTO', 'MOVE', 'RUN')
+        ]
+        self.assertEqual(ops, [
+            (0, 'GOTO', -2000), (1, 'GOTO', 100), (2, 'MOVE', 300), (0, 'RUN', spd_calc(500))
+        ])
+        self.assertEqual(decoder.errors, 0)
+
+    def test_replay_on_emulator(self):
+        self._record()
+        emulator.configure(chain_length=self.LENGTH)
+        _, records = recorder.read_records(self.path)
+        replayer = recorder.Replayer(records, speed=0)
+        self.assertIsInstance(replayer._spi, recorder.EmulatedBus)
+        self.assertEqual(replayer.run(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pybot.dspin import core, daisychain, emulator, metrics
+from pybot.dspin.defs import Direction, acc_calc, max_spd_calc
+from pybot.dspin.server import MotionClient, MotionServer, ServerError
+
+__author__ = 'Eric Pascual'
+
+
+class MotionServerTestCase(unittest.TestCase):
+    LENGTH = 3
+
+    def setUp(self):
+        emulator.configure(chain_length=self.LENGTH, time_scale=10.)
+        chain = daisychain.DaisyChain(self.LENGTH, core.DSPinSpiDev(), 11, 13, None)
+        chain.initialize()
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'dspin.sock')
+        server = MotionServer(chain, path)
+        server.start()
+        self.addCleanup(server.stop)
+        self.client = MotionClient(path)
+        self.addCleanup(self.client.close)
+        self.devices = [self.client.dspin(i) for i in range(self.LENGTH)]
+        for device in self.devices:
+            device.MAX_SPEED = max_spd_calc(4000)
+            device.ACC = device.DEC = acc_calc(20000)
+
+    def test_registers(self):
+        self.assertEqual(self.client.device_count, self.LENGTH)
+        self.assertEqual([d.MAX_SPEED for d in self.devices], [max_spd_calc(4000)] * self.LENGTH)
+
+    def test_moves(self):
+        for i, device in enumerate(self.devices):
+            device.goto((i + 1) * 100, wait=False)
+        for device in self.devices:
+            device.wait_for_move_complete()
+        self.assertEqual([d.ABS_POS for d in self.devices], [100, 200, 300])
+
+    def test_emergency_stop(self):
+        device = self.devices[0]
+        device.run(Direction.FWD, 1000)
+        self.assertTrue(device.is_moving())
+        latency = device.emergency_stop(triggered_at=metrics.clock())
+        self.assertFalse(device.is_moving())
+        self.assertTrue(0 <= latency < 1)
+
+    def test_emergency_stop_in_aborted_transaction(self):
+        device = self.devices[1]
+        device.run(Direction.FWD, 1000)
+        try:
+            with device.transaction():
+                device.emergency_stop()
+                raise RuntimeError('aborted')
+        except RuntimeError:
+            pass
+        self.assertFalse(device.is_moving())
+
+    def test_errors(self):
+        self.assertRaises(ValueError, self.client.dspin, self.LENGTH)
+        self.assertRaises(ServerError, self.client.xfer, self.LENGTH + 4, [0])
+        self.assertRaises(core.UnsupportedOperation, self.devices[0].standby)
+
+
+if __name__ == '__main__':
+    unittest.main()
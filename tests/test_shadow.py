@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pybot.dspin import core, daisychain, emulator
+from pybot.dspin.defs import Register
+from pybot.dspin.shadow import RegisterShadow
+
+__author__ = 'Eric Pascual'
+
+
+class RegisterShadowTestCase(unittest.TestCase):
+    def test_hit_miss(self):
+        shadow = RegisterShadow(2)
+        self.assertFalse(shadow.is_current(0, Register.MAX_SPEED, 0x20))
+        shadow.update(0, Register.MAX_SPEED, 0x20)
+        self.assertTrue(shadow.is_current(0, Register.MAX_SPEED, 0x20))
+        self.assertFalse(shadow.is_current(0, Register.MAX_SPEED, 0x21))
+        self.assertFalse(shadow.is_current(1, Register.MAX_SPEED, 0x20))
+        self.assertEqual(shadow.stats(), {'hits': 1, 'misses': 3, 'hit_ratio': 0.25})
+
+    def test_not_shadowed(self):
+        shadow = RegisterShadow()
+        for reg in (Register.ABS_POS, Register.MARK, Register.STATUS):
+            shadow.update(0, reg, 1)
+            self.assertIsNone(shadow.get(0, reg))
+
+    def test_invalidate(self):
+        shadow = RegisterShadow(2)
+        shadow.update(0, Register.ACC, 1)
+        shadow.update(1, Register.ACC, 2)
+        shadow.invalidate([1])
+        self.assertEqual(shadow.get(0, Register.ACC), 1)
+        self.assertIsNone(shadow.get(1, Register.ACC))
+        shadow.invalidate()
+        self.assertIsNone(shadow.get(0, Register.ACC))
+
+
+class ShadowedWritesTestCase(unittest.TestCase):
+    def setUp(self):
+        emulator.configure(chain_length=3)
+        self.chain = daisychain.DaisyChain(3, core.DSPinSpiDev(), 11, 13, None, shadow=True)
+        self.chain.initialize()
+        # another controller writing the same devices without us knowing
+        self.other = daisychain.DaisyChain(3, core.DSPinSpiDev(), 11, 13, None)
+        self.other._spi.open()
+        self.addCleanup(self.other._spi.close)
+
+    def test_skipped_writes(self):
+        shadow = self.chain.shadow
+        self.chain.MAX_SPEED = [0x20, 0x21, 0x22]
+        self.other.MAX_SPEED = [0x30, 0x30, 0x30]
+        shadow.reset_counters()
+        # only the last device is written, since the other ones are believed to be up to date
+        self.chain.MAX_SPEED = [0x20, 0x21, 0x23]
+        self.assertEqual(shadow.stats()['hits'], 2)
+        self.assertEqual(self.chain.MAX_SPEED, [0x30, 0x30, 0x23])
+
+    def test_volatile_registers_written(self):
+        self.chain.MARK = [1, 2, 3]
+        self.other.MARK = [0, 0, 0]
+        self.chain.MARK = [1, 2, 3]
+        self.assertEqual(self.chain.MARK, [1, 2, 3])
+
+    def test_invalidation(self):
+        self.chain.ACC = [0x10, 0x10, 0x10]
+        self.other.ACC = [0x20, 0x20, 0x20]
+        self.chain.invalidate_shadow([1])
+        self.chain.ACC = [0x10, 0x10, 0x10]
+        self.assertEqual(self.chain.ACC, [0x20, 0x10, 0x20])
+        # resetting the devices forgets everything
+        self.chain.reset_device()
+        self.assertIsNone(self.chain.shadow.get(0, Register.ACC))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pybot.dspin import core, daisychain, emulator, snapshot
+from pybot.dspin.defs import Register
+from pybot.dspin.snapshot import ALL_REGISTERS, RegisterSnapshot, as_register
+
+__author__ = 'Eric Pascual'
+
+
+class RegisterSnapshotTestCase(unittest.TestCase):
+    def test_access(self):
+        snap = RegisterSnapshot(['ABS_POS', Register.MARK], 2, [1, 2, 3, 4])
+        self.assertEqual(snap[1, Register.ABS_POS], 3)
+        self.assertEqual(snap[0, 'MARK'], 2)
+        self.assertEqual(snap[Register.MARK], [2, 4])
+        snap[1, 'MARK'] = 5
+        self.assertEqual(snap.device(1), [('ABS_POS', 3), ('MARK', 5)])
+        self.assertRaises(KeyError, lambda: snap[Register.ACC])
+        self.assertRaises(ValueError, RegisterSnapshot, ['ABS_POS'], 2, [1])
+
+    def test_as_register(self):
+        self.assertIs(as_register('ACC'), Register.ACC)
+        self.assertIs(as_register(Register.ACC), Register.ACC)
+        self.assertRaises(ValueError, as_register, 'FOO')
+
+    @unittest.skipIf(snapshot.numpy is None, 'NumPy not available')
+    def test_as_numpy(self):
+        snap = RegisterSnapshot(['ABS_POS', 'MARK'], 2, [1, 2, -3, 4])
+        self.assertEqual(snap.as_numpy()['ABS_POS'].tolist(), [1, -3])
+
+
+class ReadRegistersTestCase(unittest.TestCase):
+    LENGTH = 3
+
+    def setUp(self):
+        emulator.configure(chain_length=self.LENGTH)
+        self.chain = daisychain.DaisyChain(self.LENGTH, core.DSPinSpiDev(), 11, 13, None)
+        self.chain.initialize()
+        self.chain.ABS_POS = [-2000, 0, 2000]
+        self.chain.MARK = [1, 2, 3]
+
+    def test_decoding(self):
+        snap = self.chain.read_registers(['ABS_POS', Register.MARK, Register.STATUS])
+        self.assertEqual(len(snap), self.LENGTH)
+        self.assertEqual(snap[Register.ABS_POS], [-2000, 0, 2000])
+        self.assertEqual(snap['MARK'], [1, 2, 3])
+        self.assertEqual(snap[Register.STATUS], self.chain.read_register(Register.STATUS))
+
+    def test_all_registers(self):
+        snap = self.chain.snapshot()
+        self.assertEqual(snap.registers, ALL_REGISTERS)
+        # one by one reads, excluding the registers changed by the reads
+        for reg in ALL_REGISTERS:
+            if reg not in (Register.STATUS, Register.SPEED):
+                self.assertEqual(snap[reg], self.chain.read_register(reg), reg.name)
+
+    def test_single_device(self):
+        emulator.configure(chain_length=1)
+        dspin = core.DSPIN(core.DSPinSpiDev(), 11, 13)
+        dspin.initialize()
+        dspin.ABS_POS = -1234
+        self.assertIn(('ABS_POS', -1234), dspin.get_all_registers())
+
+
+if __name__ == '__main__':
+    unittest.main()
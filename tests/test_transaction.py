@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+
+from pybot.dspin import core, daisychain, emulator, metrics
+from pybot.dspin.defs import acc_calc, max_spd_calc
+
+__author__ = 'Eric Pascual'
+
+
+class _Abort(Exception):
+    pass
+
+
+class TransactionTestCase(unittest.TestCase):
+    LENGTH = 3
+
+    def setUp(self):
+        emulator.configure(chain_length=self.LENGTH, time_scale=10.)
+        self.chain = self._chain()
+
+    def _chain(self, **kwargs):
+        chain = daisychain.DaisyChain(self.LENGTH, core.DSPinSpiDev(), 11, 13, None, **kwargs)
+        chain.initialize()
+        chain.enable_metrics(metrics.MetricsRegistry())
+        return chain
+
+    def _transfers(self, chain=None):
+        return (chain or self.chain)._spi.metrics.transfers.value
+
+    def test_single_burst(self):
+        chain = self.chain
+        before = self._transfers()
+        with chain.transaction() as tx:
+            chain.MAX_SPEED = max_spd_calc(1000)
+            chain.ACC = [acc_calc(1000), None, acc_calc(2000)]
+            chain.MAX_SPEED = max_spd_calc(2000)
+            chain.goto([100, 200, None], wait=False)
+            self.assertEqual(self._transfers(), before)
+            self.assertEqual(tx.collapsed, self.LENGTH)
+        self.assertEqual(self._transfers(), before + 1)
+        self.assertEqual(chain.MAX_SPEED, [max_spd_calc(2000)] * self.LENGTH)
+        self.assertEqual(chain.ACC[0::2], [acc_calc(1000), acc_calc(2000)])
+        chain.wait_for_move_complete()
+        self.assertEqual(chain.ABS_POS, [100, 200, 0])
+
+    def test_abort(self):
+        chain = self.chain
+        chain.MARK = [1, 2, 3]
+        before = self._transfers()
+        try:
+            with chain.transaction():
+                chain.MARK = [4, 5, 6]
+                chain.goto([100, 200, 300], wait=False)
+                raise _Abort()
+        except _Abort:
+            pass
+        self.assertEqual(self._transfers(), before)
+        self.assertEqual(chain.MARK, [1, 2, 3])
+        self.assertEqual(chain.ABS_POS, [0, 0, 0])
+
+    def test_nested(self):
+        chain = self.chain
+        before = self._transfers()
+        with chain.transaction() as outer:
+            chain.MARK = [1, 2, 3]
+            with chain.transaction() as inner:
+                self.assertIs(inner, outer)
+                chain.ABS_POS = [4, 5, 6]
+            self.assertEqual(self._transfers(), before)
+        self.assertEqual(self._transfers(), before + 1)
+        self.assertEqual(chain.MARK, [1, 2, 3])
+
+    def test_other_threads_not_deferred(self):
+        chain = self.chain
+        with chain.transaction():
+            chain.MARK = [1, 2, 3]
+            thread = threading.Thread(target=setattr, args=(chain, 'ABS_POS', [4, 5, 6]))
+            thread.start()
+            thread.join(1)
+            self.assertEqual(chain.ABS_POS, [4, 5, 6])
+        self.assertEqual(chain.MARK, [1, 2, 3])
+
+    def test_shadowed_writes_skipped(self):
+        chain = self._chain(shadow=True)
+        chain.ACC = acc_calc(1000)
+        before = self._transfers(chain)
+        with chain.transaction():
+            chain.ACC = acc_calc(1000)
+        self.assertEqual(self._transfers(chain), before)
+
+    def test_single_device(self):
+        emulator.configure(chain_length=1)
+        dspin = core.DSPIN(core.DSPinSpiDev(), 11, 13)
+        dspin.initialize()
+        with dspin.transaction():
+            dspin.MARK = 10
+            dspin.ABS_POS = -10
+            self.assertEqual(dspin.MARK, 0)
+        self.assertEqual((dspin.MARK, dspin.ABS_POS), (10, -10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pybot.dspin import commands, core, daisychain, emulator, vectorized
+from pybot.dspin.defs import Direction, GoUntilAction, Register
+
+numpy = vectorized.numpy
+
+__author__ = 'Eric Pascual'
+
+
+def _list_frame(cmds):
+    # the requests encoded by the list based API, NOPs for the devices not involved
+    return [cmd.as_request() if cmd is not None else [commands.OpCodes.NOP] * 4 for cmd in cmds]
+
+
+@unittest.skipIf(numpy is None, 'NumPy not available')
+class FramesTestCase(unittest.TestCase):
+    POSITIONS = [-2000, 0, 2000, 0x1fffff]
+    MASK = [True, False, True, True]
+
+    def test_goto(self):
+        frame = vectorized.goto_frame(numpy.array(self.POSITIONS), numpy.array(self.MASK))
+        expected = _list_frame([commands.GoTo(p) if m else None for p, m in zip(self.POSITIONS, self.MASK)])
+        self.assertEqual(frame.tolist(), expected)
+
+    def test_move(self):
+        directions = [Direction.FWD, Direction.REV, Direction.REV, Direction.FWD]
+        frame = vectorized.move_frame(numpy.array(directions), numpy.array(self.POSITIONS))
+        self.assertEqual(frame.tolist(), _list_frame([commands.Move(d, s) for d, s in zip(directions, self.POSITIONS)]))
+
+    def test_run(self):
+        speeds = [1., 500., 1000.5, 15000.]
+        frame = vectorized.run_frame(Direction.REV, numpy.array(speeds))
+        self.assertEqual(frame.tolist(), _list_frame([commands.Run(Direction.REV, s) for s in speeds]))
+
+    def test_go_until(self):
+        speeds = [100., 200.]
+        frame = vectorized.go_until_frame(GoUntilAction.COPY, Direction.FWD, numpy.array(speeds))
+        expected = _list_frame([commands.GoUntil(GoUntilAction.COPY, Direction.FWD, s) for s in speeds])
+        self.assertEqual(frame.tolist(), expected)
+
+    def test_set_param(self):
+        values = [1, 2, 3]
+        frame = vectorized.set_param_frame(Register.MARK, numpy.array(values), [False, True, True])
+        expected = _list_frame([None] + [commands.SetParam(Register.MARK, v) for v in values[1:]])
+        self.assertEqual(frame.tolist(), expected)
+
+    def test_checks(self):
+        self.assertRaises(ValueError, vectorized.move_frame, numpy.array([2, 2]), numpy.array([1, 1]))
+        self.assertRaises(ValueError, vectorized.run_frame, Direction.FWD, numpy.array([0., 100.]))
+        self.assertRaises(ValueError, vectorized.goto_frame, numpy.array([1, 2]), [True])
+
+
+@unittest.skipIf(numpy is None, 'NumPy not available')
+class ChainTestCase(unittest.TestCase):
+    LENGTH = 4
+
+    def setUp(self):
+        emulator.configure(chain_length=self.LENGTH, time_scale=10.)
+        self.chain = daisychain.DaisyChain(self.LENGTH, core.DSPinSpiDev(), 11, 13, None)
+        self.chain.initialize()
+
+    def test_arrays_and_lists(self):
+        self.chain.goto(numpy.array([100, -200, 300, 400]), mask=numpy.array([True, True, False, True]))
+        self.assertEqual(self.chain.ABS_POS, [100, -200, 0, 400])
+        self.chain.goto([None, None, 300, None])
+        self.assertEqual(self.chain.ABS_POS, [100, -200, 300, 400])
+
+
+if __name__ == '__main__':
+    unittest.main()